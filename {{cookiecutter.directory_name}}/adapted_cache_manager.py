@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+
+This module is used by the Chewie-NS to inspect and prune the
+cache with the adapted loci used by the schema compressor.
+
+The compressor removes the least recently used loci when the
+cache is larger than ``ADAPTED_CACHE_MAX_SIZE`` after each
+schema is compressed, so pruning is only needed to free space
+or to remove loci that are no longer used.
+
+Expected input
+--------------
+
+It is necessary to specify the execution mode through the
+following argument:
+
+- ``-m``, ``mode`` :
+
+    - ``info`` prints the number of loci in the cache, their
+      size and the dates of the least and most recently used.
+    - ``prune`` removes the least recently used loci until the
+      cache is smaller than ``--ms`` and the loci that were not
+      used in the last ``--ma`` days.
+    - ``clear`` removes all loci.
+
+- ``--ms``, ``max_size`` :
+
+    - e.g.: ``2048`` (MB)
+
+- ``--ma``, ``max_age`` :
+
+    - e.g.: ``30`` (days)
+
+Code documentation
+------------------
+"""
+
+
+import logging
+import argparse
+import datetime as dt
+
+from app.utils import adapted_cache
+
+
+logfile = './log_files/adapted_cache_manager.log'
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                    datefmt='%Y-%m-%dT%H:%M:%S',
+                    filename=logfile)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-m', type=str,
+                        dest='mode', required=True,
+                        choices=['info', 'prune', 'clear'],
+                        help='Execution mode.')
+
+    parser.add_argument('--ms', type=int, required=False,
+                        dest='max_size', default=None,
+                        help='Maximum size of the cache in MB '
+                             '(only relevant for the "prune" mode). '
+                             'Uses ADAPTED_CACHE_MAX_SIZE by default.')
+
+    parser.add_argument('--ma', type=float, required=False,
+                        dest='max_age', default=None,
+                        help='Remove loci that were not used in this '
+                             'number of days (only relevant for the '
+                             '"prune" mode).')
+
+    args = parser.parse_args()
+
+    return [args.mode, args.max_size, args.max_age]
+
+
+def cache_info():
+    """ Prints the number of loci in the cache, their total
+        size and the dates of the least and most recently
+        used loci.
+    """
+
+    entries = adapted_cache.store.entries()
+    print('Cache directory: {0}'.format(adapted_cache.store.directory))
+    print('Loci: {0}'.format(len(entries)))
+    print('Size: {0:.1f} MB (limit {1:.1f} MB)'.format(sum(e[1] for e in entries) / 1048576,
+                                                       adapted_cache.store.max_size / 1048576))
+    if len(entries) > 0:
+        print('Least recently used: {0}'.format(dt.datetime.fromtimestamp(entries[0][2]).isoformat()))
+        print('Most recently used: {0}'.format(dt.datetime.fromtimestamp(entries[-1][2]).isoformat()))
+
+
+def main(mode, max_size, max_age):
+
+    if mode == 'info':
+        cache_info()
+        return
+
+    if mode == 'clear':
+        max_size = 0
+    elif max_size is not None:
+        max_size = max_size * 1048576
+
+    if max_age is not None:
+        max_age = max_age * 86400
+
+    removed, freed = adapted_cache.prune(max_size, max_age)
+    print('Removed {0} loci ({1:.1f} MB) from the adapted loci '
+          'cache.'.format(removed, freed / 1048576))
+    logging.info('Removed {0} loci ({1} bytes) from the adapted loci '
+                 'cache.'.format(removed, freed))
+
+
+if __name__ == '__main__':
+
+    args = parse_arguments()
+
+    main(args[0], args[1], args[2])
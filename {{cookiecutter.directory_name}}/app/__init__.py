@@ -107,6 +107,10 @@ def create_app(config_class=Config):
     from werkzeug.middleware.proxy_fix import ProxyFix
     app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_for=1, x_host=1)
 
+    # Count and time the queries sent to Virtuoso
+    from app.utils.sparql_metrics import metrics
+    metrics.init_app(app)
+
     from app.api import blueprint as api_bp
     app.register_blueprint(api_bp)
     
@@ -49,7 +49,7 @@ from flask import (
     current_app, render_template,
     flash, redirect,
     url_for, request,
-    make_response, Response,
+    make_response, Response, abort,
     stream_with_context, send_from_directory,
     jsonify)
 
@@ -59,6 +59,13 @@ from werkzeug.utils import secure_filename
 import rm_functions
 from app.models import User, Role
 from app.utils import wrappers as w
+from app.utils import id_allocator
+from app.utils import query_cache as qc
+from app.utils import lengths_store
+from app.utils import stats_cache
+from app.utils import user_names
+from app.utils import sparql_metrics
+from app.utils import sequence_index
 from app.utils import sparql_queries as sq
 from app.utils import auxiliary_functions as aux
 from app import (db, celery, login_manager, mail,
@@ -66,7 +73,6 @@ from app import (db, celery, login_manager, mail,
 
 from app.api import api, blueprint
 
-from SPARQLWrapper import SPARQLWrapper
 
 # Get the error handlers to work with Flask-restplus
 jwtm._set_error_handler_callbacks(api)
@@ -160,23 +166,19 @@ def add_locus_schema(new_schema_url, new_locus_url):
             201 if Successful
     """
 
-    # count number of loci on schema and build the uri based on that number+1
-    loci_count = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              sq.COUNT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'],
-                                                                      new_schema_url))
-
-    # 0 if schema has no loci
-    number_schema_parts = int(
-        loci_count['results']['bindings'][0]['count']['value'])
+    # reserve the identifier of the new schema part
+    schema_part_id = id_allocator.reserve_schema_parts(current_app.config['LOCAL_SPARQL'],
+                                                       current_app.config['DEFAULTHGRAPH'],
+                                                       new_schema_url)
 
     # create URI for new schema part
     new_schema_part_url = '{0}/loci/{1}'.format(
-        new_schema_url, str(number_schema_parts+1))
+        new_schema_url, str(schema_part_id))
 
     # link locus to schema (previous operations determined that schema exists)
     link_query = (sq.INSERT_SCHEMA_LOCUS.format(current_app.config['DEFAULTHGRAPH'],
                                                             new_schema_part_url,
-                                                            str(number_schema_parts+1),
+                                                            str(schema_part_id),
                                                             new_locus_url,
                                                             new_schema_url,
                                                             new_schema_part_url))
@@ -187,6 +189,7 @@ def add_locus_schema(new_schema_url, new_locus_url):
                                current_app.config['VIRTUOSO_PASS'])
 
     if link_locus.status_code in [200, 201]:
+        qc.invalidate(new_schema_url)
         return {'message': 'Locus successfully added to schema.'}, 201
     else:
         return {'message': 'Could not add locus to schema.'}, link_locus.status_code
@@ -272,7 +275,7 @@ def add_allele(new_locus_url, spec_name, loci_id, new_user_url,
                                current_app.config['VIRTUOSO_USER'],
                                current_app.config['VIRTUOSO_PASS'])
 #            else:
-#                result = aux.send_big_query(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+#                result = aux.send_big_query(current_app.config['LOCAL_SPARQL'],
 #                                            query2send,
 #                                            current_app.config['VIRTUOSO_USER'],
 #                                            current_app.config['VIRTUOSO_PASS'])
@@ -287,6 +290,8 @@ def add_allele(new_locus_url, spec_name, loci_id, new_user_url,
     if result.status_code > 201:
         return {'FAIL': 'Could not {0} new allele.'.format(operation[1])}, result.status_code
     else:
+        qc.invalidate(new_locus_url)
+        sequence_index.add([(new_seq_url, new_allele_url)])
         return {operation[0]: 'A new allele has been {0} to {1}'.format(operation[2], new_allele_url)}, result.status_code
 
 
@@ -335,6 +340,9 @@ def generate(header, iterable):
         header: str
             Header of the response.
         iterable: iterable
+            Items to send. Can be a generator, such as
+            the bindings returned by `aux.stream_data`,
+            which is consumed while the response is sent.
 
         Yields
         ------
@@ -344,14 +352,39 @@ def generate(header, iterable):
 
     # first '{' has to be escaped
     yield '{{ "{0}": ['.format(header)
-    if len(iterable) > 0:
-        yield json.dumps(iterable[0])
-        for item in iterable[1:]:
-            yield ',{0}'.format(json.dumps(item))
+    items = iter(iterable)
+    for item in items:
+        yield json.dumps(item)
+        break
+    for item in items:
+        yield ',{0}'.format(json.dumps(item))
 
     yield '] }'
 
 
+def peek(iterable):
+    """ Checks if an iterable has any items without losing
+        the first item.
+
+        Parameters
+        ----------
+        iterable: iterable
+            Iterable to check.
+
+        Returns
+        -------
+        iterable: iterable
+            Iterable with all the items or None if
+            there are no items.
+    """
+
+    items = iter(iterable)
+    for item in items:
+        return itertools.chain([item], items)
+
+    return None
+
+
 # queue to add profile
 @celery.task(time_limit=20)
 def add_profile(rdf_2_ins):
@@ -416,6 +449,210 @@ def add_profile(rdf_2_ins):
         return e, 400
 
 
+def insert_profiles(profiles, headers, loci_uris, species_url, user_url,
+                    valid_alleles):
+    """ Validates and inserts a batch of allele call profiles.
+
+        Parameters
+        ----------
+        profiles: list
+            Tuples with the name of a genome and the list
+            of allele identifiers in its profile.
+        headers: list
+            Headers of the profiles. The first header is
+            the header of the genome names column.
+        loci_uris: dict
+            Locus original names as keys and locus URIs
+            as values.
+        species_url: str
+            URI of the species.
+        user_url: str
+            URI of the user that sent the profiles.
+        valid_alleles: set
+            URIs of alleles that are known to be defined
+            in the NS. Alleles checked in this batch are
+            added to it so that they are not checked again.
+
+        Returns
+        -------
+        isolates: list
+            Tuples with the genome name, the isolate URI
+            and the number of alleles for each profile.
+            Profiles without alleles are not inserted.
+        error: tuple
+            Response message and status code if the batch
+            could not be inserted, None otherwise.
+    """
+
+    isolates = []
+    for genome_name, alleles in profiles:
+        # create the new isolate id for the uri
+        nameWdata2hash = genome_name + \
+            str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
+        new_isolate_id = hashlib.sha256(
+            nameWdata2hash.encode('utf-8')).hexdigest()
+
+        isolateUri = "{0}/isolates/{1}".format(
+            species_url, str(new_isolate_id))
+
+        allele_uris = []
+        for i, allele in enumerate(alleles):
+            # get the allele id, missing loci have no id
+            try:
+                allele = int(allele)
+            except ValueError:
+                continue
+
+            # get the locus uri
+            try:
+                loci_uri = loci_uris[headers[i+1]]
+            except (KeyError, IndexError):
+                gene = headers[i+1] if i+1 < len(headers) else 'column {0}'.format(i+2)
+                return [], ({"message": ("{0} locus was not found, profile not uploaded".format(str(gene)))}, 404)
+
+            allele_uris.append("{0}/alleles/{1}".format(loci_uri, str(allele)))
+
+        isolates.append((genome_name, isolateUri, allele_uris))
+
+    # check if alleles exist, all profiles in the batch at once
+    unknown_alleles = set(uri for isolate in isolates
+                          for uri in isolate[2]).difference(valid_alleles)
+    if len(unknown_alleles) > 0:
+        try:
+            valid_alleles.update(aux.get_existing_alleles(current_app.config['LOCAL_SPARQL'],
+                                                          current_app.config['DEFAULTHGRAPH'],
+                                                          unknown_alleles))
+        except Exception:
+            return [], ({"message": "Could not validate profile alleles, try again"}, 500)
+
+    # check if isolates already exist
+    try:
+        existing = aux.get_values_bindings(current_app.config['LOCAL_SPARQL'],
+                                           sq.SELECT_EXISTING_ISOLATES,
+                                           current_app.config['DEFAULTHGRAPH'],
+                                           ['<{0}>'.format(isolate[1]) for isolate in isolates])
+    except Exception:
+        return [], ({"message": "Could not check isolates, try again"}, 500)
+
+    if len(existing) > 0:
+        return [], ({"message": "Isolate already exists"}, 409)
+
+    # build the rdf with all profiles and alleles
+    rdf_2_ins = ('PREFIX typon: <http://purl.phyloviz.net/ontology/typon#> \nINSERT DATA IN GRAPH <{0}> {{\n'.format(
+        current_app.config['DEFAULTHGRAPH']))
+
+    inserted = []
+    for genome_name, isolateUri, allele_uris in isolates:
+        allele_uris = [uri for uri in allele_uris if uri in valid_alleles]
+        inserted.append((genome_name, isolateUri, len(allele_uris)))
+        if len(allele_uris) == 0:
+            continue
+
+        rdf_2_ins += ('<{0}> a typon:Isolate;\ntypon:name "{1}"^^xsd:string; typon:sentBy <{2}>;'
+                      ' typon:dateEntered "{3}"^^xsd:dateTime; typon:isFromTaxon <{4}>;'.format(isolateUri,
+                                                                                                genome_name,
+                                                                                                user_url,
+                                                                                                str(dt.datetime.now().strftime(
+                                                                                                    '%Y-%m-%dT%H:%M:%S.%f')),
+                                                                                                species_url))
+        rdf_2_ins += ''.join('\ntypon:hasAllele <{0}>;'.format(uri)
+                             for uri in allele_uris)
+
+        # remove last semicolon from rdf and close the isolate
+        rdf_2_ins = rdf_2_ins[:-1] + ' .\n'
+
+    # if no genome has alleles, there is nothing to send
+    if all(isolate[2] == 0 for isolate in inserted):
+        return inserted, None
+
+    rdf_2_ins += "}"
+
+    # add to the queue to send the profiles
+    task = add_profile.apply(args=[rdf_2_ins])
+
+    process_ran = task.ready()
+    process_sucess = task.status
+
+    if not (process_ran and process_sucess == "SUCCESS"):
+        return [], ({"message": "Profile not uploaded, try again "}, 500)
+
+    process_result_status_code = int(task.result[-1])
+    if process_result_status_code > 201:
+        return [], ({"message": "Profile not uploaded, try again "}, process_result_status_code)
+
+    return inserted, None
+
+
+def lookup_sequences(inputs, query_part, loci_counts):
+    """ Resolves a batch of sequences to the loci and alleles
+        that have them.
+
+        Parameters
+        ----------
+        inputs: list
+            Tuples with the input sent by the client (a DNA
+            sequence or a sequence hash) and the sequence hash.
+        query_part: str
+            Additional graph pattern used to filter the
+            loci (e.g. by species).
+        loci_counts: dict
+            Number of alleles of the loci resolved in
+            previous batches. Loci resolved in this batch
+            are added to it so that they are not counted
+            again.
+
+        Returns
+        -------
+        results: list
+            One dictionary per input with the input, the
+            sequence URI, the bindings with the locus, allele,
+            schema and UniProt annotation for each allele
+            that has the sequence and the number of alleles
+            of each locus.
+
+        Raises
+        ------
+        Exception
+            If the batched queries failed.
+    """
+
+    base_url = current_app.config['BASE_URL']
+
+    # sequences that the local index knows are not
+    # in any locus do not have to be queried
+    sequence_uris = set()
+    for value, seq_hash in inputs:
+        indexed = sequence_index.lookup(seq_hash)
+        if indexed is None or len(indexed[1]) > 0:
+            sequence_uris.add('{0}sequences/{1}'.format(base_url, seq_hash))
+
+    info = {}
+    if len(sequence_uris) > 0:
+        info = aux.get_sequences_info(current_app.config['LOCAL_SPARQL'],
+                                      current_app.config['DEFAULTHGRAPH'],
+                                      sequence_uris, query_part)
+
+    loci = set(b['locus']['value'] for bindings in info.values()
+               for b in bindings).difference(loci_counts)
+    if len(loci) > 0:
+        loci_counts.update(aux.count_loci_alleles(current_app.config['LOCAL_SPARQL'],
+                                                  current_app.config['DEFAULTHGRAPH'],
+                                                  loci))
+
+    results = []
+    for value, seq_hash in inputs:
+        sequence_uri = '{0}sequences/{1}'.format(base_url, seq_hash)
+        sequence_info = info.get(sequence_uri, [])
+        seq_loci = set(b['locus']['value'] for b in sequence_info)
+        results.append({'input': value,
+                        'sequence_uri': sequence_uri,
+                        'result': sequence_info,
+                        'number_alleles_loci': {locus: loci_counts.get(locus, 0)
+                                                for locus in seq_loci}})
+
+    return results
+
+
 user_datastore = datastore_cheat
 
 # Create a default admin user on Postgres and Virtuoso
@@ -905,8 +1142,7 @@ class AllUsers(Resource):
 			user_uri = '{0}users/{1}'.format(
 				current_app.config['BASE_URL'], user.id)
 			user_exists_query = sq.ASK_USER.format(user_uri)
-			ask_result = aux.get_data(SPARQLWrapper(
-				current_app.config['LOCAL_SPARQL']), user_exists_query)
+			ask_result = aux.get_data(current_app.config['LOCAL_SPARQL'], user_exists_query)
 			user_exists = ask_result['boolean']
 
 			current_user_dict = {}
@@ -1000,8 +1236,7 @@ class AllUsers(Resource):
 
 			# check if user already exists in Virtuoso
 			user_exists_query = sq.ASK_USER.format(new_user_uri)
-			ask_result = aux.get_data(SPARQLWrapper(
-				current_app.config['LOCAL_SPARQL']), user_exists_query)
+			ask_result = aux.get_data(current_app.config['LOCAL_SPARQL'], user_exists_query)
 			user_exists = ask_result['boolean']
 
 			if user_exists is True:
@@ -1112,8 +1347,7 @@ class RegisterUser(Resource):
 
             # check if user already exists in Virtuoso
             user_exists_query = sq.ASK_USER.format(new_user_uri)
-            ask_result = aux.get_data(SPARQLWrapper(
-                current_app.config['LOCAL_SPARQL']), user_exists_query)
+            ask_result = aux.get_data(current_app.config['LOCAL_SPARQL'], user_exists_query)
             user_exists = ask_result['boolean']
 
             if user_exists is True:
@@ -1176,7 +1410,7 @@ class CurrentUserProfileContributions(Resource):
 		user_uri = '{0}users/{1}'.format(
 			current_app.config['BASE_URL'], current_user)
 
-		result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+		result = aux.get_data(current_app.config['LOCAL_SPARQL'],
 						(sq.COUNT_USER_PROFILE.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
 		profile_table_data = result["results"]["bindings"]
@@ -1212,7 +1446,7 @@ class CurrentUserProfileContributions(Resource):
 			# 	schema_uri = "{0}species/{1}/schemas/{2}".format(current_app.config['BASE_URL'], i["species_id"], i["schema_id"])
 			# 	# if i["nr_allele"] < 10000:
 
-			# 	loci_allele_list_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+			# 	loci_allele_list_result = aux.get_data(current_app.config['LOCAL_SPARQL'],
 			# 		(sq.SELECT_USER_PROFILE_LOCI_ALLELES.format(current_app.config['DEFAULTHGRAPH'], schema_uri, user_uri)))
 
 			# 	final_result["species_id_{0}_schema_id_{1}".format(i["species_id"], i["schema_id"])] = {
@@ -1222,7 +1456,7 @@ class CurrentUserProfileContributions(Resource):
 
 			# 	else:
 			# 		while count != i["nr_allele"]:
-			# 			alleles = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+			# 			alleles = aux.get_data(current_app.config['LOCAL_SPARQL'],
 			# 								sq.SELECT_USER_PROFILE_LOCI_ALLELES_2.format(
 			# 									current_app.config['DEFAULTHGRAPH'],
 			# 									schema_uri, 
@@ -1274,8 +1508,7 @@ class CurrentUser(Resource):
         user_uri = '{0}users/{1}'.format(
             current_app.config['BASE_URL'], current_user)
         user_exists_query = sq.ASK_USER.format(user_uri)
-        ask_result = aux.get_data(SPARQLWrapper(
-            current_app.config['LOCAL_SPARQL']), user_exists_query)
+        ask_result = aux.get_data(current_app.config['LOCAL_SPARQL'], user_exists_query)
         user_exists = ask_result['boolean']
 
         current_user_dict = {}
@@ -1313,9 +1546,7 @@ class CurrentUser(Resource):
         )
         user_exists_query = sq.ASK_USER.format(user_uri)
         ask_result = aux.get_data(
-            SPARQLWrapper(
-                current_app.config['LOCAL_SPARQL']
-            ),
+            current_app.config['LOCAL_SPARQL'],
             user_exists_query
         )
         user_exists = ask_result['boolean']
@@ -1337,6 +1568,7 @@ class CurrentUser(Resource):
         user.country = country if country != "" else user.country
 
         db.session.commit()
+        user_names.invalidate(user.id)
 
         return {"message": "Profile succesfully updated."}, 200
 
@@ -1372,8 +1604,7 @@ class Users(Resource):
         user_uri = '{0}users/{1}'.format(
             current_app.config['BASE_URL'], user.id)
         user_exists_query = sq.ASK_USER.format(user_uri)
-        ask_result = aux.get_data(SPARQLWrapper(
-            current_app.config['LOCAL_SPARQL']), user_exists_query)
+        ask_result = aux.get_data(current_app.config['LOCAL_SPARQL'], user_exists_query)
         user_exists = ask_result['boolean']
 
         current_user_dict = {}
@@ -1423,13 +1654,13 @@ class Users(Resource):
         user_datastore.delete_user(user)
         # commit changes to the database
         db.session.commit()
+        user_names.invalidate(user_id)
 
         # delete user from Virtuoso
         user_uri = '{0}users/{1}'.format(
             current_app.config['BASE_URL'], user_id)
         user_exists_query = sq.ASK_USER.format(user_uri)
-        ask_result = aux.get_data(SPARQLWrapper(
-            current_app.config['LOCAL_SPARQL']), user_exists_query)
+        ask_result = aux.get_data(current_app.config['LOCAL_SPARQL'], user_exists_query)
         user_exists = ask_result['boolean']
 
         if user_exists is True:
@@ -1481,6 +1712,7 @@ class UsersPromote(Resource):
             user_datastore.add_role_to_user(user, promote_to_this_role)
             # Commit changes to the database
             db.session.commit()
+            user_names.invalidate(id)
             postgres_change = True
             postgres_message = 'Promoted user to Contributor in Postgres DB.'
         elif remove_this_role == 'Admin':
@@ -1494,7 +1726,7 @@ class UsersPromote(Resource):
         role_query = (sq.SELECT_USER.format(
             current_app.config['DEFAULTHGRAPH'], user_uri))
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               role_query)
 
         user_role = result['results']['bindings'][0]['role']['value']
@@ -1566,6 +1798,7 @@ class UsersDemote(Resource):
             user_datastore.add_role_to_user(user, promote_to_this_role)
             # Commit changes to the database
             db.session.commit()
+            user_names.invalidate(id)
             postgres_change = True
             postgres_message = 'Demoted user to User in Postgres DB.'
 
@@ -1577,7 +1810,7 @@ class UsersDemote(Resource):
         role_query = (sq.SELECT_USER.format(
             current_app.config['DEFAULTHGRAPH'], user_uri))
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               role_query)
 
         user_role = result['results']['bindings'][0]['role']['value']
@@ -1631,16 +1864,22 @@ class DownloadCompressedSchemas(Resource):
         filename = "{0}_{1}".format(
             str(species_id), str(schema_id))
 
-        for f_name in os.listdir("compressed_schemas"):
-            if f_name.startswith(filename):
-                compressed_schema_filename = f_name
+        # archives being written have a temporary name
+        compressed_schemas = aux.compressed_versions(os.listdir("compressed_schemas"),
+                                                     filename)
+        if len(compressed_schemas) == 0:
+            return {'Not found': 'Could not find a compressed version of specified schema.'}, 404
+        compressed_schema_filename = compressed_schemas[-1]
 
         response = make_response()
 
         # Set response Headers
         response.headers['Content-Description'] = 'File Transfer'
         response.headers['Cache-Control'] = 'no-cache'
-        response.headers['Content-Type'] = 'application/zip'
+        if compressed_schema_filename.endswith('.zip'):
+            response.headers['Content-Type'] = 'application/zip'
+        else:
+            response.headers['Content-Type'] = 'application/zstd'
         response.headers['X-Accel-Redirect'] = "/compressed_schemas/" + compressed_schema_filename
 
         return response
@@ -1693,7 +1932,7 @@ class StatsSummary(Resource):
         """ Count the number of items in Typon """
 
         # get simple counts for data in the NS
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.NS_STATS.format(current_app.config['DEFAULTHGRAPH'])))
 
         stats = result['results']['bindings']
@@ -1703,6 +1942,24 @@ class StatsSummary(Resource):
             return {'NOT FOUND': 'Could not retrieve summary info from NS.'}, 404
 
 
+@stats_conf.route("/sparql")
+class StatsSPARQL(Resource):
+    """ Metrics about the queries sent to Virtuoso. """
+
+    @api.hide
+    @api.doc(responses={200: 'OK',
+                        403: 'Unauthorized',
+                        401: 'Unauthenticated'},
+             security=["access_token"])
+    @w.admin_required
+    def get(self):
+        """ Get the query histograms per endpoint and per template
+            collected by the worker that handles the request.
+        """
+
+        return sparql_metrics.metrics.snapshot(), 200
+
+
 @stats_conf.route("/species")
 class StatsSpecies(Resource):
     """ Summary of all species data. """
@@ -1718,7 +1975,7 @@ class StatsSpecies(Resource):
         """ Get species properties values and total number of schemas per species. """
 
         # count number of schemas per species
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.COUNT_SPECIES_SCHEMAS.format(current_app.config['DEFAULTHGRAPH'])))
 
         species_schemas_count = result['results']['bindings']
@@ -1750,28 +2007,25 @@ class StatsSpeciesId(Resource):
     def get(self, species_id, schema_id):
         """ Get schema properties values, total number of loci and total number of alleles for all schemas of a species. """
 
-        precomputed_data_file = os.path.join(
-            os.getcwd(), 'pre-computed-data/totals_{0}.json'.format(str(species_id)))
-
-        with open(precomputed_data_file, 'r') as json_file:
-            json_data = json.load(json_file)
-
-        # get user id to obtain the username from the Postgres DB
-        for i in json_data["message"]:
-
-            json_user_id = int(i["user"].rsplit("/", 1)[-1])
+        # cached entries are shared and must be copied
+        schemas_data = stats_cache.stats_data('totals_{0}.json'.format(species_id),
+                                              'uri', schema_id)
+        if schema_id is None:
+            json_data = dict(schemas_data)
+            schemas_data = json_data['message'] = [dict(s) for s in schemas_data['message']]
+        else:
+            json_data = schemas_data = [dict(s) for s in schemas_data]
 
-            user_db = User.query.get_or_404(json_user_id)
+        # get the usernames of all users from the Postgres DB
+        usernames = user_names.resolve(i["user"] for i in schemas_data)
+        for i in schemas_data:
+            if i["user"] not in usernames:
+                abort(404)
 
-            # replace the user id with the username
-            i["user"] = user_db.username
+            # replace the user URI with the username
+            i["user"] = usernames[i["user"]]
 
-        if schema_id is None:
-            return json_data
-        elif schema_id is not None:
-            schema_data = [s for s in json_data['message']
-                           if s['uri'].split('/')[-1] == schema_id]
-            return schema_data
+        return stats_cache.data_response(json_data)
 
 
 @stats_conf.route("/species/<int:species_id>/schema/loci/nr_alleles")
@@ -1796,18 +2050,8 @@ class StatsSpeciesSchemas(Resource):
     def get(self, species_id, schema_id):
         """ Get the loci and count the alleles for each schema of a particular species. """
 
-        precomputed_data_file = os.path.join(
-            os.getcwd(), 'pre-computed-data/loci_{0}.json'.format(str(species_id)))
-
-        with open(precomputed_data_file, 'r') as json_file:
-            json_data = json.load(json_file)
-
-        if schema_id is None:
-            return json_data
-        elif schema_id is not None:
-            schema_data = [s for s in json_data['message']
-                           if s['schema'].split('/')[-1] == schema_id]
-            return schema_data
+        return stats_cache.stats_response('loci_{0}.json'.format(species_id),
+                                          'schema', schema_id)
 
 
 @stats_conf.route("/species/<int:species_id>/schema/<int:schema_id>/modes")
@@ -1824,14 +2068,7 @@ class StatsSpeciesSchemasMode(Resource):
     def get(self, species_id, schema_id):
         """ Get the all the loci and calculate the allele mode for a particular schema of a particular species. """
 
-        #
-        precomputed_data_file = os.path.join(
-            os.getcwd(), 'pre-computed-data/mode_{0}_{1}.json'.format(species_id, schema_id))
-
-        with open(precomputed_data_file, 'r') as json_file:
-            json_data = json.load(json_file)
-
-        return json_data
+        return stats_cache.stats_response('mode_{0}_{1}.json'.format(species_id, schema_id))
 
 
 @stats_conf.route("/species/<int:species_id>/schema/<int:schema_id>/annotations")
@@ -1848,14 +2085,7 @@ class StatsAnnotations(Resource):
     def get(self, species_id, schema_id):
         """ Get all the annotations in NS. """
 
-        #
-        precomputed_data_file = os.path.join(
-            os.getcwd(), 'pre-computed-data/annotations_{0}_{1}.json'.format(species_id, schema_id))
-
-        with open(precomputed_data_file, 'r') as json_file:
-            json_data = json.load(json_file)
-
-        return json_data
+        return stats_cache.stats_response('annotations_{0}_{1}.json'.format(species_id, schema_id))
 
 
 @stats_conf.route("/species/<int:species_id>/schema/<int:schema_id>/lengthStats")
@@ -1872,13 +2102,7 @@ class StatsLengthStats(Resource):
     def get(self, species_id, schema_id):
         """ Get the five-number summary and mean for all loci in a particular schema. """
 
-        precomputed_data_file = os.path.join(
-            os.getcwd(), 'pre-computed-data/boxplot_{0}_{1}.json'.format(species_id, schema_id))
-
-        with open(precomputed_data_file, 'r') as json_file:
-            json_data = json.load(json_file)
-
-        return json_data
+        return stats_cache.stats_response('boxplot_{0}_{1}.json'.format(species_id, schema_id))
 
 
 @stats_conf.route("/species/<int:species_id>/schema/<int:schema_id>/contributions")
@@ -1895,19 +2119,12 @@ class StatsContributions(Resource):
     def get(self, species_id, schema_id):
         """ Get the allele contributions any schema. """
 
-        precomputed_data_file = os.path.join(
-            os.getcwd(), 'pre-computed-data/allele_contributions_{0}_{1}.json'.format(species_id, schema_id))
-
-        if os.path.exists(precomputed_data_file):
-
-            with open(precomputed_data_file, 'r') as json_file:
-                json_data = json.load(json_file)
+        try:
+            return stats_cache.stats_response('allele_contributions_{0}_{1}.json'.format(species_id, schema_id))
+        except FileNotFoundError:
 
-            return json_data
-        else:
-            
             json_data = "undefined"
-        
+
             return json_data
 
 
@@ -1998,29 +2215,37 @@ class LociList(Resource):
             sequence_uri = '{0}sequences/{1}'.format(
                 current_app.config['BASE_URL'], str(sequence_hash))
 
-            # get all loci that have the provided sequence
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.SELECT_SEQUENCE_LOCI.format(current_app.config['DEFAULTHGRAPH'], sequence_uri)))
+            # sequences without alleles are not in any locus
+            indexed = sequence_index.lookup(sequence_hash)
+            if indexed is not None and len(indexed[1]) == 0:
+                res_loci = []
+            else:
+                # get all loci that have the provided sequence
+                result = aux.get_data(current_app.config['LOCAL_SPARQL'],
+                                      (sq.SELECT_SEQUENCE_LOCI.format(current_app.config['DEFAULTHGRAPH'], sequence_uri)))
 
-            res_loci = result['results']['bindings']
+                res_loci = result['results']['bindings']
 
         else:
             # get list of loci, ascending order of locus identifier
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  sq.SELECT_ALL_LOCI.format(current_app.config['DEFAULTHGRAPH']))
+            # the list is streamed from Virtuoso while it is sent
+            res_loci = aux.stream_data(current_app.config['LOCAL_SPARQL'],
+                                       sq.SELECT_ALL_LOCI.format(current_app.config['DEFAULTHGRAPH']))
 
-            res_loci = result['results']['bindings']
+            if isinstance(res_loci, Exception):
+                return {'message': 'Could not retrieve the list of loci.'}, 500
 
         if prefix is not None:
-            res_loci = [
-                res for res in res_loci if prefix in res['name']['value']]
+            res_loci = (res for res in res_loci
+                        if prefix in res['name']['value'])
 
         if locus_ori_name is not None:
-            res_loci = [
-                res for res in res_loci if locus_ori_name in res['original_name']['value']]
+            res_loci = (res for res in res_loci
+                        if locus_ori_name in res['original_name']['value'])
 
         # if result is not empty, stream with context
-        if len(res_loci) > 0:
+        res_loci = peek(res_loci)
+        if res_loci is not None:
             return Response(stream_with_context(generate('Loci', res_loci)), content_type='application/json', mimetype='application/json')
         # if there are loci with the sequence, filter based on other arguments
         else:
@@ -2050,20 +2275,15 @@ class LociList(Resource):
         if aux.check_prefix(prefix) is False:
             return {'message': 'Please provide a valid prefix.'}, 400
 
-        # count total number of loci in the NS
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              (sq.COUNT_TOTAL_LOCI.format(current_app.config['DEFAULTHGRAPH'])))
-
-        number_loci_spec = int(
-            result["results"]["bindings"][0]['count']['value'])
-
-        newLocusId = number_loci_spec + 1
+        # reserve the identifier of the new locus
+        newLocusId = id_allocator.reserve_loci(current_app.config['LOCAL_SPARQL'],
+                                               current_app.config['DEFAULTHGRAPH'])
 
         # name will be something like prefix-000001
         aliases = '{0}-{1}'.format(prefix, '%06d' % (newLocusId,))
 
         # check if already exists locus with that aliases
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.ASK_LOCUS_PREFIX.format(aliases)))
 
         if result['boolean']:
@@ -2121,7 +2341,7 @@ class LociNS(Resource):
         locus_url = '{0}loci/{1}'.format(
             current_app.config['BASE_URL'], loci_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_LOCUS.format(current_app.config['DEFAULTHGRAPH'], locus_url)))
 
         locus = result['results']['bindings']
@@ -2181,15 +2401,18 @@ class LociNSFastaAPItypon(Resource):
         locus_uri = '{0}loci/{1}'.format(current_app.config['BASE_URL'], loci_id)
 
         # check if locus exists
-        locus_exists = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                    sq.ASK_LOCUS.format(locus_uri))
+        locus_exists = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                                   'ASK_LOCUS', [locus_uri],
+                                   scopes=[locus_uri])
         locus_exists = locus_exists['boolean']
         if locus_exists is False:
             return {'message': 'There is no locus with provided ID.'}, 404
 
         # get schema that the locus is associated with
-        locus_schema_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                          (sq.SELECT_LOCUS_SCHEMA.format(current_app.config['DEFAULTHGRAPH'], locus_uri)))
+        locus_schema_query = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                                         'SELECT_LOCUS_SCHEMA',
+                                         [current_app.config['DEFAULTHGRAPH'], locus_uri],
+                                         scopes=[locus_uri])
 
         # get schema URI from response
         has_schema = False if locus_schema_query['results']['bindings'] == [] else True
@@ -2199,39 +2422,53 @@ class LociNSFastaAPItypon(Resource):
 
         locus_schema = locus_schema_query['results']['bindings'][0]['schema']['value']
 
+        # cached results are valid while the schema is not modified
+        schema_version = qc.schema_version(current_app.config['LOCAL_SPARQL'],
+                                           current_app.config['DEFAULTHGRAPH'],
+                                           locus_schema)
+        cache_scopes = [qc.SCHEMAS_SCOPE, locus_schema, locus_uri]
+
         # get request data
         request_data = request.args
+        # alleles are streamed from Virtuoso while they are sent
         if 'date' in request_data:
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.SELECT_LOCUS_FASTA_BY_DATE.format(current_app.config['DEFAULTHGRAPH'],
-                                                                        locus_uri,
-                                                                        request_data['date'])))
+            fasta_seqs = qc.stream_data(current_app.config['LOCAL_SPARQL'],
+                                        'SELECT_LOCUS_FASTA_BY_DATE',
+                                        [current_app.config['DEFAULTHGRAPH'],
+                                         locus_uri,
+                                         request_data['date']],
+                                        scopes=cache_scopes,
+                                        version=schema_version)
         else:
             # find all alleles from the locus and return the sequence and id sorted by id
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.SELECT_LOCUS_FASTA.format(current_app.config['DEFAULTHGRAPH'],
-                                                                locus_uri)))
+            fasta_seqs = qc.stream_data(current_app.config['LOCAL_SPARQL'],
+                                        'SELECT_LOCUS_FASTA',
+                                        [current_app.config['DEFAULTHGRAPH'], locus_uri],
+                                        scopes=cache_scopes,
+                                        version=schema_version)
 
         # virtuoso returned an error because request length exceeded maximum value
-        # get each allele separately
-        try:
-            fasta_seqs = result['results']['bindings']
-        except:
+        # get the sequence hashes and then the sequences in batches
+        if isinstance(fasta_seqs, Exception):
             # get locus sequences hashes
             if 'date' in request_data:
-                result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                       (sq.SELECT_LOCUS_SEQS_BY_DATE.format(current_app.config['DEFAULTHGRAPH'], locus_uri, request_data['date'])))
             else:
-                result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+                result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                       (sq.SELECT_LOCUS_SEQS.format(current_app.config['DEFAULTHGRAPH'], locus_uri)))
 
             fasta_seqs = result['results']['bindings']
-            for s in range(len(fasta_seqs)):
-                # get the sequence corresponding to the hash
-                result2 = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                       (sq.SELECT_SEQ_FASTA.format(current_app.config['DEFAULTHGRAPH'], fasta_seqs[s]['sequence']['value'])))
 
-                fasta_seqs[s]['nucSeq'] = result2['results']['bindings'][0]['nucSeq']
+            # get the sequences corresponding to the hashes in batches
+            try:
+                sequences = aux.get_sequences(current_app.config['LOCAL_SPARQL'],
+                                              current_app.config['DEFAULTHGRAPH'],
+                                              [f['sequence']['value'] for f in fasta_seqs])
+                for f in fasta_seqs:
+                    f['nucSeq'] = sequences[f['sequence']['value']]
+            except Exception:
+                return {'message': 'Could not retrieve the sequences of the locus.'}, 500
 
         return Response(stream_with_context(generate('Fasta', fasta_seqs)), content_type='application/json')
 
@@ -2252,10 +2489,26 @@ class LociNSUniprotAPItypon(Resource):
 
         locus_url = '{0}loci/{1}'.format(current_app.config['BASE_URL'], loci_id)
 
+        # annotations only change when the locus schema is modified
+        locus_schema_query = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                                         'SELECT_LOCUS_SCHEMA',
+                                         [current_app.config['DEFAULTHGRAPH'], locus_url],
+                                         scopes=[locus_url])
+        try:
+            locus_schema = locus_schema_query['results']['bindings'][0]['schema']['value']
+            schema_version = qc.schema_version(current_app.config['LOCAL_SPARQL'],
+                                               current_app.config['DEFAULTHGRAPH'],
+                                               locus_schema)
+        except (TypeError, KeyError, IndexError):
+            locus_schema = None
+            schema_version = None
+
         # get all uniprot labels and URI from all alleles of the selected locus
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              (sq.SELECT_LOCUS_UNIPROT.format(current_app.config['DEFAULTHGRAPH'],
-                                                              locus_url)))
+        result = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                             'SELECT_LOCUS_UNIPROT',
+                             [current_app.config['DEFAULTHGRAPH'], locus_url],
+                             scopes=[qc.SCHEMAS_SCOPE, locus_schema, locus_url],
+                             version=schema_version)
 
         annotations = result['results']['bindings']
 
@@ -2293,7 +2546,7 @@ class LociNSAlleles(Resource):
         locus_url = '{0}loci/{1}'.format(current_app.config['BASE_URL'], loci_id)
 
         # check if provided loci id exists
-        result_loci = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_loci = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    (sq.ASK_LOCUS.format(locus_url)))
 
         if not result_loci['boolean']:
@@ -2308,8 +2561,7 @@ class LociNSAlleles(Resource):
             uniprot_query = (sq.SELECT_UNIPROT_TAXON.format(species))
 
             # Check if species exists on uniprot
-            result2 = aux.get_data(SPARQLWrapper(
-                current_app.config['UNIPROT_SPARQL']), uniprot_query)
+            result2 = aux.get_data(current_app.config['UNIPROT_SPARQL'], uniprot_query)
 
             uniprot_taxid = result2['results']['bindings']
             if uniprot_taxid != []:
@@ -2318,14 +2570,14 @@ class LociNSAlleles(Resource):
                 return {'message': 'Species name not found on uniprot, search on http://www.uniprot.org/taxonomy/'}, 404
 
             # check if species already exists locally (typon)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.ASK_SPECIES_UNIPROT.format(taxon_uri)))
 
             if not result['boolean']:
                 return {'message': 'Species does not exists in NS.'}, 409
 
             # determine if locus with provided identifier is associated to provided species
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_LOCUS_SPECIES_ALLELES.format(current_app.config['DEFAULTHGRAPH'],
                                                                           locus_url,
                                                                           species)))
@@ -2333,7 +2585,7 @@ class LociNSAlleles(Resource):
         # simply get all alleles for provided locus
         else:
             # get list of alleles from that locus
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_LOCUS_ALLELES.format(current_app.config['DEFAULTHGRAPH'],
                                                                   locus_url)))
 
@@ -2372,7 +2624,7 @@ class LociNSAlleles(Resource):
         locus_url = '{0}loci/{1}'.format(current_app.config['BASE_URL'], loci_id)
 
         # check if locus exists, must exist to be able to add alleles
-        #result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        #result = aux.get_data(current_app.config['LOCAL_SPARQL'],
         #                      (sq.ASK_LOCUS.format(new_locus_url)))
 
         # stop execution if locus does not exist
@@ -2380,7 +2632,7 @@ class LociNSAlleles(Resource):
         #    return {'UNEXISTENT LOCUS': 'Specified locus does not exist.'}, 404
 
         # get schema that the locus is associated with
-        #locus_schema_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        #locus_schema_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
         #                                  (sq.SELECT_LOCUS_SCHEMA.format(current_app.config['DEFAULTHGRAPH'], new_locus_url)))
 
         # get schema URI from response
@@ -2391,7 +2643,7 @@ class LociNSAlleles(Resource):
         #    return {'message': 'Locus with provided ID is not associated to any schema.'}
 
         # determine if schema is locked
-        #locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        #locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
         #                                   (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], locus_schema)))
         #locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
@@ -2401,7 +2653,7 @@ class LociNSAlleles(Resource):
             # check the role of the user that is trying to access
         #    new_user_url = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-        #    result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        #    result = aux.get_data(current_app.config['LOCAL_SPARQL'],
         #                          (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], new_user_url)))
 
         #    user_role = result['results']['bindings'][0]['role']['value']
@@ -2424,8 +2676,7 @@ class LociNSAlleles(Resource):
             query = (sq.SELECT_UNIPROT_TAXON.format(species_name))
 
             # Check if species exists on uniprot
-            result_species = aux.get_data(SPARQLWrapper(
-                current_app.config['UNIPROT_SPARQL']), query)
+            result_species = aux.get_data(current_app.config['UNIPROT_SPARQL'], query)
             try:
                 url = result_species['results']['bindings'][0]['taxon']['value']
             except:
@@ -2434,7 +2685,7 @@ class LociNSAlleles(Resource):
                         'http://www.uniprot.org/taxonomy/'}, 404
 
             # after determining that the species exists, check if the sequence is a valid CDS
-            translation_result = aux.translate_dna(sequence, 11, 0)
+            translation_result = aux.translate_dna_batch([sequence], 11, 0)[0]
             if isinstance(translation_result, list):
                 protein_sequence = str(translation_result[0][0])
             else:
@@ -2446,11 +2697,9 @@ class LociNSAlleles(Resource):
 
             # queries with big sequences need different approach
             if len(sequence) > 9000:
-                result = aux.send_big_query(SPARQLWrapper(
-                    current_app.config['LOCAL_SPARQL']), query)
+                result = aux.send_big_query(current_app.config['LOCAL_SPARQL'], query)
             else:
-                result = aux.get_data(SPARQLWrapper(
-                    current_app.config['LOCAL_SPARQL']), query)
+                result = aux.get_data(current_app.config['LOCAL_SPARQL'], query)
 
             # if sequence already exists on locus return the allele uri, if not create new sequence
             try:
@@ -2464,14 +2713,12 @@ class LociNSAlleles(Resource):
             # should not be necessary if properly translated
 
             # in manual, the allele URI is not provided
-            # construct allele URI by counting the total number of alleles in locus
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.COUNT_LOCUS_ALLELES.format(current_app.config['DEFAULTHGRAPH'], locus_url)))
-
-            number_alleles_loci = int(
-                result["results"]["bindings"][0]['count']['value'])
+            # construct allele URI with a new identifier for the locus
+            allele_id = id_allocator.reserve_alleles(current_app.config['LOCAL_SPARQL'],
+                                                     current_app.config['DEFAULTHGRAPH'],
+                                                     locus_url)
 
-            allele_uri = '{0}/alleles/{1}'.format(locus_url, number_alleles_loci+1)
+            allele_uri = '{0}/alleles/{1}'.format(locus_url, allele_id)
 
         # Get the uniprot info if it's provided
         elif post_data["input"] == "auto":
@@ -2486,6 +2733,12 @@ class LociNSAlleles(Resource):
             # in 'auto' mode, alleles URIs are provided by the load schema process
             allele_uri = post_data['sequence_uri']
 
+            # identifiers reserved later must be higher
+            try:
+                id_allocator.ensure_allele(locus_url, int(allele_uri.split('/')[-1]))
+            except ValueError:
+                pass
+
         # build the id of the sequence by hashing it
         seq_hash = hashlib.sha256(sequence.encode('utf-8')).hexdigest()
 
@@ -2494,14 +2747,17 @@ class LociNSAlleles(Resource):
             current_app.config['BASE_URL'], str(seq_hash))
 
         # check if there is a sequence with the same hash
-        hash_presence = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                     (sq.ASK_SEQUENCE_HASH.format(new_seq_url)))
+        # Virtuoso is only queried if the local index is not available
+        hash_presence = sequence_index.contains(seq_hash)
+        if hash_presence is None:
+            hash_presence = aux.get_data(current_app.config['LOCAL_SPARQL'],
+                                         (sq.ASK_SEQUENCE_HASH.format(new_seq_url)))['boolean']
 
         # check if the sequence that has the same hash is the same or a different DNA sequence
         # only enter here if hash is attributed to a sequence that is in the NS
         # if hash_presence['boolean'] is True:
 
-        #    hashed_sequence = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        #    hashed_sequence = aux.get_data(current_app.config['LOCAL_SPARQL'],
         #                                   (sq.ASK_SEQUENCE_HASH_SEQ.format(new_seq_url, sequence)))
 
             # WARNING: there was a hash collision, two different sequences have the same hash
@@ -2509,7 +2765,7 @@ class LociNSAlleles(Resource):
         #        return {'HASH COLLISION': ('Found hash collision. New sequence has same hash as sequence at URI {0}.\n{1}'.format(new_seq_url, sequence))}, 409
 
         # if the sequence already exists in the NS
-        if hash_presence['boolean']:
+        if hash_presence:
             # celery task
             task = add_allele.apply(
                 args=[locus_url, species_name, loci_id,
@@ -2551,14 +2807,14 @@ class AlleleNSAPItypon(Resource):
         # check if provided loci id exists
         locus_url = allele_url.split('/alleles')[0]
 
-        result_loci = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_loci = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    sq.ASK_LOCUS.format(locus_url))
 
         if not result_loci['boolean']:
             return {'UNEXISTENT LOCUS': 'Specified locus does not exist.'}, 404
 
         # get information on allele, sequence, submission date, id and number of isolates with this allele
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_ALLELE_INFO.format(current_app.config['DEFAULTHGRAPH'], allele_url)))
 
         allele_info = result['results']['bindings']
@@ -2672,6 +2928,18 @@ allele_model = api.model('AlleleModel',
                                                      description="The ID of the allele in NS")
                           })
 
+sequence_lookup_model = api.model('SequenceLookupModel',
+                                  {'sequences': fields.List(fields.String,
+                                                            required=False,
+                                                            description="DNA sequences"),
+                                   'seq_ids': fields.List(fields.String,
+                                                          required=False,
+                                                          description="DNA sequence hashes"),
+                                   'species_id': fields.String(required=False,
+                                                               pattern='^[0-9]+$',
+                                                               description="ID of the species")
+                                   })
+
 profile_model = api.model('ProfileModel',
                           {'profile': fields.Raw(required=True,
                                                  description="AlleleCall profile"),
@@ -2710,9 +2978,10 @@ class SpeciesListAPItypon(Resource):
         query_end = ' typon:name "{0}"^^xsd:string. '.format(
             species_name) if species_name is not None else ' typon:name ?name. '
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              (sq.SELECT_SPECIES.format(current_app.config['DEFAULTHGRAPH'],
-                                                                    query_end)))
+        result = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                             'SELECT_SPECIES',
+                             [current_app.config['DEFAULTHGRAPH'], query_end],
+                             scopes=[qc.SPECIES_SCOPE])
 
         species_list = result['results']['bindings']
         if species_list == []:
@@ -2743,7 +3012,7 @@ class SpeciesListAPItypon(Resource):
         taxon_name = str(post_data['name'])
 
         # get total number of taxa already on the graph
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.COUNT_TAXON.format(current_app.config['DEFAULTHGRAPH'])))
 
         number_taxa = int(result["results"]["bindings"][0]['count']['value'])
@@ -2752,15 +3021,14 @@ class SpeciesListAPItypon(Resource):
         uniprot_query = sq.SELECT_UNIPROT_TAXON.format(taxon_name)
 
         # check if species exists on uniprot
-        result2 = aux.get_data(SPARQLWrapper(
-            current_app.config['UNIPROT_SPARQL']), uniprot_query)
+        result2 = aux.get_data(current_app.config['UNIPROT_SPARQL'], uniprot_query)
         try:
             uniprot_url = result2["results"]["bindings"][0]['taxon']['value']
         except:
             return {'message': 'Species name not found on uniprot. Please provide a valid species name or search at http://www.uniprot.org/taxonomy/'}, 404
 
         # check if species already exists locally (typon)
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.ASK_SPECIES_UNIPROT.format(uniprot_url)))
 
         if result['boolean']:
@@ -2779,6 +3047,7 @@ class SpeciesListAPItypon(Resource):
                                current_app.config['VIRTUOSO_PASS'])
 
         if result.status_code in [200, 201]:
+            qc.invalidate(qc.SPECIES_SCOPE)
             return {'message': '{0} added to the NS.'.format(taxon_name)}, 201
         else:
             return {'message': 'Could not add new taxon to the NS.',
@@ -2804,7 +3073,7 @@ class SpeciesAPItypon(Resource):
 
         # get species name and its schemas
         # returns empty list if there is no species with provided identifier
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_SPECIES_AND_SCHEMAS.format(current_app.config['DEFAULTHGRAPH'], species_url)))
 
         species_info = result['results']['bindings']
@@ -2831,7 +3100,7 @@ class SpeciesProfiles(Resource):
     @api.expect(profile_model)
     @jwt_required
     def post(self, species_id):
-        """ Add an allele call profile"""
+        """ Add allele call profiles (JSON or AlleleCall TSV file)"""
 
         # get user data
         c_user = get_jwt_identity()
@@ -2840,7 +3109,7 @@ class SpeciesProfiles(Resource):
             user_url = "{0}users/{1}".format(
                 current_app.config['BASE_URL'], c_user)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('ASK where {{ <{0}> a <http://xmlns.com/foaf/0.1/Agent>; typon:Role "Admin"^^xsd:string}}'.format(user_url)))
 
             if not result['boolean']:
@@ -2849,14 +3118,19 @@ class SpeciesProfiles(Resource):
         except:
             return {"message": "Not authorized, admin only"}, 403
 
-        # get post data
-        post_data = request.get_json()
+        # profiles can be sent in JSON or in a TSV file with one
+        # genome per line that is read while the profiles are inserted
+        if request.mimetype == 'text/tab-separated-values':
+            headers, profiles = aux.read_profiles_tsv(line.decode('utf-8')
+                                                      for line in request.stream)
+        else:
+            post_data = request.get_json()
 
-        if not post_data:
-            return {"message": "No profile provided"}, 400
+            if not post_data:
+                return {"message": "No profile provided"}, 400
 
-        profile_dict = post_data["profile"]
-        headers = post_data["headers"]
+            headers = post_data["headers"]
+            profiles = iter(post_data["profile"].items())
 
         species_url = "{0}species/{1}".format(
             current_app.config['BASE_URL'], str(species_id))
@@ -2864,7 +3138,7 @@ class SpeciesProfiles(Resource):
         dict_genes = {}
 
         # get all locus from the species and their respective name, to compare to the name of the locus from the profile the user sent
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               ('select (str(?originalName) as ?originalName) ?locus '
                                'from <{0}> '
                                'where '
@@ -2875,101 +3149,41 @@ class SpeciesProfiles(Resource):
             dict_genes[str(gene['originalName']['value'])
                        ] = str(gene['locus']['value'])
 
-        genome_name = next(iter(profile_dict))
-
-        # create the new isolate id for the uri
-        nameWdata2hash = genome_name + \
-            str(dt.datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'))
-        new_isolate_id = hashlib.sha256(
-            nameWdata2hash.encode('utf-8')).hexdigest()
-
-        rdf_2_ins = ('PREFIX typon: <http://purl.phyloviz.net/ontology/typon#> \nINSERT DATA IN GRAPH <{0}> {{\n'.format(
-            current_app.config['DEFAULTHGRAPH']))
-
-        isolateUri = "{0}/isolates/{1}".format(
-            species_url, str(new_isolate_id))
-
-        # Check if isolate already exists
-        check_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                    ('ASK where {{ <{0}> a typon:Isolate }}'.format(isolateUri)))
-
-        if not check_result['boolean']:
-            return {"message": "Isolate already exists"}, 409
-
-        rdf_2_ins += ('<{0}> a typon:Isolate;\ntypon:name "{1}"^^xsd:string; typon:sentBy <{2}>;'
-                      ' typon:dateEntered "{3}"^^xsd:dateTime; typon:isFromTaxon <{4}>;'.format(isolateUri,
-                                                                                                genome_name,
-                                                                                                user_url,
-                                                                                                str(dt.datetime.now().strftime(
-                                                                                                    '%Y-%m-%dT%H:%M:%S.%f')),
-                                                                                                species_url))
-        i = 0
-        hasAlleles = 0
-
-        # build the rdf with all alleles
-        while i < len(profile_dict[genome_name]):
-            gene = headers[i+1]
-
-            # get the allele id
-            try:
-                allele = int(profile_dict[genome_name][i])
-
-            except:
-                i += 1
-                continue
-
-            # get the locus uri
-            try:
-                loci_uri = dict_genes[headers[i+1]]
-            except:
-                return {"message": ("{0} locus was not found, profile not uploaded".format(str(headers[i+1])))}, 404
-
-            # check if allele exists
-            allele_uri = "{0}/alleles/{1}".format(loci_uri, str(allele))
-
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  ('ASK where {{ <{0}> a typon:Locus; typon:hasDefinedAllele <{1}> }}'.format(loci_uri, allele_uri)))
-            if result['boolean']:
-
-                rdf_2_ins += '\ntypon:hasAllele <{0}>;'.format(allele_uri)
-                hasAlleles += 1
-
-            i += 1
-
-        # if the genome has alleles, send the rdf
-        if hasAlleles > 0:
-
-            # remove last semicolon from rdf and close the brackets
-            rdf_2_ins = rdf_2_ins[:-1]
-
-            rdf_2_ins += ".}"
-
-            # add to the queue to send the profile
-            task = add_profile.apply(args=[rdf_2_ins])
-
-            process_result = task.result
-
-            process_ran = task.ready()
-            process_sucess = task.status
-
-            if process_ran and process_sucess == "SUCCESS":
-                pass
-            else:
-                return "status: " + " run:"
-
-            process_result = task.result
-            print(process_result)
-            process_result_status_code = int(process_result[-1])
-
-            print(genome_name, str(process_result_status_code))
+        # validate and insert profiles in batches
+        isolates = []
+        valid_alleles = set()
+        while True:
+            batch = list(itertools.islice(profiles, current_app.config['PROFILE_BATCH_SIZE']))
+            if len(batch) == 0:
+                break
+
+            inserted, error = insert_profiles(batch, headers, dict_genes,
+                                              species_url, user_url,
+                                              valid_alleles)
+            isolates.extend(inserted)
+            if error is not None:
+                if len(isolates) == 0:
+                    return error
+                # report profiles inserted in previous batches
+                message, status_code = error
+                message['uploaded'] = {i[0]: i[1] for i in isolates if i[2] > 0}
+                return message, status_code
+
+        if len(isolates) == 0:
+            return {"message": "No profile provided"}, 400
 
-            if process_result_status_code > 201:
-                return {"message": "Profile not uploaded, try again "}, process_result_status_code
+        # keep the responses for single profiles
+        if len(isolates) == 1:
+            genome_name, isolateUri, nr_alleles = isolates[0]
+            if nr_alleles > 0:
+                return {"message": "Profile successfully uploaded at " + isolateUri}, 201
             else:
-                return {"message": "Profile successfully uploaded at " + isolateUri}, process_result_status_code
+                return {"message": "Profile not uploaded, no alleles to send at {0}".format(isolateUri)}, 200
 
-        else:
-            return {"message": "Profile not uploaded, no alleles to send at {0}".format(isolateUri)}, 200
+        uploaded = {i[0]: i[1] for i in isolates if i[2] > 0}
+        return {"message": "{0} of {1} profiles uploaded".format(len(uploaded), len(isolates)),
+                "uploaded": uploaded,
+                "no_alleles": [i[0] for i in isolates if i[2] == 0]}, 201 if len(uploaded) > 0 else 200
 
 
 @species_conf.route('/<int:species_id>/schemas')
@@ -2990,7 +3204,7 @@ class SchemaListAPItypon(Resource):
             current_app.config['BASE_URL'], species_id)
 
         # check if there is a species with provided identifier
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               sq.ASK_SPECIES_NS.format(species_url))
 
         species_exists = result['boolean']
@@ -2998,7 +3212,7 @@ class SchemaListAPItypon(Resource):
             return {'NOT FOUND': 'There is no species in the NS with the provided ID.'}, 404
 
         # if there is a species with the ID, get all schemas for that species
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_SPECIES_SCHEMAS.format(current_app.config['DEFAULTHGRAPH'], species_url)))
 
         species_schemas = result['results']['bindings']
@@ -3070,18 +3284,18 @@ class SchemaListAPItypon(Resource):
         species_url = '{0}species/{1}'.format(
             current_app.config['BASE_URL'], species_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               sq.ASK_SPECIES_NS.format(species_url))
 
         if not result['boolean']:
             return {'NOT FOUND': 'Species does not exist'}, 404
 
         # check if a schema already exists with this name for this species
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.ASK_SCHEMA_DESCRIPTION.format(species_url, name)))
         if result['boolean']:
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_SCHEMA.format(current_app.config['DEFAULTHGRAPH'], species_url, name)))
 
             schema_url = result['results']['bindings'][0]['schema']['value']
@@ -3089,7 +3303,7 @@ class SchemaListAPItypon(Resource):
             return {'message': 'schema with that name already exists {0}'.format(schema_url)}, 409
 
         # get schema with highest integer identifier
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_HIGHEST_SCHEMA.format(current_app.config['DEFAULTHGRAPH'], species_url)))
 
         highest_schema = result['results']['bindings']
@@ -3177,8 +3391,9 @@ class SchemaAPItypon(Resource):
         species_url = '{0}species/{1}'.format(
             current_app.config['BASE_URL'], species_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              sq.ASK_SPECIES_NS.format(species_url))
+        result = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                             'ASK_SPECIES_NS', [species_url],
+                             scopes=[qc.SPECIES_SCOPE])
 
         species_exists = result['boolean']
         if species_exists is False:
@@ -3189,20 +3404,28 @@ class SchemaAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # check if schema is deprecated
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              (sq.ASK_SCHEMA_DEPRECATED.format(schema_url)))
+        # not cached, deprecation does not change the schema version
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
+                              sq.ASK_SCHEMA_DEPRECATED.format(schema_url))
         if result['boolean'] is True:
             # check user permissions, Admin can access deprecated schemas
-            user_info = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            user_info = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                      sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri))
             user_role = user_info['results']['bindings'][0]['role']['value']
 
             if user_role != 'Admin':
                 return {'message': 'Schema is deprecated.'}, 403
 
-        # get schema info
-        schema_info = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                   (sq.SELECT_SPECIES_SCHEMA.format(current_app.config['DEFAULTHGRAPH'], schema_url)))
+        # get schema info, cached while the schema is not modified
+        # or locked by other processes
+        schema_version = qc.schema_version(current_app.config['LOCAL_SPARQL'],
+                                           current_app.config['DEFAULTHGRAPH'],
+                                           schema_url)
+        schema_info = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                                  'SELECT_SPECIES_SCHEMA',
+                                  [current_app.config['DEFAULTHGRAPH'], schema_url],
+                                  scopes=[qc.SCHEMAS_SCOPE, schema_url],
+                                  version=schema_version)
 
         schema_properties = schema_info['results']['bindings']
 
@@ -3246,7 +3469,7 @@ class SchemaAPItypon(Resource):
             schema_url = '{0}species/{1}/schemas/{2}'.format(
                 current_app.config['BASE_URL'], species_id, schema_id)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.ASK_SCHEMA_OWNERSHIP.format(schema_url, user_url)))
 
             if not result['boolean']:
@@ -3262,6 +3485,7 @@ class SchemaAPItypon(Resource):
                                    current_app.config['VIRTUOSO_PASS'])
 
             if result.status_code in [200, 201]:
+                qc.invalidate(schema_url)
                 return {'message': 'Schema sucessfully removed.'}, 201
             else:
                 return {'message': 'Sum Thing Wong.'}, result.status_code
@@ -3292,7 +3516,7 @@ class SchemaAdminAPItypon(Resource):
         schema_uri = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.ASK_SCHEMA_OWNERSHIP.format(schema_uri, user_uri)))
 
         administers = result['boolean']
@@ -3319,7 +3543,7 @@ class SchemaModDateAPItypon(Resource):
         schema_uri = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_SCHEMA_DATE.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         result_data = result['results']['bindings']
@@ -3352,7 +3576,7 @@ class SchemaModDateAPItypon(Resource):
         user_url = '{0}users/{1}'.format(
             current_app.config['BASE_URL'], c_user)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_url)))
 
         # create schema URI
@@ -3362,7 +3586,7 @@ class SchemaModDateAPItypon(Resource):
         user_role = result['results']['bindings'][0]['role']['value']
 
         # get schema locking status
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         # get post data
@@ -3385,7 +3609,7 @@ class SchemaModDateAPItypon(Resource):
             return {'Invalid Argument': 'Invalid date format. Please provide a date in format Y-M-DTH:M:S'}, 400
 
         # get schema info
-        schema_info = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        schema_info = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    (sq.SELECT_SPECIES_SCHEMA.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         schema_properties = schema_info['results']['bindings']
@@ -3429,6 +3653,8 @@ class SchemaModDateAPItypon(Resource):
                                                 current_app.config['VIRTUOSO_USER'],
                                                 current_app.config['VIRTUOSO_PASS'])
 
+        qc.invalidate(schema_uri)
+
         if last_modified_result.status_code in [200, 201]:
             return {'message': 'Changed schema modification date.'}, 201
         else:
@@ -3453,7 +3679,7 @@ class SchemaLockAPItypon(Resource):
         schema_uri = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         result_data = result['results']['bindings']
@@ -3488,7 +3714,7 @@ class SchemaLockAPItypon(Resource):
         user_url = '{0}users/{1}'.format(
             current_app.config['BASE_URL'], c_user)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_url)))
 
         # create schema URI
@@ -3498,7 +3724,7 @@ class SchemaLockAPItypon(Resource):
         user_role = result['results']['bindings'][0]['role']['value']
 
         # get schema locking status
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         # get post data
@@ -3560,6 +3786,8 @@ class SchemaLockAPItypon(Resource):
                                        current_app.config['VIRTUOSO_USER'],
                                        current_app.config['VIRTUOSO_PASS'])
 
+        qc.invalidate(schema_uri)
+
         if result.status_code in [200, 201]:
             return {'message': 'Schema sucessfully locked/unlocked.'}, 201
         else:
@@ -3586,7 +3814,7 @@ class SchemaPtfAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # get the prodigal training file hash
-        ptf_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        ptf_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                  (sq.SELECT_SCHEMA_PTF.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         ptf_hash = ptf_query['results']['bindings'][0]['ptf']['value']
@@ -3620,7 +3848,7 @@ class SchemaPtfAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # get the prodigal training file hash
-        ptf_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        ptf_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                  (sq.SELECT_SCHEMA_PTF.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         ptf_hash = ptf_query['results']['bindings'][0]['ptf']['value']
@@ -3665,7 +3893,7 @@ class SchemaZipAPItypon(Resource):
         schema_uri = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
 
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings']
         if len(locking_status) == 0:
@@ -3680,16 +3908,18 @@ class SchemaZipAPItypon(Resource):
 
         root_dir = os.path.abspath(current_app.config['SCHEMAS_ZIP'])
 
-        schema_zip = [z for z in os.listdir(
-            root_dir) if z.startswith(zip_prefix) is True]
-        if len(schema_zip) == 1 and '.zip' in schema_zip[0]:
+        # archives are written with a temporary name and renamed
+        # when complete, the previous version is served until then
+        root_files = os.listdir(root_dir)
+        schema_zip = aux.compressed_versions(root_files, zip_prefix)
+        if len(schema_zip) > 0:
             if request_type == 'check':
-                return {'zip': schema_zip}, 200
+                return {'zip': schema_zip[-1:]}, 200
             elif request_type == 'download':
-                return send_from_directory(root_dir, schema_zip[0], as_attachment=True)
-        elif (len(schema_zip) == 1 and '.zip' not in schema_zip[0]) or len(schema_zip) > 1:
+                return send_from_directory(root_dir, schema_zip[-1], as_attachment=True)
+        elif '{0}_temp'.format(zip_prefix) in root_files:
             return {'Working': 'A new compressed version of the schema is being created. Please try again later.'}, 403
-        elif len(schema_zip) == 0:
+        else:
             return {'Not found': 'Could not find a compressed version of specified schema.'}, 404
 
     # send post to compress single schema
@@ -3710,14 +3940,14 @@ class SchemaZipAPItypon(Resource):
         user_uri = '{0}users/{1}'.format(
             current_app.config['BASE_URL'], user_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
         user_role = result['results']['bindings'][0]['role']['value']
 
         # check if schema is locked
         schema_uri = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings']
         if len(locking_status) == 0:
@@ -3767,7 +3997,7 @@ class SchemaDescriptionAPItypon(Resource):
         schema_uri = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_SCHEMA_DESCRIPTION.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
 
         schema_description = result['results']['bindings']
@@ -3815,7 +4045,7 @@ class SchemaDescriptionAPItypon(Resource):
         # check the role of the user that is trying to access
         user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
         user_role = result['results']['bindings'][0]['role']['value']
@@ -3823,14 +4053,14 @@ class SchemaDescriptionAPItypon(Resource):
         # only add description if user is Admin or Contributor that created the schema
         if 'Admin' not in user_role:
             # only the Contributor that started schema upload might add a description
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.ASK_SCHEMA_OWNERSHIP.format(schema_uri, user_uri)))
 
             if not result['boolean']:
                 return {'message': 'Schema is not administrated by current user.'}, 403
 
             # only add description if schema has not been fully uploaded
-            date_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            date_result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    (sq.ASK_SCHEMA_DATE.format(schema_uri, 'dateEntered', 'singularity')))
 
             if date_result['boolean'] is False:
@@ -3881,8 +4111,9 @@ class SchemaLociAPItypon(Resource):
         species_url = '{0}species/{1}'.format(
             current_app.config['BASE_URL'], species_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              sq.ASK_SPECIES_NS.format(species_url))
+        result = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                             'ASK_SPECIES_NS', [species_url],
+                             scopes=[qc.SPECIES_SCOPE])
 
         species_exists = result['boolean']
         if species_exists is False:
@@ -3892,50 +4123,72 @@ class SchemaLociAPItypon(Resource):
         schema_url = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                              (sq.ASK_SCHEMA.format(schema_url)))
+        result = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                             'ASK_SCHEMA', [schema_url],
+                             scopes=[qc.SCHEMAS_SCOPE, schema_url])
 
         if result['boolean'] is False:
             return {'message': 'Schema not found.'}, 404
 
+        # cached results are valid while the schema is not modified
+        schema_version = qc.schema_version(current_app.config['LOCAL_SPARQL'],
+                                           current_app.config['DEFAULTHGRAPH'],
+                                           schema_url)
+        cache_scopes = [qc.SCHEMAS_SCOPE, schema_url]
+
         # if date is provided the request returns the alleles that were added after that specific date for all loci
         # else the request returns the list of loci
         # a correct request returns also the server date at which the request was done
         if 'local_date' in request_data:
 
+            query_params = [current_app.config['DEFAULTHGRAPH'], schema_url,
+                            request_data['local_date'], request_data['ns_date']]
+
+            # headers are sent before the alleles, get the date of
+            # the last allele that will be sent first
+            result = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                                 'SELECT_SCHEMA_LATEST_DATE',
+                                 query_params,
+                                 scopes=cache_scopes,
+                                 version=schema_version)
+
+            try:
+                latest = result['results']['bindings'][0]
+            except (TypeError, KeyError, IndexError):
+                return {'message': 'Could not retrieve the alleles added to the schema.'}, 500
+
             # query all alleles for the loci of the schema since a specific date, sorted from oldest to newest (limit of max 50k records)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.SELECT_SCHEMA_LATEST_FASTA.format(current_app.config['DEFAULTHGRAPH'], schema_url,
-                                                                        request_data['local_date'], request_data['ns_date'])))
+            # alleles are streamed from Virtuoso while they are sent
+            new_alleles = qc.stream_data(current_app.config['LOCAL_SPARQL'],
+                                         'SELECT_SCHEMA_LATEST_FASTA',
+                                         query_params,
+                                         scopes=cache_scopes,
+                                         version=schema_version)
 
-            new_alleles = result['results']['bindings']
-            number_of_alleles = len(new_alleles)
+            if isinstance(new_alleles, Exception):
+                return {'message': 'Could not retrieve the alleles added to the schema.'}, 500
 
-            # if there are no new alleles
-            if number_of_alleles == 0:
+            response = Response(stream_with_context(generate('newAlleles', new_alleles)),
+                                content_type='application/json')
 
-                response = Response(stream_with_context(generate('newAlleles', new_alleles)),
-                                    content_type='application/json')
+            # if there are no new alleles
+            if 'last_date' not in latest:
                 # if there are no alleles, return server date information
                 response.headers.set('Server-Date', request_data['ns_date'])
             else:
-                # get the allele with the latest date from all retrieved alleles
-                latest_allele = new_alleles[-1]
-
-                # get allele date
-                latest_datetime = latest_allele['date']['value']
-
-                response = Response(stream_with_context(generate('newAlleles', new_alleles)),
-                                    content_type='application/json')
-                response.headers.set('Last-Allele', latest_datetime)
+                # date of the allele with the latest date from all retrieved alleles
+                response.headers.set('Last-Allele', latest['last_date']['value'])
 
             return response
 
         # if no date provided, query for all loci for the schema
         else:
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.SELECT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_url)))
+            result = qc.get_data(current_app.config['LOCAL_SPARQL'],
+                                 'SELECT_SCHEMA_LOCI',
+                                 [current_app.config['DEFAULTHGRAPH'], schema_url],
+                                 scopes=cache_scopes,
+                                 version=schema_version)
 
             # check if schema has loci
             loci_list = result['results']['bindings']
@@ -3971,14 +4224,14 @@ class SchemaLociAPItypon(Resource):
         schema_url = '{0}species/{1}/schemas/{2}'.format(
             current_app.config['BASE_URL'], species_id, schema_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               sq.ASK_SCHEMA_DEPRECATED2.format(schema_url))
 
         if result['boolean']:
             return {'message': 'Schema not found.'}, 404
 
         # determine if schema is locked
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_url)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
@@ -3989,7 +4242,7 @@ class SchemaLociAPItypon(Resource):
             user_url = '{0}users/{1}'.format(
                 current_app.config['BASE_URL'], c_user)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_url)))
 
             user_role = result['results']['bindings'][0]['role']['value']
@@ -4005,14 +4258,14 @@ class SchemaLociAPItypon(Resource):
         new_locus_url = '{0}loci/{1}'.format(
             current_app.config['BASE_URL'], loci_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               ('ASK where {{ <{0}> a typon:Locus}}'.format(new_locus_url)))
 
         if not result['boolean']:
             return {'message': 'Could not find locus with provided ID.'}, 404
 
         # check if locus already exists on schema
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.ASK_SCHEMA_LOCUS.format(schema_url, new_locus_url)))
 
         if result['boolean']:
@@ -4066,7 +4319,7 @@ class SchemaLociDataAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # check if schema has been fully uploaded
-        date_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        date_result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    (sq.ASK_SCHEMA_DATE.format(schema_uri, 'dateEntered', 'singularity')))
 
         if not date_result['boolean']:
@@ -4082,15 +4335,15 @@ class SchemaLociDataAPItypon(Resource):
             return {'message': 'There is no temp folder for specified schema.'}, 404
 
         # count number of loci in Chewie-NS
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                     (sq.COUNT_TOTAL_LOCI.format(current_app.config['DEFAULTHGRAPH'])))
         nr_loci = result['results']['bindings'][0]['count']['value']
         # links to species
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                     (sq.COUNT_SPECIES_LOCI.format(current_app.config['DEFAULTHGRAPH'], species_uri)))
         sp_loci = result['results']['bindings'][0]['count']['value']
         # links to schema
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                     (sq.COUNT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         sc_loci = result['results']['bindings'][0]['count']['value']
 
@@ -4142,14 +4395,14 @@ class SchemaLociDataAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # check if schema has been fully uploaded
-        date_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        date_result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    (sq.ASK_SCHEMA_DATE.format(schema_uri, 'dateEntered', 'singularity')))
 
         if not date_result['boolean']:
             return {'message': 'Cannot add loci after schema has been fully uploaded.'}, 403
 
         # determine if schema is locked
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
@@ -4157,7 +4410,7 @@ class SchemaLociDataAPItypon(Resource):
             # check the role of the user that is trying to access
             user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
             user_role = result['results']['bindings'][0]['role']['value']
@@ -4209,15 +4462,15 @@ class SchemaLociDataAPItypon(Resource):
         elif len(valid) == 0:
 
             # count number of loci in Chewie-NS
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                         (sq.COUNT_TOTAL_LOCI.format(current_app.config['DEFAULTHGRAPH'])))
             nr_loci = result['results']['bindings'][0]['count']['value']
             # links to species
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                         (sq.COUNT_SPECIES_LOCI.format(current_app.config['DEFAULTHGRAPH'], species_uri)))
             sp_loci = result['results']['bindings'][0]['count']['value']
             # links to schema
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                         (sq.COUNT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
             sc_loci = result['results']['bindings'][0]['count']['value']
 
@@ -4293,7 +4546,7 @@ class SchemaLociIdAPItypon(Resource):
                 current_app.config['BASE_URL'], species_id, schema_id)
 
             # this will return FALSE for Admin if the schema was uploaded by a Contributor?
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('ASK where {{ <{0}> a typon:Schema; typon:administratedBy <{1}>;'
                                    ' typon:deprecated  "true"^^xsd:boolean }}'.format(schema_url, user_url)))
 
@@ -4304,20 +4557,20 @@ class SchemaLociIdAPItypon(Resource):
             locus_url = "{0}species/{1}/loci/{2}".format(
                 current_app.config['BASE_URL'], species_id, request_data["loci_id"])
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.ASK_LOCUS.format(locus_url)))
 
             if not result['boolean']:
                 return {"message": "Locus not found"}, 404
 
             # check if locus exists on schema
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.ASK_SCHEMA_LOCUS2.format(schema_url, locus_url)))
 
             if not result['boolean']:
                 return {"message": "Locus already on schema"}, 409
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?parts '
                                    'from <{0}> '
                                    'where '
@@ -4336,6 +4589,7 @@ class SchemaLociIdAPItypon(Resource):
                                    current_app.config['VIRTUOSO_PASS'])
 
             if result.status_code in [200, 201]:
+                qc.invalidate(schema_url)
                 return {"message": "Locus sucessfully removed from schema"}, 201
             else:
                 return {"message": "Could not remove locus from schema."}, result.status_code
@@ -4362,14 +4616,14 @@ class SchemaLociDataAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # check if schema has been fully uploaded
-        date_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        date_result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    (sq.ASK_SCHEMA_DATE.format(schema_uri, 'dateEntered', 'singularity')))
 
         if not date_result['boolean']:
             return {'message': 'Cannot add initial set of alleles after schema has been fully uploaded.'}, 403
 
         # determine if schema is locked
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
@@ -4377,7 +4631,7 @@ class SchemaLociDataAPItypon(Resource):
             # check the role of the user that is trying to access
             user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
             user_role = result['results']['bindings'][0]['role']['value']
@@ -4446,7 +4700,7 @@ class SchemaStatusAPItypon(Resource):
 
         user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
         user_role = result['results']['bindings'][0]['role']['value']
@@ -4455,13 +4709,13 @@ class SchemaStatusAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # check if schema exists
-        schema_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        schema_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.ASK_SCHEMA.format(schema_uri)))
         if schema_query['boolean'] is False:
             return {'Not found': 'Could not find a schema with specified ID.'}, 404
 
         # determine if schema is locked
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
@@ -4469,26 +4723,26 @@ class SchemaStatusAPItypon(Resource):
             locking_status = 'LOCKED'
 
         # determine last modification date
-        date_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        date_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.SELECT_SCHEMA_DATE.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         modification_date = date_query['results']['bindings'][0]['last_modified']['value']
 
         # count number of alleles
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         nr_alleles = result['results']['bindings'][0]['nr_alleles']['value']
 
         # count number of loci
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.COUNT_SCHEMA_LOCI.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         nr_loci = result['results']['bindings'][0]['count']['value']
 
         # determine compressed version date
         compressed_dir = os.path.abspath(current_app.config['SCHEMAS_ZIP'])
-        compressed_schema = [f for f in os.listdir(compressed_dir)
-                                if f.startswith('{0}_{1}'.format(species_id, schema_id))]
-        if len(compressed_schema) > 0 and 'temp' not in compressed_schema[0]:
-            compressed_schema = compressed_schema[0].split('_')[-1].rstrip('.zip')
+        compressed_schema = aux.compressed_versions(os.listdir(compressed_dir),
+                                                    '{0}_{1}'.format(species_id, schema_id))
+        if len(compressed_schema) > 0:
+            compressed_schema = aux.archive_date(compressed_schema[-1])
         else:
             compressed_schema = 'N/A'
 
@@ -4526,7 +4780,7 @@ class SchemaLociUpdateAPItypon(Resource):
 
         user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
         user_role = result['results']['bindings'][0]['role']['value']
@@ -4535,18 +4789,18 @@ class SchemaLociUpdateAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # check if schema exists
-        schema_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        schema_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.ASK_SCHEMA.format(schema_uri)))
         if schema_query['boolean'] is False:
             return {'Not found': 'Could not find a schema with specified ID.'}, 404
 
         # determine if schema is locked
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
         # count number of alleles
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
             (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         nr_alleles = result['results']['bindings'][0]['nr_alleles']['value']
 
@@ -4606,14 +4860,14 @@ class SchemaLociUpdateAPItypon(Resource):
         locus_uri = '{0}loci/{1}'.format(current_app.config['BASE_URL'], loci_id)
 
         # check if locus is linked to schema
-        schema_locus = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        schema_locus = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                     sq.ASK_SCHEMA_LOCUS.format(schema_uri, locus_uri))
 
         if schema_locus['boolean'] is False:
             return {'Not Found': 'Schema has no locus with provided ID.'}
 
         # determine if schema is locked
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
@@ -4623,7 +4877,7 @@ class SchemaLociUpdateAPItypon(Resource):
             # check the role of the user that is trying to access
             user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
             user_role = result['results']['bindings'][0]['role']['value']
@@ -4648,7 +4902,7 @@ class SchemaLociUpdateAPItypon(Resource):
 
         if 'complete' in request.headers:
             # count number of alleles in schema
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
             nr_alleles = result['results']['bindings'][0]['nr_alleles']['value']
 
@@ -4688,7 +4942,7 @@ class SchemaLociLengthsAPItypon(Resource):
             current_app.config['BASE_URL'], species_id, schema_id)
 
         # determine if schema is locked
-        locking_status_query = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        locking_status_query = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             (sq.SELECT_SCHEMA_LOCK.format(current_app.config['DEFAULTHGRAPH'], schema_uri)))
         locking_status = locking_status_query['results']['bindings'][0]['Schema_lock']['value']
 
@@ -4696,7 +4950,7 @@ class SchemaLociLengthsAPItypon(Resource):
             # check the role of the user that is trying to access
             user_uri = '{0}users/{1}'.format(current_app.config['BASE_URL'], c_user)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_USER.format(current_app.config['DEFAULTHGRAPH'], user_uri)))
 
             user_role = result['results']['bindings'][0]['role']['value']
@@ -4707,54 +4961,23 @@ class SchemaLociLengthsAPItypon(Resource):
         locus_uri = '{0}loci/{1}'.format(current_app.config['BASE_URL'], loci_id)
 
         # check if locus is linked to schema
-        schema_locus = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        schema_locus = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                     sq.ASK_SCHEMA_LOCUS.format(schema_uri, locus_uri))
 
         if schema_locus['boolean'] is False:
             return {'Not Found': 'Schema has no locus with provided ID.'}
 
-        root_dir = os.path.abspath(current_app.config['PRE_COMPUTE'])
-
-        # directory that stores the files with alleles length values
-        schema_dir = os.path.join(root_dir, '{0}_{1}_lengths'.format(species_id, schema_id))
-
         request_data = request.get_json()
 
-        schemas_temp = os.path.abspath(current_app.config['SCHEMA_UP'])
-        schema_temp = os.path.join(schemas_temp, '{0}_{1}'.format(species_id, schema_id))
-
+        # merge the alleles lengths sent for the locus
         file_content = request_data['content']
-        file_content = {locus_uri: file_content[k] for k in file_content}
-
-        # if file does not exist
-        if os.path.isdir(schema_dir) is False:
-            os.mkdir(schema_dir)
+        alleles = {}
+        for k in file_content:
+            alleles.update(file_content[k])
 
-        locus_file = os.path.join(schema_dir, '{0}_{1}_{2}'.format(species_id, schema_id, loci_id))
-
-        if os.path.isfile(locus_file) is False:
-            with open(locus_file, 'wb') as lf:
-                pickle.dump(file_content, lf)
-        else:
-            with open(locus_file, 'rb') as lf:
-                locus_data = pickle.load(lf)
-
-            ns_data = locus_data[locus_uri]
-            user_data = file_content[locus_uri]
-
-            ns_alleles = set(ns_data)
-            user_alleles = set(user_data)
-
-            # determine new alleles
-            new_alleles = user_alleles - ns_alleles
-            # add new alleles
-            for a in new_alleles:
-                ns_data[a] = user_data[a]
-
-            locus_data[locus_uri] = ns_data
-
-            with open(locus_file, 'wb') as lf:
-                pickle.dump(locus_data, lf)
+        # only new alleles are appended to the store of the schema
+        store = lengths_store.schema_store(species_id, schema_id)
+        store.append({int(loci_id): alleles})
 
         return {'OK': 'Received file alleles lengths to add to schema info.'}, 201
 
@@ -4797,7 +5020,7 @@ class LociListAPItypon(Resource):
         species_url = '{0}species/{1}'.format(
             current_app.config['BASE_URL'], species_id)
 
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               sq.ASK_SPECIES_NS.format(species_url))
 
         if not result['boolean']:
@@ -4816,13 +5039,18 @@ class LociListAPItypon(Resource):
             sequence_uri = '{0}sequences/{1}'.format(
                 current_app.config['BASE_URL'], sequence_hash)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                  (sq.SELECT_LOCI_WITH_DNA.format(current_app.config['DEFAULTHGRAPH'], sequence_uri, species_url)))
+            # sequences without alleles are not in any locus
+            indexed = sequence_index.lookup(sequence_hash)
+            if indexed is not None and len(indexed[1]) == 0:
+                res_loci = []
+            else:
+                result = aux.get_data(current_app.config['LOCAL_SPARQL'],
+                                      (sq.SELECT_LOCI_WITH_DNA.format(current_app.config['DEFAULTHGRAPH'], sequence_uri, species_url)))
 
-            res_loci = result['results']['bindings']
+                res_loci = result['results']['bindings']
         else:
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_SPECIES_LOCI.format(current_app.config['DEFAULTHGRAPH'], species_url)))
 
             res_loci = result['results']['bindings']
@@ -4862,7 +5090,7 @@ class LociListAPItypon(Resource):
 
         spec_url = '{0}species/{1}'.format(
             current_app.config['BASE_URL'], species_id)
-        result_spec = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_spec = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                    (sq.ASK_SPECIES_NS.format(spec_url)))
 
         if not result_spec['boolean']:
@@ -4871,7 +5099,7 @@ class LociListAPItypon(Resource):
         new_locus_url = '{0}loci/{1}'.format(
             current_app.config['BASE_URL'], post_data['locus_id'])
 
-        result_locus = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_locus = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                     (sq.ASK_LOCUS.format(new_locus_url)))
 
         if not result_locus['boolean']:
@@ -4995,7 +5223,7 @@ class IsolatesListAPItypon(Resource):
         if isolName:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], species_id)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?date '
                                    'from <{0}> '
                                    'where '
@@ -5005,7 +5233,7 @@ class IsolatesListAPItypon(Resource):
         elif startDate and endDate:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], species_id)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5018,7 +5246,7 @@ class IsolatesListAPItypon(Resource):
         elif endDate:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], species_id)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5030,7 +5258,7 @@ class IsolatesListAPItypon(Resource):
         elif startDate:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], species_id)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5043,7 +5271,7 @@ class IsolatesListAPItypon(Resource):
         else:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], str(species_id))
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5067,7 +5295,7 @@ class IsolatesListAPItypon(Resource):
         isolate_id = latestIsolate['isolate']['value']
 
         # get latest isolate submission date
-        result2 = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result2 = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                ('select ?date '
                                 'from <{0}> '
                                 'where '
@@ -5177,7 +5405,7 @@ class IsolatesUserListAPItypon(Resource):
         if isolName:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], str(species_id))
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?date '
                                    'from <{0}> '
                                    'where '
@@ -5188,7 +5416,7 @@ class IsolatesUserListAPItypon(Resource):
         elif startDate and endDate:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], species_id)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5203,7 +5431,7 @@ class IsolatesUserListAPItypon(Resource):
         elif endDate:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], species_id)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5217,7 +5445,7 @@ class IsolatesUserListAPItypon(Resource):
         elif startDate:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], str(species_id))
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5231,7 +5459,7 @@ class IsolatesUserListAPItypon(Resource):
         else:
             new_spec_url = "{0}species/{1}".format(
                 current_app.config['BASE_URL'], species_id)
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('select ?isolate ?name '
                                    'from <{0}> '
                                    'where {{'
@@ -5256,7 +5484,7 @@ class IsolatesUserListAPItypon(Resource):
         isolate_id = latestIsolate['isolate']['value']
 
         # get latest isolate submission date
-        result2 = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result2 = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                ('select ?date '
                                 'from <{0}> '
                                 'where '
@@ -5328,8 +5556,7 @@ class IsolatesAPItypon(Resource):
                  'OPTIONAL{{<{1}> <http://www.w3.org/2003/01/geo/wgs84_pos#long> ?long.}} '
                  'OPTIONAL{{<{1}> typon:isolationSource ?isol_source.}} }}'.format(current_app.config['DEFAULTHGRAPH'], new_isol_url))
 
-        result = aux.get_data(SPARQLWrapper(
-            current_app.config['LOCAL_SPARQL']), query)
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'], query)
 
         try:
             return (result["results"]["bindings"])
@@ -5360,7 +5587,7 @@ class IsolatesAPItypon(Resource):
             new_user_url = "{0}users/{1}".format(
                 current_app.config['BASE_URL'], c_user)
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   ('ASK where {{ <{0}> a <http://xmlns.com/foaf/0.1/Agent>; '
                                    'typon:Role "Admin"^^xsd:string}}'.format(new_user_url)))
 
@@ -5371,7 +5598,7 @@ class IsolatesAPItypon(Resource):
             return {"message": "Not authorized, admin only"}, 403
 
         # count number of isolates already created for that species, build the new isolate uri and send to server
-        # result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),'select (COUNT(?isolate) as ?count) where { ?isolate a typon:Isolate . }')
+        # result = aux.get_data(current_app.config['LOCAL_SPARQL'],'select (COUNT(?isolate) as ?count) where { ?isolate a typon:Isolate . }')
         # print(result)
         # number_isolates_spec = int(result["results"]["bindings"][0]['count']['value'])
 
@@ -5395,8 +5622,7 @@ class IsolatesAPItypon(Resource):
                  'OPTIONAL{{<{1}> <http://www.w3.org/2003/01/geo/wgs84_pos#long> ?long.}} '
                  'OPTIONAL{{<{1}> typon:isolationSource ?isol_source.}} }}'.format(current_app.config['DEFAULTHGRAPH'], new_isol_url))
 
-        result_meta = aux.get_data(SPARQLWrapper(
-            current_app.config['LOCAL_SPARQL']), query)
+        result_meta = aux.get_data(current_app.config['LOCAL_SPARQL'], query)
 
         result_meta = result_meta["results"]["bindings"][0]
 
@@ -5499,8 +5725,7 @@ class IsolatesAPItypon(Resource):
 
                 print("searching on host..")
 
-                result2 = aux.get_data(SPARQLWrapper(
-                    current_app.config['UNIPROT_SPARQL']), query)
+                result2 = aux.get_data(current_app.config['UNIPROT_SPARQL'], query)
                 try:
                     url = result2["results"]["bindings"][0]['taxon']['value']
                     data2sendlist.append(' typon:host <'+url+'>')
@@ -5523,8 +5748,7 @@ class IsolatesAPItypon(Resource):
 
                     print("searching on uniprot..")
 
-                    result2 = aux.get_data(SPARQLWrapper(
-                        current_app.config['UNIPROT_SPARQL']), query)
+                    result2 = aux.get_data(current_app.config['UNIPROT_SPARQL'], query)
                     try:
                         url = result2["results"]["bindings"][0]['taxon']['value']
                         data2sendlist.append(' typon:host <' + url + '>')
@@ -5620,8 +5844,7 @@ class IsolatesAPItypon(Resource):
                      'FILTER (STRLANG("{0}", "en") = LCASE(?label) ) }}'.format(country_name))
             print("searching country on dbpedia..")
 
-            result = aux.get_data(SPARQLWrapper(
-                current_app.config['DBPEDIA_SPARQL']), query)
+            result = aux.get_data(current_app.config['DBPEDIA_SPARQL'], query)
             try:
                 country_url = result["results"]["bindings"][0]['country']['value']
                 label = result["results"]["bindings"][0]['label']['value']
@@ -5637,8 +5860,7 @@ class IsolatesAPItypon(Resource):
                              'FILTER (STRLANG("{0}", "en") = LCASE(?longName) ) }}'.format(country_name))
 
                     print("searching on dbpedia for the long name..")
-                    result = aux.get_data(SPARQLWrapper(
-                        current_app.config['DBPEDIA_SPARQL']), query)
+                    result = aux.get_data(current_app.config['DBPEDIA_SPARQL'], query)
                     country_url = result["results"]["bindings"][0]['country']['value']
                     label = result["results"]["bindings"][0]['label']['value']
                     data2sendlist.append(
@@ -5730,7 +5952,7 @@ class IsolatesAlleles(Resource):
             current_app.config['BASE_URL'], str(species_id), str(isolate_id))
 
         # get all alleles from the isolate, independent of schema
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               ('select ?alleles '
                                'from <{0}> '
                                'where '
@@ -5771,28 +5993,28 @@ class IsolatesAlleles(Resource):
                                               str(post_data["allele_id"]))
 
         # check if isolate exists
-        result_isolate = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_isolate = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                       ('ASK where {{ <{0}> a typon:Isolate .}}'.format(isolate_url)))
 
         if not result_isolate['boolean']:
             return {"message": "Isolate not found"}, 404
 
         # check if locus exists
-        result_locus = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_locus = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                     ('ASK where {{ <{0}> a typon:Locus .}}'.format(locus_url)))
 
         if not result_locus['boolean']:
             return {"message": "Locus not found"}, 404
 
         # check if allele exists
-        result_allele = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_allele = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                      ('ASK where {{ <{0}> a typon:Locus; typon:hasDefinedAllele <{1}> }}'.format(locus_url, allele_url)))
 
         if not result_allele['boolean']:
             return {"message": "Allele does not exist for that locus"}, 404
 
         # check if locus already exists on isolate
-        result_locus_isolate = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result_locus_isolate = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                             ('ASK where {{ <{0}> typon:hasAllele ?alleles. '
                                              '?alleles typon:isOfLocus <{1}>.}}'.format(isolate_url, locus_url)))
 
@@ -5852,7 +6074,7 @@ class IsolatesSchema(Resource):
             schema_uri = "{0}/schemas/{1}".format(
                 species_url, str(request_data["schema_id"]))
 
-            result_schema = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result_schema = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                          ('ASK where {{ <{0}> a typon:Schema. '
                                           'FILTER NOT EXISTS {{ <{0}> typon:deprecated  "true"^^xsd:boolean }} }}'.format(schema_uri)))
 
@@ -5863,7 +6085,7 @@ class IsolatesSchema(Resource):
             isolate_url = "{0}/isolates/{1}".format(
                 species_url, str(isolate_id))
 
-            result_isolate = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result_isolate = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                           ('ASK where {{ <{0}> a typon:Isolate .}}'.format(isolate_url)))
 
             if not result_isolate['boolean']:
@@ -5880,8 +6102,7 @@ class IsolatesSchema(Resource):
                                     '?locus typon:name ?name. '
                                     'FILTER NOT EXISTS {{ ?part typon:deprecated  "true"^^xsd:boolean }}.}} }} }}'.format(current_app.config['DEFAULTHGRAPH'], isolate_url, schema_uri))
 
-            result_schema_isolate = aux.get_data(SPARQLWrapper(
-                current_app.config['LOCAL_SPARQL']), schema_isolate_query)
+            result_schema_isolate = aux.get_data(current_app.config['LOCAL_SPARQL'], schema_isolate_query)
 
             try:
                 return (result_schema_isolate["results"]["bindings"])
@@ -5895,7 +6116,7 @@ class IsolatesSchema(Resource):
             isolate_url = "{0}species/{1}/isolates/{2}".format(
                 current_app.config['BASE_URL'], str(species_id), str(isolate_id))
 
-            result_isolate = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result_isolate = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                           ('ASK where {{ <{0}> a typon:Isolate .}}'.format(isolate_url)))
 
             if not result_isolate['boolean']:
@@ -5912,8 +6133,7 @@ class IsolatesSchema(Resource):
                                     '?locus typon:name ?name. '
                                     'FILTER NOT EXISTS {{ ?part typon:deprecated  "true"^^xsd:boolean }}.}} }} }}'.format(current_app.config['DEFAULTHGRAPH'], isolate_url))
 
-            result_schema_isolate = aux.get_data(SPARQLWrapper(
-                current_app.config['LOCAL_SPARQL']), schema_isolate_query)
+            result_schema_isolate = aux.get_data(current_app.config['LOCAL_SPARQL'], schema_isolate_query)
 
             try:
                 return (result_schema_isolate["results"]["bindings"])
@@ -5945,7 +6165,7 @@ class SequencesListAPItypon(Resource):
 
         # query number of sequences on database
         # should return 0 if there are no sequences
-        result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+        result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                               (sq.COUNT_SEQUENCES.format(current_app.config['DEFAULTHGRAPH'])))
 
         number_sequences = result['results']['bindings'][0]['count']['value']
@@ -6014,13 +6234,22 @@ class SequencesAPItypon(Resource):
                 current_app.config['BASE_URL'], seq_hash)
 
             # check if the sequence exists
-            result_existence = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
-                                            (sq.ASK_SEQUENCE_HASH.format(seq_url)))
+            # Virtuoso is only queried if the local index is not available
+            indexed = sequence_index.lookup(seq_hash)
+            if indexed is None:
+                result_existence = aux.get_data(current_app.config['LOCAL_SPARQL'],
+                                                (sq.ASK_SEQUENCE_HASH.format(seq_url)))
+                exists = result_existence['boolean']
+            else:
+                exists = indexed[0] is not None
 
-            if not result_existence['boolean']:
+            if not exists:
                 return {'message': 'Provided DNA sequence is not in the NS.'}, 404
 
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            if indexed is not None and len(indexed[1]) == 0:
+                return {'message': 'Sequence is in the NS but is not linked to any locus.'}, 404
+
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_SEQUENCE_INFO_BY_DNA.format(current_app.config['DEFAULTHGRAPH'], seq_url, query_part)))
 
             sequence_info = result['results']['bindings']
@@ -6029,7 +6258,7 @@ class SequencesAPItypon(Resource):
 
             locus_url = sequence_info[0]["locus"]["value"]
             
-            locus_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            locus_result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                       (sq.COUNT_LOCUS_ALLELES.format(current_app.config['DEFAULTHGRAPH'], locus_url)))
                       
             number_alleles_loci = int(
@@ -6043,8 +6272,13 @@ class SequencesAPItypon(Resource):
             seq_url = '{0}sequences/{1}'.format(
                 current_app.config['BASE_URL'], request_data['seq_id'])
 
+            # sequences that are not in the index have no information
+            indexed = sequence_index.lookup(request_data['seq_id'])
+            if indexed is not None and len(indexed[1]) == 0:
+                return {'NOT FOUND': 'Could not find information for a sequence with provided hash.'}, 404
+
             # get information on sequence, DNA string, uniprot URI and uniprot label
-            result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                                   (sq.SELECT_SEQUENCE_INFO_BY_HASH.format(current_app.config['DEFAULTHGRAPH'], seq_url, query_part)))
 
             sequence_info = result['results']['bindings']
@@ -6054,7 +6288,7 @@ class SequencesAPItypon(Resource):
 
             locus_url = sequence_info[0]["locus"]["value"]
             
-            locus_result = aux.get_data(SPARQLWrapper(current_app.config['LOCAL_SPARQL']),
+            locus_result = aux.get_data(current_app.config['LOCAL_SPARQL'],
                       (sq.COUNT_LOCUS_ALLELES.format(current_app.config['DEFAULTHGRAPH'], locus_url)))
                       
             number_alleles_loci = int(
@@ -6062,3 +6296,68 @@ class SequencesAPItypon(Resource):
 
             return {'result': sequence_info,
                     'number_alleles_loci': number_alleles_loci}, 200
+
+    @api.doc(responses={200: 'OK',
+                        400: 'Invalid Argument',
+                        413: 'Too Many Sequences',
+                        500: 'Internal Server Error'},
+            )
+    @api.expect(sequence_lookup_model, validate=True)
+    def post(self):
+        """ Get information on a list of sequences or sequence hashes.
+
+            Sequences are resolved in batches and the result
+            for each input is streamed as soon as its batch
+            is resolved.
+        """
+
+        post_data = request.get_json()
+
+        # sequences are identified by their hash
+        if post_data.get('sequences') is not None:
+            inputs = [(sequence, hashlib.sha256(sequence.upper().encode('utf-8')).hexdigest())
+                      for sequence in post_data['sequences']]
+        elif post_data.get('seq_ids') is not None:
+            inputs = [(seq_id, seq_id) for seq_id in post_data['seq_ids']]
+            # hashes are included in the queries, only accept SHA-256 digests
+            invalid = [seq_id for seq_id in post_data['seq_ids']
+                       if len(seq_id) != 64 or not all(c in '0123456789abcdef' for c in seq_id)]
+            if len(invalid) > 0:
+                return {'message': 'Invalid DNA sequence hashes: {0}'.format(invalid[:10])}, 400
+        else:
+            return {'message': 'Please provide a list of DNA sequences or DNA sequence hashes.'}, 400
+
+        if len(inputs) > current_app.config['SEQUENCE_LOOKUP_MAX_INPUTS']:
+            return {'message': 'Too many sequences, please provide at most {0} '
+                               'per request.'.format(current_app.config['SEQUENCE_LOOKUP_MAX_INPUTS'])}, 413
+
+        # determine if species identifier was provided
+        query_part = ''
+        if post_data.get('species_id') is not None:
+            # the identifier is included in the queries
+            species_id = str(post_data['species_id'])
+            if len(species_id) == 0 or not all(c in '0123456789' for c in species_id):
+                return {'message': 'Invalid species identifier.'}, 400
+            species_uri = '{0}{1}/{2}'.format(
+                current_app.config['BASE_URL'], 'species', species_id)
+            # create additional query part to filter by species
+            query_part = '?locus a typon:Locus; typon:isOfTaxon <{0}> .'.format(
+                species_uri)
+
+        batch_size = current_app.config['SEQUENCE_LOOKUP_BATCH_SIZE']
+        batches = [inputs[i:i+batch_size] for i in range(0, len(inputs), batch_size)]
+        loci_counts = {}
+
+        # the first batch is resolved before the response starts
+        # so that errors can be returned with the status code
+        try:
+            first = lookup_sequences(batches[0], query_part, loci_counts) if len(batches) > 0 else []
+        except Exception:
+            return {'message': 'Could not retrieve information for the sequences, try again.'}, 500
+
+        def results():
+            yield from first
+            for batch in batches[1:]:
+                yield from lookup_sequences(batch, query_part, loci_counts)
+
+        return Response(stream_with_context(generate('Sequences', results())), content_type='application/json', mimetype='application/json')
@@ -10,6 +10,15 @@ translated are discarded from the final schema. One or more alleles of each
 gene/locus will be chosen as representatives and included in the 'short'
 directory.
 
+Representatives are selected by BLASTing one representative at a time
+against the proteins that still have no representative. With the
+pre-clustering stage, an initial set of representatives is proposed with
+a greedy clustering based on shared k-mers and all proposed
+representatives are BLASTed in a single run. Further runs are only
+needed for the proteins that the proposed representatives do not
+represent. Both methods guarantee that every protein is a representative
+or has a BSR of at least BSR+0.1 with one of the representatives.
+
 Code documentation
 ------------------
 """
@@ -23,7 +32,9 @@ import argparse
 import traceback
 import itertools
 import multiprocessing
+from collections import Counter
 
+import numpy as np
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.Alphabet import generic_dna
@@ -31,6 +42,104 @@ from Bio.Alphabet import generic_dna
 from app.utils import auxiliary_functions as aux
 
 
+# size of the k-mers used to pre-cluster proteins
+PRECLUSTER_KMER_SIZE = 4
+
+# minimum fraction of the k-mers of a protein that a representative
+# must have to include the protein in the cluster of the representative
+PRECLUSTER_KMER_SHARE = 0.3
+
+
+def representative_scores(blast_results):
+    """ Gets the self-score of the representatives from
+        BLAST results.
+
+        Parameters
+        ----------
+        blast_results: list
+            the query identifiers, subject identifiers and
+            raw scores arrays returned by `run_blastp`.
+
+        Returns
+        -------
+        list
+            The identifiers of the representatives, sorted,
+            and the self-score of each representative.
+    """
+
+    queries, subjects, scores = blast_results
+    self_hits = queries == subjects
+    seqids = queries[self_hits]
+    order = np.argsort(seqids, kind='stable')
+
+    return [seqids[order], scores[self_hits][order]]
+
+
+def blast_score_ratios(blast_results, representatives_scores):
+    """ Computes the BSR of the BLAST hits between
+        different sequences.
+
+        Parameters
+        ----------
+        blast_results: list
+            the query identifiers, subject identifiers and
+            raw scores arrays returned by `run_blastp`.
+        representatives_scores: list
+            the identifiers and self-scores of the
+            representatives returned by `representative_scores`.
+
+        Returns
+        -------
+        list
+            The query identifiers, the subject identifiers
+            and the BSR of the hits. Hits of queries without
+            self-score are excluded.
+    """
+
+    queries, subjects, scores = blast_results
+    rep_ids, rep_scores = representatives_scores
+
+    if len(rep_ids) == 0:
+        return [queries[:0], subjects[:0], scores[:0]]
+
+    positions = np.minimum(np.searchsorted(rep_ids, queries), len(rep_ids)-1)
+    valid = (queries != subjects) & (rep_ids[positions] == queries)
+    bsr_values = scores[valid] / rep_scores[positions[valid]]
+
+    return [queries[valid], subjects[valid], bsr_values]
+
+
+def group_hits(queries, subjects):
+    """ Groups the subjects of BLAST hits by query.
+
+        Parameters
+        ----------
+        queries: numpy.ndarray
+            query identifiers.
+        subjects: numpy.ndarray
+            subject identifiers.
+
+        Returns
+        -------
+        groups: dict
+            query identifiers as keys and arrays with
+            subject identifiers as values, in the order
+            the queries appear in the results.
+    """
+
+    if len(queries) == 0:
+        return {}
+
+    order = np.argsort(queries, kind='stable')
+    seqids, starts = np.unique(queries[order], return_index=True)
+    hits = np.split(subjects[order], starts[1:])
+    first = order[starts]
+
+    groups = {int(seqids[i]): hits[i] for i in np.argsort(first, kind='stable')}
+
+    return groups
+
+
 def bsr_categorizer(blast_results, representatives,
                     representatives_scores, min_bsr, max_bsr):
     """ Determines the BLAST hits that have a BSR below a minimum threshold
@@ -39,14 +148,14 @@ def bsr_categorizer(blast_results, representatives,
         Parameters
         ----------
         blast_results: list
-            a list with sublists, each sublist contains
-            information about a BLAST hit.
+            the query identifiers, subject identifiers and
+            raw scores arrays returned by `run_blastp`.
         representatives: list
             list with sequence identifiers of
             representative sequences.
-        representatives_scores: dict
-            dictionary with self BLAST raw score
-            for every representative.
+        representatives_scores: list
+            the identifiers and self-scores of the
+            representatives returned by `representative_scores`.
         min_bsr: float
             minimum BSR value accepted to consider a sequence
             as a possible new representative.
@@ -58,49 +167,48 @@ def bsr_categorizer(blast_results, representatives,
         -------
         list
             List with following elements:
-                high_bsr (list): list with all sequence identifiers of subject
+                high_bsr (numpy.ndarray): identifiers of subject
                 sequences that had hits with a BSR higher than the maximum
                 defined threshold.
-                low_bsr (list): list with all sequence identifiers of subject
+                low_bsr (numpy.ndarray): identifiers of subject
                 sequences that had hits with a BSR lower than the minimum
                 defined threshold.
+                hotspot_bsr (numpy.ndarray): identifiers of subject
+                sequences that had hits with a BSR between both thresholds.
+                high_reps (dict): representatives and the subjects with a
+                BSR higher than the minimum threshold.
+                low_reps (list): representatives that only had hits with a
+                BSR lower than the minimum threshold.
+                hot_reps (dict): representatives and the subjects with a
+                BSR between both thresholds.
     """
 
-    high_bsr = []
-    hotspot_bsr = []
-    low_bsr = []
-
-    high_reps = {}
-    hot_reps = {}
-    low_reps = {}
-
-    filtered_results = [res for res in blast_results
-                        if res[0] != res[1] and res[1] not in representatives]
-    bsr_values = [float(res[2])/float(representatives_scores[res[0]])
-                  for res in filtered_results]
-
-    high_bsr = [res[1] for ind, res in enumerate(filtered_results)
-                if bsr_values[ind] >= max_bsr]
-    low_bsr = [res[1] for ind, res in enumerate(filtered_results)
-               if bsr_values[ind] < min_bsr]
-    hotspot_bsr = [res[1] for ind, res in enumerate(filtered_results)
-                   if bsr_values[ind] >= min_bsr and bsr_values[ind] < max_bsr]
-
-    for ind, res in enumerate(filtered_results):
-        if bsr_values[ind] >= min_bsr:
-            high_reps.setdefault(res[0], []).append(res[1])
-        if bsr_values[ind] < min_bsr:
-            low_reps.setdefault(res[0], []).append(res[1])
-        if bsr_values[ind] >= min_bsr and bsr_values[ind] < max_bsr:
-            hot_reps.setdefault(res[0], []).append(res[1])
+    queries, subjects, bsr_values = blast_score_ratios(blast_results,
+                                                       representatives_scores)
+
+    not_representative = ~np.isin(subjects, np.array(representatives, dtype=np.int64))
+    queries = queries[not_representative]
+    subjects = subjects[not_representative]
+    bsr_values = bsr_values[not_representative]
+
+    high = bsr_values >= max_bsr
+    low = bsr_values < min_bsr
+    hot = ~high & ~low
+
+    high_bsr = subjects[high]
+    low_bsr = subjects[low]
+    hotspot_bsr = subjects[hot]
+
+    high_reps = group_hits(queries[~low], subjects[~low])
+    hot_reps = group_hits(queries[hot], subjects[hot])
 
     # determine representatives that only led to low BSR
-    low_reps = list(set(low_reps) - set(high_reps))
+    low_reps = np.setdiff1d(queries[low], queries[~low]).tolist()
 
     return [high_bsr, low_bsr, hotspot_bsr, high_reps, low_reps, hot_reps]
 
 
-def select_candidate(candidates, proteins, seqids,
+def select_candidate(candidates, lengths, seqids,
                      representatives, final_representatives):
     """ Chooses a new representative sequence.
 
@@ -109,9 +217,9 @@ def select_candidate(candidates, proteins, seqids,
         candidates: list
             list with the sequence identifiers
             of all candidates.
-        proteins: dict
-            a dictionary with protein identifiers
-            as keys and protein sequences as values.
+        lengths: numpy.ndarray
+            array with the length of each protein
+            at the index of its integer identifier.
         seqids: list
             a list with the sequence identifiers that
             still have no representative (representatives identifiers
@@ -131,17 +239,11 @@ def select_candidate(candidates, proteins, seqids,
     # with more than one sequence as candidate, select longest
     if len(candidates) > 1:
 
-        # determine length of all candidates
-        candidates_len = [(seqid, len(proteins[seqid]))
-                          for seqid in candidates]
-
-        # order representative candidates by length descending order
-        candidates_len = sorted(candidates_len, key=lambda x: x[1],
-                                reverse=True)
-
         # longest allele is the new representative
-        representatives.append(candidates_len[0][0])
-        final_representatives.append(candidates_len[0][0])
+        # (the first one if several have the same length)
+        longest = candidates[int(np.argmax(lengths[candidates]))]
+        representatives.append(longest)
+        final_representatives.append(longest)
 
     # if tere is only one candidate, keep that
     elif len(candidates) == 1:
@@ -154,21 +256,208 @@ def select_candidate(candidates, proteins, seqids,
     elif len(candidates) == 0 and \
             len(seqids) > len(representatives):
 
-        # determine length of remaining sequences
+        # longest of remaining sequences is new representative
         # (representatives not included)
-        candidates_len = [(seqid, len(proteins[seqid]))
-                          for seqid in seqids
-                          if seqid not in representatives]
+        remaining = np.array(seqids, dtype=np.int64)
+        remaining = remaining[~np.isin(remaining, representatives)]
+        longest = int(remaining[np.argmax(lengths[remaining])])
+        representatives.append(longest)
+        final_representatives.append(longest)
 
-        # sort by descending length
-        candidates_len = sorted(candidates_len, key=lambda x: x[1],
-                                reverse=True)
+    return [representatives, final_representatives]
 
-        # longest of remaining sequences is new representative
-        representatives.append(candidates_len[0][0])
-        final_representatives.append(candidates_len[0][0])
 
-    return [representatives, final_representatives]
+def run_blastp(query_ids, target_ids, proteins, blastp_db, blastp_task,
+               temp_dir, gene_id):
+    """ BLASTs a set of proteins against a subset of the proteins
+        in a BLAST database.
+
+        Parameters
+        ----------
+        query_ids: list
+            identifiers of the query proteins.
+        target_ids: list
+            identifiers of the proteins in the database that
+            the queries are aligned against (queries must be
+            included to determine their self score).
+        proteins: dict
+            a dictionary with protein identifiers
+            as keys and protein sequences as values.
+        blastp_db: str
+            path to the BLAST database.
+        blastp_task: str
+            blastp task ('blastp' or 'blastp-short').
+        temp_dir: str
+            directory for the input and output files.
+        gene_id: str
+            identifier of the gene/locus.
+
+        Returns
+        -------
+        blast_results: list
+            arrays with the query identifiers, the subject
+            identifiers and the raw scores of the hits.
+    """
+
+    # create FASTA file with representative sequences
+    rep_file = aux.join_paths(temp_dir,
+                              '{0}_rep_protein.fasta'.format(gene_id))
+    rep_protein_lines = aux.fasta_lines(query_ids, proteins)
+    aux.write_list(rep_protein_lines, rep_file)
+
+    # create file with seqids to BLAST against
+    ids_str = aux.concatenate_list(map(str, target_ids), '\n')
+    ids_file = aux.join_paths(temp_dir,
+                              '{0}_ids.txt'.format(gene_id))
+    aux.write_text_chunk(ids_file, ids_str)
+
+    # BLAST representatives against non-represented
+    blast_output = aux.join_paths(temp_dir,
+                                  '{0}_blast_out.tsv'.format(gene_id))
+    # set max_target_seqs to huge number because BLAST only
+    # returns 500 hits by default
+    blast_command = ('blastp -task {0} -db {1} -query {2} -out {3} '
+                     '-outfmt "6 qseqid sseqid score" -max_hsps 1 '
+                     '-num_threads {4} -max_target_seqs 100000 '
+                     '-seqidlist {5} 2>/dev/null'.format(blastp_task, blastp_db,
+                                                         rep_file, blast_output,
+                                                         1, ids_file))
+    os.system(blast_command)
+
+    # import BLAST results
+    blast_results = aux.read_blast_columns(blast_output)
+
+    # remove files created for current run
+    os.remove(rep_file)
+    os.remove(blast_output)
+    os.remove(ids_file)
+
+    return blast_results
+
+
+def kmer_set(protein, k):
+    """ Gets the set of k-mers in a protein sequence. Proteins
+        shorter than k have a single k-mer, the protein.
+    """
+
+    kmers = {protein[i:i+k] for i in range(len(protein)-k+1)}
+
+    return kmers if len(kmers) > 0 else {protein}
+
+
+def propose_representatives(seqids, proteins):
+    """ Proposes representatives with a greedy clustering of
+        proteins based on shared k-mers.
+
+        Proteins are processed by decreasing length and each
+        protein becomes a new representative if no previous
+        representative has at least `PRECLUSTER_KMER_SHARE`
+        of its k-mers.
+
+        Parameters
+        ----------
+        seqids: list
+            identifiers of the proteins.
+        proteins: dict
+            a dictionary with protein identifiers
+            as keys and protein sequences as values.
+
+        Returns
+        -------
+        representatives: list
+            identifiers of the proposed representatives,
+            longest first.
+    """
+
+    ordered = sorted(seqids, key=lambda x: (-len(proteins[x]), int(x)))
+
+    representatives = []
+    # k-mers of the representatives and the representatives that have them
+    kmers_index = {}
+    for seqid in ordered:
+        kmers = kmer_set(proteins[seqid], PRECLUSTER_KMER_SIZE)
+        shared = Counter(rep for kmer in kmers for rep in kmers_index.get(kmer, ()))
+        if len(shared) > 0 and \
+                shared.most_common(1)[0][1] >= PRECLUSTER_KMER_SHARE*len(kmers):
+            continue
+
+        for kmer in kmers:
+            kmers_index.setdefault(kmer, []).append(seqid)
+        representatives.append(seqid)
+
+    return representatives
+
+
+def cluster_representatives(seqids, proteins, bsr, blastp_db, blastp_task,
+                            temp_dir, gene_id):
+    """ Selects representatives with the pre-clustering stage.
+
+        The proteins without representative are pre-clustered,
+        all proposed representatives are BLASTed against those
+        proteins in a single run and proteins with a BSR of at
+        least BSR+0.1 with a representative are represented.
+        This is repeated for the remaining proteins, which is
+        rarely needed more than once or twice. Representatives
+        that are represented by other representatives and
+        whose represented proteins are all represented by
+        other representatives are excluded at the end.
+
+        Parameters
+        ----------
+        seqids: list
+            identifiers of the distinct proteins.
+        proteins: dict
+            a dictionary with protein identifiers
+            as keys and protein sequences as values.
+        bsr: float
+            BLAST Score Ratio value.
+        blastp_db: str
+            path to the BLAST database with the proteins.
+        blastp_task: str
+            blastp task ('blastp' or 'blastp-short').
+        temp_dir: str
+            directory for the BLAST files.
+        gene_id: str
+            identifier of the gene/locus.
+
+        Returns
+        -------
+        final_representatives: list
+            identifiers of the representatives.
+    """
+
+    representatives = []
+    represented = {}
+    remaining = list(seqids)
+    while len(remaining) > 0:
+        new_representatives = propose_representatives(remaining, proteins)
+        blast_results = run_blastp(new_representatives, remaining, proteins,
+                                   blastp_db, blastp_task, temp_dir, gene_id)
+
+        queries, subjects, bsr_values = \
+            blast_score_ratios(blast_results, representative_scores(blast_results))
+        high = bsr_values >= bsr+0.1
+        for rep, hits in group_hits(queries[high], subjects[high]).items():
+            represented.setdefault(rep, set()).update(hits.tolist())
+
+        # representatives do not need to be represented
+        representatives.extend(new_representatives)
+        done = set(new_representatives).union(*[represented.get(rep, set())
+                                                 for rep in new_representatives])
+        remaining = [seqid for seqid in remaining if seqid not in done]
+
+    # exclude redundant representatives
+    final_representatives = []
+    covered = set()
+    for rep in representatives:
+        rep_represented = represented.get(rep, set())
+        if rep in covered and rep_represented.issubset(covered):
+            continue
+        final_representatives.append(rep)
+        covered.add(rep)
+        covered.update(rep_represented)
+
+    return final_representatives
 
 
 def adapt_loci(genes_list):
@@ -199,13 +488,14 @@ def adapt_loci(genes_list):
     summary_stats = []
     invalid_genes = []
     invalid_alleles = []
-    genes = genes_list[:-6]
-    schema_path = genes_list[-6]
-    schema_short_path = genes_list[-5]
-    bsr = genes_list[-4]
-    min_len = genes_list[-3]
-    table_id = genes_list[-2]
-    size_threshold = genes_list[-1]
+    genes = genes_list[:-7]
+    schema_path = genes_list[-7]
+    schema_short_path = genes_list[-6]
+    bsr = genes_list[-5]
+    min_len = genes_list[-4]
+    table_id = genes_list[-3]
+    size_threshold = genes_list[-2]
+    precluster = genes_list[-1]
     for gene in genes:
 
         representatives = []
@@ -249,18 +539,18 @@ def adapt_loci(genes_list):
             equal_prots = aux.determine_duplicated_prots(prot_seqs)
 
             # get only one identifier per protein
-            ids_to_blast = [protids[0]
+            # (BLAST results are read with integer identifiers)
+            ids_to_blast = [int(protids[0])
                             for protein, protids in equal_prots.items()]
-
-            # get longest sequence as first representative
-            longest = aux.determine_longest(ids_to_blast, prot_seqs)
-            representatives.append(longest)
-            final_representatives.append(longest)
+            proteins = {int(seqid): protein
+                        for seqid, protein in prot_seqs.items()}
+            lengths = np.zeros(max(proteins)+1, dtype=np.int64)
+            lengths[list(proteins)] = [len(protein) for protein in proteins.values()]
 
             # create FASTA file with distinct protein sequences
             protein_file = aux.join_paths(gene_temp_dir,
                                           '{0}_protein.fasta'.format(gene_id))
-            protein_lines = aux.fasta_lines(ids_to_blast, prot_seqs)
+            protein_lines = aux.fasta_lines(ids_to_blast, proteins)
             aux.write_list(protein_lines, protein_file)
 
             # create blastdb with all distinct proteins
@@ -270,97 +560,76 @@ def adapt_loci(genes_list):
             # determine appropriate blastp task (proteins < 30aa need blastp-short)
             blastp_task = aux.determine_blast_task(equal_prots)
 
-            # cycles to BLAST representatives against non-representatives until
-            # all non-representatives have a representative
-            while len(set(ids_to_blast) - set(representatives)) != 0:
-
-                # create FASTA file with representative sequences
-                rep_file = aux.join_paths(gene_temp_dir,
-                                          '{0}_rep_protein.fasta'.format(gene_id))
-                rep_protein_lines = aux.fasta_lines(representatives, prot_seqs)
-                aux.write_list(rep_protein_lines, rep_file)
-
-                # create file with seqids to BLAST against
-                ids_str = aux.concatenate_list(
-                    [str(i) for i in ids_to_blast], '\n')
-                ids_file = aux.join_paths(gene_temp_dir,
-                                          '{0}_ids.txt'.format(gene_id))
-                aux.write_text_chunk(ids_file, ids_str)
-
-                # BLAST representatives against non-represented
-                blast_output = aux.join_paths(gene_temp_dir,
-                                              '{0}_blast_out.tsv'.format(gene_id))
-                # set max_target_seqs to huge number because BLAST only
-                # returns 500 hits by default
-                blast_command = ('blastp -task {0} -db {1} -query {2} -out {3} '
-                                 '-outfmt "6 qseqid sseqid score" -max_hsps 1 '
-                                 '-num_threads {4} -max_target_seqs 100000 '
-                                 '-seqidlist {5} 2>/dev/null'.format(blastp_task, blastp_db,
-                                                                     rep_file, blast_output,
-                                                                     1, ids_file))
-                os.system(blast_command)
-
-                # import BLAST results
-                blast_results = aux.read_blast_tabular(blast_output)
-
-                # get self-score for representatives
-                rep_self_scores = {res[1]: res[2] for res in blast_results
-                                   if res[0] == res[1]}
-
-                # divide results into high, low and hot BSR values
-                hitting_high, hitting_low, hotspots, high_reps, low_reps, hot_reps = \
-                    bsr_categorizer(blast_results, representatives,
-                                    rep_self_scores, bsr, bsr+0.1)
-
-                excluded_reps = []
-
-                # remove high BSR hits that have representative
-                hitting_high = set(hitting_high)
-                ids_to_blast = [
-                    i for i in ids_to_blast if i not in hitting_high]
-
-                # remove representatives that led to high BSR with subjects that were removed
-                prunned_high_reps = {
-                    k: [r for r in v if r in ids_to_blast] for k, v in high_reps.items()}
-                reps_to_remove = [
-                    k for k, v in prunned_high_reps.items() if len(v) == 0]
-
-                excluded_reps.extend(reps_to_remove)
-
-                # determine smallest set of representatives that allow to get all cycle candidates
-                excluded = []
-                hotspot_reps = set(aux.flatten_list(list(hot_reps.values())))
-                for rep, hits in hot_reps.items():
-                    common = hotspot_reps.intersection(set(hits))
-                    if len(common) > 0:
-                        hotspot_reps = hotspot_reps - common
-                    else:
-                        excluded.append(rep)
-
-                excluded_reps.extend(excluded)
-
-                # remove representatives that only led to low BSR
-                excluded_reps.extend(low_reps)
-
-                representatives = [
-                    rep for rep in representatives if rep not in excluded_reps]
-                ids_to_blast = [
-                    i for i in ids_to_blast if i not in excluded_reps]
-
-                # determine next representative from candidates
-                rep_candidates = list(set(hotspots) - hitting_high)
-                # sort to guarantee reproducible results with same datasets
-                rep_candidates = sorted(rep_candidates, key=lambda x: int(x))
-                representatives, final_representatives = select_candidate(rep_candidates,
-                                                                          prot_seqs,
-                                                                          ids_to_blast,
-                                                                          representatives,
-                                                                          final_representatives)
-
-                # remove files created for current gene iteration
-                os.remove(rep_file)
-                os.remove(blast_output)
-                os.remove(ids_file)
+            if precluster is True:
+                final_representatives = cluster_representatives(ids_to_blast, proteins,
+                                                                 bsr, blastp_db,
+                                                                 blastp_task,
+                                                                 gene_temp_dir,
+                                                                 gene_id)
+            else:
+                # get longest sequence as first representative
+                longest = aux.determine_longest(ids_to_blast, proteins)
+                representatives.append(longest)
+                final_representatives.append(longest)
+
+                # cycles to BLAST representatives against non-representatives until
+                # all non-representatives have a representative
+                while len(set(ids_to_blast) - set(representatives)) != 0:
+
+                    blast_results = run_blastp(representatives, ids_to_blast, proteins,
+                                               blastp_db, blastp_task, gene_temp_dir,
+                                               gene_id)
+
+                    # get self-score for representatives
+                    rep_self_scores = representative_scores(blast_results)
+
+                    # divide results into high, low and hot BSR values
+                    hitting_high, hitting_low, hotspots, high_reps, low_reps, hot_reps = \
+                        bsr_categorizer(blast_results, representatives,
+                                        rep_self_scores, bsr, bsr+0.1)
+
+                    excluded_reps = set()
+
+                    # high BSR hits have representative
+                    hitting_high = set(hitting_high.tolist())
+
+                    # remove representatives that led to high BSR with subjects that were removed
+                    reps_to_remove = [k for k, v in high_reps.items()
+                                      if hitting_high.issuperset(v.tolist())]
+
+                    excluded_reps.update(reps_to_remove)
+
+                    # determine smallest set of representatives that allow to get all cycle candidates
+                    excluded = []
+                    hotspot_reps = set(hotspots.tolist())
+                    for rep, hits in hot_reps.items():
+                        common = hotspot_reps.intersection(hits.tolist())
+                        if len(common) > 0:
+                            hotspot_reps = hotspot_reps - common
+                        else:
+                            excluded.append(rep)
+
+                    excluded_reps.update(excluded)
+
+                    # remove representatives that only led to low BSR
+                    excluded_reps.update(low_reps)
+
+                    representatives = [
+                        rep for rep in representatives if rep not in excluded_reps]
+                    # remove high BSR hits and excluded representatives
+                    excluded_reps.update(hitting_high)
+                    ids_to_blast = [
+                        i for i in ids_to_blast if i not in excluded_reps]
+
+                    # determine next representative from candidates
+                    rep_candidates = list(set(hotspots.tolist()) - hitting_high)
+                    # sort to guarantee reproducible results with same datasets
+                    rep_candidates = sorted(rep_candidates, key=lambda x: int(x))
+                    representatives, final_representatives = select_candidate(rep_candidates,
+                                                                              lengths,
+                                                                              ids_to_blast,
+                                                                              representatives,
+                                                                              final_representatives)
 
         else:
             final_representatives = list(prot_seqs.keys())
@@ -373,7 +642,7 @@ def adapt_loci(genes_list):
         valid_sequences = len(gene_lines)
 
         # write schema file with representatives
-        final_representatives = [seqids_map[rep]
+        final_representatives = [seqids_map[str(rep)]
                                  for rep in final_representatives]
         gene_rep_lines = aux.fasta_lines(final_representatives, gene_seqs)
         aux.write_list(gene_rep_lines, gene_short_file)
@@ -391,7 +660,31 @@ def adapt_loci(genes_list):
     return [invalid_alleles, invalid_genes, summary_stats]
 
 
-def main(external_schema, output_schema, core_count, bsr, min_len, trans_tbl, ptf_path, size_threshold, logfile):
+def adapt_locus(gene_inputs):
+    """ Adapts a single gene/locus and measures the time it takes.
+
+        Parameters
+        ----------
+        gene_inputs: list
+            a list with the path to the gene file followed by
+            the inputs expected by :py:func:`adapt_loci`.
+
+        Returns
+        -------
+        list
+            the path to the gene file, the list returned by
+            :py:func:`adapt_loci` and the number of seconds
+            it took to adapt the gene.
+    """
+
+    start = time.time()
+    result = adapt_loci(gene_inputs)
+
+    return [gene_inputs[0], result, time.time() - start]
+
+
+def main(external_schema, output_schema, core_count, bsr, min_len, trans_tbl, ptf_path, size_threshold, logfile,
+         precluster=False):
 
     logging.basicConfig(filename=logfile, level=logging.INFO)
 
@@ -403,6 +696,7 @@ def main(external_schema, output_schema, core_count, bsr, min_len, trans_tbl, pt
     logging.info('Translation table: {0}'.format(trans_tbl))
     logging.info('Minimum accepted sequence length: {0}'.format(min_len))
     logging.info('Size threshold: {0}'.format(size_threshold))
+    logging.info('Pre-clustering: {0}'.format(precluster))
 
     # define output paths
     schema_path = os.path.abspath(output_schema)
@@ -427,61 +721,50 @@ def main(external_schema, output_schema, core_count, bsr, min_len, trans_tbl, pt
     logging.info('Determining the total number of alleles and '
                  'allele mean length per gene...'.format())
 
-    # count number of sequences and mean length per gene
-    genes_info = []
-    genes_pools = multiprocessing.Pool(processes=core_count)
-    gp = genes_pools.map_async(aux.gene_seqs_info, genes_list,
-                               callback=genes_info.extend)
-    gp.wait()
-
-    # split files according to number of sequences and sequence mean length
-    # in each file to pass even groups of sequences to all cores
-    even_genes_groups = aux.split_genes_by_core(genes_info, core_count*4,
-                                                'seqcount')
-    # with few inputs, some sublists might be empty
-    even_genes_groups = [i for i in even_genes_groups if len(i) > 0]
-
-    # append output paths and bsr value to each input
-    for i in range(len(even_genes_groups)):
-        even_genes_groups[i].append(schema_path)
-        even_genes_groups[i].append(schema_short_path)
-        even_genes_groups[i].append(bsr)
-        even_genes_groups[i].append(min_len)
-        even_genes_groups[i].append(trans_tbl)
-        even_genes_groups[i].append(size_threshold)
-
-    logging.info('Adapting {0} genes...'.format(len(genes_list)))
-
+    # a single pool is used to count sequences and to adapt the
+    # genes, genes are sent one at a time, largest first, so that
+    # idle processes get the next gene instead of waiting for the
+    # process with the largest genes to finish
     invalid_data = []
-    # process inputs in parallel
-    genes_pools = multiprocessing.Pool(processes=core_count)
-
-    rawr = genes_pools.map_async(adapt_loci, even_genes_groups,
-                                 callback=invalid_data.extend)
-
-    rawr.wait()
-
-    # handle exceptions
-    try:
-        # try to get returned results
-        # will re-raise exceptions raised during multiprocessing
-        a = rawr.get()
-    except Exception as e:
-        # get exception info
-        exc_type, exc_value, exc_traceback = sys.exc_info()
-        logging.info('The process encountered some problem and could '
-                     'not complete successfully. Raised exceptions:\n')
-        # get traceback as list of lines
-        traceback_lines = traceback.format_exception(
-            exc_type, exc_value, exc_traceback)
-        # keep first exception traceback and exclude traceback from rawr.get()
-        exc_index = traceback_lines.index(
-            'The above exception was the direct cause of the following exception:\n\n')
-        traceback_lines[0] = traceback_lines[0].split(
-            'multiprocessing.pool.RemoteTraceback: \n"""')[1]
-        traceback_lines[exc_index-1] = traceback_lines[exc_index-1].rstrip('"""\n')
-        logging.info(''.join(traceback_lines[0:exc_index]))
-        return False
+    timings = []
+    with multiprocessing.Pool(processes=core_count) as genes_pool:
+        try:
+            genes_info = list(genes_pool.imap_unordered(aux.gene_seqs_info, genes_list,
+                                                        chunksize=max(1, len(genes_list)//(core_count*4))))
+            genes_info = sorted(genes_info, key=lambda g: (g[1], g[2]), reverse=True)
+
+            # append output paths and bsr value to each input
+            genes_inputs = [[gene[0], schema_path, schema_short_path, bsr,
+                             min_len, trans_tbl, size_threshold, precluster]
+                            for gene in genes_info]
+
+            logging.info('Adapting {0} genes...'.format(len(genes_list)))
+
+            # report progress about every 10% of the genes
+            step = max(1, len(genes_inputs)//10)
+            for gene, result, seconds in genes_pool.imap_unordered(adapt_locus, genes_inputs,
+                                                                   chunksize=1):
+                invalid_data.append(result)
+                timings.append((seconds, gene))
+                logging.debug('Adapted {0} in {1:.2f}s.'.format(gene, seconds))
+                if len(timings) % step == 0 or len(timings) == len(genes_inputs):
+                    logging.info('Adapted {0}/{1} genes.'.format(len(timings),
+                                                                 len(genes_inputs)))
+        except Exception as e:
+            # the exception has the traceback of the worker as cause
+            logging.info('The process encountered some problem and could '
+                         'not complete successfully. Raised exceptions:\n')
+            traceback_lines = traceback.format_exception(type(e), e, e.__traceback__)
+            logging.info(''.join(traceback_lines))
+            return False
+
+    # log the genes that took longer to adapt
+    slowest = sorted(timings, reverse=True)[:5]
+    if len(slowest) > 0:
+        logging.info('Slowest genes: {0} (mean {1:.2f}s per gene).'
+                     ''.format(';'.join('{0} ({1:.2f}s)'.format(os.path.basename(g), t)
+                                        for t, g in slowest),
+                               sum(t for t, g in timings)/len(timings)))
 
     # log alleles that were determined to be invalid
     invalid_alleles = [sub[0] for sub in invalid_data]
@@ -565,13 +848,19 @@ def parse_arguments():
                         default=None, dest='logfile',
                         help='Logfile of the execution.')
 
+    parser.add_argument('--precluster', action='store_true', required=False,
+                        dest='precluster',
+                        help='Propose representatives with a k-mer based '
+                             'pre-clustering and BLAST them together to '
+                             'reduce the number of BLAST runs.')
+
     args = parser.parse_args()
 
     return [args.input_files, args.output_directory,
             args.cpu_cores, args.blast_score_ratio,
             args.minimum_length, args.translation_table,
             args.ptf_path, args.size_threshold,
-            args.logfile]
+            args.logfile, args.precluster]
 
 
 if __name__ == '__main__':
@@ -579,4 +868,4 @@ if __name__ == '__main__':
     args = parse_arguments()
     main(args[0], args[1], args[2], args[3],
          args[4], args[5], args[6], args[7],
-         args[8])
+         args[8], args[9])
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains a persistent cache with the files created by
+PrepExternalSchema for each locus.
+
+The adapted files of a locus only depend on the FASTA file with its
+alleles and on the adaptation parameters (BLAST Score Ratio,
+translation table, minimum sequence length and size threshold).
+Entries are keyed by the SHA-256 hash of those inputs, so a locus
+that did not change since it was last adapted is a cache hit even
+if it is in a different schema or in a new compressed version.
+
+Each entry has two files in `ADAPTED_CACHE_PATH`, the FASTA file
+with all valid alleles and the FASTA file with the representative
+alleles ('short'). Entries are written with a temporary name and
+renamed, so concurrent readers never get partial files. Reading an
+entry updates its modification time, and the least recently used
+entries are removed when the cache is larger than
+`ADAPTED_CACHE_MAX_SIZE`. The cache can be inspected and pruned
+with `adapted_cache_manager.py`.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from config import Config
+
+
+# changing the adaptation process must change this
+# value to ignore entries created by previous versions
+ADAPT_VERSION = '1'
+
+# extensions of the files of each entry
+FULL_EXTENSION = '.fasta'
+SHORT_EXTENSION = '_short.fasta'
+
+
+def locus_key(fasta_file, params):
+    """ Computes the cache key of a locus.
+
+        Parameters
+        ----------
+        fasta_file : str
+            Path to the FASTA file with the alleles of
+            the locus. The filename is part of the key
+            because it determines the locus identifier.
+        params : list
+            Adaptation parameters passed to PrepExternalSchema.
+
+        Returns
+        -------
+        str
+            SHA-256 hash of the inputs.
+    """
+
+    key = hashlib.sha256()
+    key.update('{0}\t{1}\t{2}\n'.format(ADAPT_VERSION,
+                                        os.path.basename(fasta_file),
+                                        '\t'.join(map(str, params))).encode())
+    with open(fasta_file, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1048576), b''):
+            key.update(chunk)
+
+    return key.hexdigest()
+
+
+class AdaptedCache(object):
+    """ Cache with the adapted files of loci.
+
+        Parameters
+        ----------
+        directory : str
+            Path to the directory with the cache entries.
+        max_size : int
+            Maximum number of bytes kept by :py:meth:`prune`.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def paths(self, key):
+        """ Gets the paths to the files of an entry. """
+
+        shard = os.path.join(self.directory, key[:2])
+
+        return [os.path.join(shard, key + FULL_EXTENSION),
+                os.path.join(shard, key + SHORT_EXTENSION)]
+
+    def get(self, key):
+        """ Reads the adapted files of a locus.
+
+            Parameters
+            ----------
+            key : str
+                Cache key computed with :py:func:`locus_key`.
+
+            Returns
+            -------
+            list
+                The contents of the FASTA file with all
+                alleles and of the FASTA file with the
+                representative alleles. None if the locus
+                is not in the cache.
+        """
+
+        contents = []
+        try:
+            for path in self.paths(key):
+                with open(path, 'rb') as infile:
+                    contents.append(infile.read())
+                os.utime(path)
+        except OSError:
+            return None
+
+        return contents
+
+    def put(self, key, full_file, short_file):
+        """ Adds the adapted files of a locus to the cache.
+
+            Parameters
+            ----------
+            key : str
+                Cache key computed with :py:func:`locus_key`.
+            full_file : str
+                Path to the FASTA file with all valid alleles.
+            short_file : str
+                Path to the FASTA file with the representative
+                alleles.
+
+            Returns
+            -------
+            bool
+                True if the entry was added, False otherwise.
+        """
+
+        try:
+            for source, path in zip((full_file, short_file), self.paths(key)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                                     prefix='.tmp')
+                try:
+                    with os.fdopen(handle, 'wb') as outfile, \
+                            open(source, 'rb') as infile:
+                        shutil.copyfileobj(infile, outfile)
+                    os.replace(temp_path, path)
+                except BaseException:
+                    os.remove(temp_path)
+                    raise
+        except OSError as e:
+            logging.warning('Could not add locus to adapted cache: {0}'.format(e))
+            return False
+
+        return True
+
+    def entries(self):
+        """ Lists the entries in the cache.
+
+            Returns
+            -------
+            entries : list
+                Tuples with the key, the number of bytes and
+                the last access time of each entry, the least
+                recently used first.
+        """
+
+        entries = {}
+        if not os.path.isdir(self.directory):
+            return []
+
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for file in os.scandir(shard.path):
+                if file.name.startswith('.tmp'):
+                    continue
+                key = file.name.split('_')[0].split('.')[0]
+                # entries might be removed by other processes
+                try:
+                    stat = file.stat()
+                except FileNotFoundError:
+                    continue
+                size, mtime = entries.get(key, (0, 0))
+                entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+
+        return sorted(((k, v[0], v[1]) for k, v in entries.items()),
+                      key=lambda e: e[2])
+
+    def remove(self, key):
+        """ Removes an entry from the cache. """
+
+        for path in self.paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def prune(self, max_size=None, max_age=None):
+        """ Removes the least recently used entries.
+
+            Parameters
+            ----------
+            max_size : int
+                Maximum number of bytes kept in the cache.
+                Uses the cache limit if it is None.
+            max_age : float
+                Entries that were not used in this number of
+                seconds are removed. No limit if it is None.
+
+            Returns
+            -------
+            list
+                The number of entries and the number of bytes
+                that were removed.
+        """
+
+        max_size = self.max_size if max_size is None else max_size
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        oldest = time.time() - max_age if max_age is not None else None
+
+        removed = 0
+        freed = 0
+        for key, size, mtime in entries:
+            if total - freed <= max_size and (oldest is None or mtime >= oldest):
+                break
+            self.remove(key)
+            removed += 1
+            freed += size
+
+        return [removed, freed]
+
+
+store = AdaptedCache(Config.ADAPTED_CACHE_PATH,
+                     Config.ADAPTED_CACHE_MAX_SIZE)
+
+
+def get(key):
+    """ Reads the adapted files of a locus from the process
+        cache. See `AdaptedCache.get`.
+    """
+
+    return store.get(key)
+
+
+def put(key, full_file, short_file):
+    """ Adds the adapted files of a locus to the process
+        cache. See `AdaptedCache.put`.
+    """
+
+    return store.put(key, full_file, short_file)
+
+
+def prune(max_size=None, max_age=None):
+    """ Removes the least recently used entries from the
+        process cache. See `AdaptedCache.prune`.
+    """
+
+    return store.prune(max_size, max_age)
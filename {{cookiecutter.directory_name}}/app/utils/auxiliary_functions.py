@@ -20,21 +20,44 @@ import shutil
 import pickle
 import hashlib
 import requests
+import functools
 import itertools
 import urllib.request
 import multiprocessing
+import concurrent.futures
 from flask import abort
 from collections import Counter
-from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper import SPARQLWrapper
 from urllib.parse import urlparse, urlencode, urlsplit, parse_qs
 
+import numpy as np
 from Bio import SeqIO
 from Bio.Seq import Seq
+from Bio.Data import CodonTable
 from Bio.Alphabet import generic_dna
 
+from config import Config
+from app.utils import sparql_queries as sq
+# requests to SPARQL endpoints go through the pooled client
+from app.utils.sparql_client import (get_data, send_data,
+                                     send_big_query, stream_data)
+
 
 UNIPROT_SERVER = SPARQLWrapper("http://sparql.uniprot.org/sparql")
 
+# extensions of the compressed versions of schemas
+ARCHIVE_EXTENSIONS = ('.zip', '.tar.zst')
+
+# orientations tried to translate DNA sequences, in order
+STRANDS = ['sense', 'antisense', 'revsense', 'revantisense']
+
+# bases used to index codons (codon index = 16*b1 + 4*b2 + b3),
+# any other character is mapped to 4
+CODON_BASES = b'ACGT'
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+BASE_CODES[np.frombuffer(CODON_BASES, dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
 
 def binary_file_hash(binary_file):
     """ Obtains the hash of binary file.
@@ -129,6 +152,55 @@ def write_gene_list(schema_dir):
     return [os.path.isfile(schema_list_file), schema_list_file]
 
 
+def archive_date(filename):
+    """ Gets the date of a compressed version of a schema.
+
+    Parameters
+    ----------
+    filename: str
+        Filename of the compressed version, in the format
+        <species_id>_<schema_id>_<date><extension>.
+
+    Returns
+    -------
+    str
+        The last modification date of the schema when
+        the compressed version was created.
+    """
+
+    date = filename.split('_')[-1]
+    for extension in ARCHIVE_EXTENSIONS:
+        if date.endswith(extension):
+            return date[:-len(extension)]
+
+    return date
+
+
+def compressed_versions(filenames, schema_prefix):
+    """ Selects the compressed versions of a schema.
+
+    Parameters
+    ----------
+    filenames: list
+        Files in the directory with the compressed schemas.
+    schema_prefix: str
+        Filename prefix of the compressed versions of the
+        schema (<species_id>_<schema_id>).
+
+    Returns
+    -------
+    list
+        Filenames of the compressed versions of the schema
+        sorted by date, the most recent version is the last.
+        Archives that are being written are not included.
+    """
+
+    versions = [f for f in filenames
+                if f.startswith(schema_prefix + '_') and f.endswith(ARCHIVE_EXTENSIONS)]
+
+    return sorted(versions, key=archive_date)
+
+
 def is_fasta(filename):
     """ Checks if a file is a FASTA file.
 
@@ -418,6 +490,35 @@ def read_blast_tabular(blast_tabular_file):
     return blasting_results
 
 
+def read_blast_columns(blast_tabular_file):
+    """ Reads a file with BLAST results in tabular format
+        with integer query and subject identifiers and the
+        raw score ('6 qseqid sseqid score') into arrays.
+
+        Parameters
+        ----------
+        blast_tabular_file: str
+            path to output file of BLAST.
+
+        Returns
+        -------
+        list
+            List with the following elements:
+                queries (numpy.ndarray): query identifiers.
+                subjects (numpy.ndarray): subject identifiers.
+                scores (numpy.ndarray): raw score of each hit.
+    """
+
+    with open(blast_tabular_file, 'r') as blastout:
+        fields = blastout.read().split()
+
+    queries = np.array(fields[0::3], dtype=np.int64)
+    subjects = np.array(fields[1::3], dtype=np.int64)
+    scores = np.array(fields[2::3], dtype=np.float64)
+
+    return [queries, subjects, scores]
+
+
 def fasta_lines(identifiers, sequences_dictionary):
     """ Creates list with line elements for a FASTA file based on the sequence
         identifiers passed.
@@ -622,9 +723,11 @@ def get_seqs_dicts(gene_file, gene_id, table_id, min_len, size_threshold):
     prot_seqs = {}
     seqids_map = {}
     invalid_alleles = []
-    seq_generator = SeqIO.parse(gene_file, 'fasta', generic_dna)
-    translated_seqs = [(rec.id, translate_dna(
-        str(rec.seq), table_id, min_len)) for rec in seq_generator]
+    records = [(rec.id, str(rec.seq))
+               for rec in SeqIO.parse(gene_file, 'fasta', generic_dna)]
+    translated_seqs = list(zip([rec[0] for rec in records],
+                               translate_dna_batch([rec[1] for rec in records],
+                                                   table_id, min_len)))
     total_seqs = len(translated_seqs)
 
     for rec in translated_seqs:
@@ -1034,6 +1137,175 @@ def translate_dna(dna_sequence, table_id, min_len):
         return exception_str
 
 
+@functools.lru_cache(maxsize=None)
+def codon_lookup(table_id):
+    """ Creates lookup tables for the 64 codons of a genetic code,
+        with the same codon table used by `translate_sequence`.
+
+        Parameters
+        ----------
+        table_id: int
+            translation table identifier.
+
+        Returns
+        -------
+        list
+            List with following elements:
+                codon_table (CodonTable): the Biopython codon table.
+                codons (list): the codons, in the order of their index.
+                amino_acids (numpy.ndarray): the amino acid coded by
+                each codon ('*' for stop codons).
+                starts (numpy.ndarray): True for start codons.
+                stops (numpy.ndarray): True for stop codons.
+                in_frame_stops (numpy.ndarray): True for stop codons
+                that do not code for an amino acid.
+    """
+
+    codon_table = CodonTable.ambiguous_generic_by_id[table_id]
+    codons = [bytes([b1, b2, b3]).decode()
+              for b1 in CODON_BASES for b2 in CODON_BASES for b3 in CODON_BASES]
+
+    amino_acids = np.zeros(64, dtype=np.uint8)
+    in_frame_stops = np.zeros(64, dtype=bool)
+    for i, codon in enumerate(codons):
+        try:
+            amino_acids[i] = ord(codon_table.forward_table[codon])
+        except (KeyError, CodonTable.TranslationError):
+            if codon in codon_table.stop_codons:
+                amino_acids[i] = ord('*')
+                in_frame_stops[i] = True
+            else:
+                amino_acids[i] = ord('X')
+
+    starts = np.array([c in codon_table.start_codons for c in codons])
+    stops = np.array([c in codon_table.stop_codons for c in codons])
+
+    return [codon_table, codons, amino_acids, starts, stops, in_frame_stops]
+
+
+def translate_dna_batch(dna_sequences, table_id, min_len):
+    """ Checks and translates a set of DNA sequences, such as all
+        alleles of a locus. The result for each sequence is the
+        same as the result of `translate_dna`.
+
+        The sequences are joined in a single buffer and the
+        alphabet, length, start, stop and in-frame stop codon
+        checks are computed for all sequences and for the 4
+        orientations at the same time with a lookup table
+        for the codons of the genetic code.
+
+        Parameters
+        ----------
+        dna_sequences: list
+            strings representing DNA sequences.
+        table_id: int
+            translation table identifier.
+        min_len: int
+            minimum sequence length.
+
+        Returns
+        -------
+        results: list
+            The value returned by `translate_dna` for
+            each sequence, in the same order.
+    """
+
+    try:
+        lookup = codon_lookup(int(table_id))
+    except Exception:
+        # let Biopython raise the same exceptions
+        return [translate_dna(seq, table_id, min_len) for seq in dna_sequences]
+
+    codon_table, codons, amino_acids, starts, stops, in_frame_stops = lookup
+
+    sequences = [seq.upper() for seq in dna_sequences]
+    results = [None] * len(sequences)
+    if len(sequences) == 0:
+        return results
+
+    # characters that are not ASCII are replaced and become invalid
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    codes = BASE_CODES[np.frombuffer(''.join(sequences).encode('ascii', 'replace'),
+                                     dtype=np.uint8)]
+    ends = np.cumsum(lengths)
+    invalid_count = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid_dna = (invalid_count[ends] - invalid_count[ends-lengths]) == 0
+    valid_length = lengths % 3 == 0
+    valid_min = lengths >= min_len
+
+    for i in np.flatnonzero(~(valid_dna & valid_length & valid_min)):
+        if not valid_dna[i]:
+            results[i] = 'ambiguous or invalid characters'
+        elif not valid_length[i]:
+            results[i] = 'sequence length is not a multiple of 3'
+        else:
+            results[i] = 'sequence shorter than {0} nucleotides'.format(min_len)
+
+    # empty sequences are translated by Biopython
+    empty = np.flatnonzero(valid_dna & valid_length & valid_min & (lengths == 0))
+    for i in empty:
+        results[i] = translate_dna(sequences[i], table_id, min_len)
+
+    selected = np.flatnonzero(valid_dna & valid_length & valid_min & (lengths > 0))
+    if len(selected) == 0:
+        return results
+
+    # codons of the selected sequences, in the order of each sequence
+    bases = codes[np.repeat(np.isin(np.arange(len(sequences)), selected),
+                            lengths)].reshape(-1, 3).astype(np.int64)
+    n_codons = lengths[selected] // 3
+    codon_end = np.cumsum(n_codons)
+    codon_start = codon_end - n_codons
+
+    # index of each codon in each orientation and True if the
+    # orientation reads the codons in reverse order
+    orientations = [(bases[:, 0]*16 + bases[:, 1]*4 + bases[:, 2], False),
+                    ((3-bases[:, 2])*16 + (3-bases[:, 1])*4 + (3-bases[:, 0]), True),
+                    (bases[:, 2]*16 + bases[:, 1]*4 + bases[:, 0], True),
+                    ((3-bases[:, 0])*16 + (3-bases[:, 1])*4 + (3-bases[:, 2]), False)]
+
+    checks = []
+    for codon_index, reverse in orientations:
+        first = codon_index[codon_end-1] if reverse else codon_index[codon_start]
+        last = codon_index[codon_start] if reverse else codon_index[codon_end-1]
+        # stop codons between the first and the last codon
+        stop_count = np.concatenate(([0], np.cumsum(in_frame_stops[codon_index])))
+        inner_stops = (stop_count[codon_end-1] - stop_count[codon_start+1]) > 0
+        valid = starts[first] & stops[last] & ~inner_stops
+        checks.append((first, last, valid, amino_acids[codon_index], reverse))
+
+    for j, i in enumerate(selected):
+        sequence = sequences[i]
+        translated = next((k for k, check in enumerate(checks) if check[2][j]), None)
+        if translated is not None:
+            protein = checks[translated][3][codon_start[j]:codon_end[j]]
+            if checks[translated][4] is True:
+                protein = protein[::-1]
+            protein = 'M' + protein[1:-1].tobytes().decode()
+            if translated == 1:
+                sequence = sequence[::-1].translate(COMPLEMENT)
+            elif translated == 2:
+                sequence = sequence[::-1]
+            elif translated == 3:
+                sequence = sequence.translate(COMPLEMENT)
+            results[i] = [[Seq(protein, codon_table.protein_alphabet), sequence],
+                          STRANDS[translated]]
+        else:
+            # same exceptions as the Biopython translation
+            exceptions = []
+            for strand, (first, last, valid, aa, reverse) in zip(STRANDS, checks):
+                if not starts[first[j]]:
+                    exception = "First codon '{0}' is not a start codon".format(codons[first[j]])
+                elif not stops[last[j]]:
+                    exception = "Final codon '{0}' is not a stop codon".format(codons[last[j]])
+                else:
+                    exception = 'Extra in frame stop codon found.'
+                exceptions.append('{0}({1})'.format(strand, exception))
+            results[i] = ','.join(exceptions)
+
+    return results
+
+
 def retranslate(sequence, method, table_id, strands, exception_collector):
     """ Sends sequence for translation and collects exceptions when
         the sequence cannot be translated.
@@ -1189,39 +1461,277 @@ def progress_bar(process, total, tickval, ticknum, completed):
     return completed
 
 
-def get_data(server, sparql_query):
-    """ Gets data from Virtuoso.
+def values_chunks(terms, max_length):
+    """ Splits RDF terms into chunks that can be used as the
+        content of VALUES blocks in SPARQL queries.
+
+        Parameters
+        ----------
+        terms: list
+            List with RDF terms (e.g. '<uri>').
+        max_length: int
+            Maximum length of each VALUES block.
+
+        Returns
+        -------
+        chunks: list
+            List with one string per chunk, each
+            string has terms separated by spaces.
+    """
+
+    chunks = []
+    current = []
+    current_length = 0
+    for term in terms:
+        if current_length + len(term) + 1 > max_length and len(current) > 0:
+            chunks.append(' '.join(current))
+            current = []
+            current_length = 0
+        current.append(term)
+        current_length += len(term) + 1
+
+    if len(current) > 0:
+        chunks.append(' '.join(current))
+
+    return chunks
+
+
+def get_values_bindings(server, query_template, virtuoso_graph, terms,
+                        max_length=None, params=()):
+    """ Gets the results of a query for a large set of RDF terms.
+
+        Terms are sent in VALUES blocks that are smaller
+        than `max_length` and the queries are sent
+        concurrently by a maximum of `SPARQL_BATCH_WORKERS`
+        threads.
 
         Parameters
         ----------
         server: str
             URL of the SPARQL server.
-        sparql_query: str
-            SPARQL query to perform.
+        query_template: str
+            Query template that receives the default graph
+            and the content of the VALUES block.
+        virtuoso_graph: str
+            URI of the default graph.
+        terms: list
+            List with RDF terms (e.g. '<uri>').
+        max_length: int
+            Maximum length of each VALUES block. Uses the
+            value of `SPARQL_VALUES_MAX_LENGTH` if it is None.
+        params: list
+            Additional values used to format the template,
+            passed after the VALUES block.
 
         Returns
         -------
-        result: str
-            JSON response from the server.
+        bindings: list
+            Bindings returned by all queries.
 
+        Raises
+        ------
+        Exception
+            If the results for a VALUES block could not
+            be retrieved.
     """
 
-    tries = 0
-    max_tries = 5
-    success = False
-    while success is False and tries < max_tries:
-        try:
-            server.setQuery(sparql_query)
-            server.setReturnFormat(JSON)
-            server.setTimeout(1000)
-            result = server.query().convert()
-            success = True
-        except Exception as e:
-            tries += 1
-            result = e
-            time.sleep(2)
+    max_length = max_length or Config.SPARQL_VALUES_MAX_LENGTH
+    chunks = values_chunks(terms, max_length)
+    queries = [query_template.format(virtuoso_graph, chunk, *params)
+               for chunk in chunks]
+
+    bindings = []
+    workers = max(1, min(Config.SPARQL_BATCH_WORKERS, len(queries)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(get_data,
+                                   itertools.repeat(server),
+                                   queries):
+            try:
+                bindings.extend(result['results']['bindings'])
+            except Exception:
+                raise Exception('Could not retrieve results: {0}'.format(result))
+
+    return bindings
 
-    return result
+
+def get_sequences(server, virtuoso_graph, sequence_uris):
+    """ Gets the DNA sequences of a set of sequence URIs.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL server.
+        virtuoso_graph: str
+            URI of the default graph.
+        sequence_uris: list
+            List with sequence URIs.
+
+        Returns
+        -------
+        sequences: dict
+            Dictionary with sequence URIs as keys and
+            the 'nucSeq' binding for each sequence as values.
+
+        Raises
+        ------
+        Exception
+            If the sequences in a VALUES block could not
+            be retrieved.
+    """
+
+    terms = ['<{0}>'.format(uri) for uri in set(sequence_uris)]
+    bindings = get_values_bindings(server, sq.SELECT_SEQS_FASTA,
+                                   virtuoso_graph, terms)
+
+    sequences = {b['sequence']['value']: b['nucSeq'] for b in bindings}
+
+    return sequences
+
+
+def get_existing_alleles(server, virtuoso_graph, allele_uris):
+    """ Determines which alleles are defined in the
+        NS from a set of allele URIs.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL server.
+        virtuoso_graph: str
+            URI of the default graph.
+        allele_uris: list
+            List with allele URIs.
+
+        Returns
+        -------
+        set
+            URIs of the alleles that are defined.
+
+        Raises
+        ------
+        Exception
+            If the alleles in a VALUES block could not
+            be checked.
+    """
+
+    terms = ['<{0}>'.format(uri) for uri in set(allele_uris)]
+    bindings = get_values_bindings(server, sq.SELECT_EXISTING_ALLELES,
+                                   virtuoso_graph, terms,
+                                   Config.PROFILE_VALUES_MAX_LENGTH)
+
+    return set(b['allele']['value'] for b in bindings)
+
+
+def get_sequences_info(server, virtuoso_graph, sequence_uris, query_part=''):
+    """ Gets the loci, alleles, schemas and UniProt annotations
+        of a set of sequence URIs.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL server.
+        virtuoso_graph: str
+            URI of the default graph.
+        sequence_uris: list
+            List with sequence URIs.
+        query_part: str
+            Additional graph pattern used to filter the
+            loci (e.g. by species).
+
+        Returns
+        -------
+        info: dict
+            Dictionary with sequence URIs as keys and the
+            list of bindings for each sequence as values.
+            Sequences that are not in any locus are not
+            included.
+
+        Raises
+        ------
+        Exception
+            If the sequences in a VALUES block could not
+            be retrieved.
+    """
+
+    terms = ['<{0}>'.format(uri) for uri in set(sequence_uris)]
+    bindings = get_values_bindings(server, sq.SELECT_SEQUENCES_INFO,
+                                   virtuoso_graph, terms,
+                                   params=[query_part])
+
+    info = {}
+    for b in bindings:
+        info.setdefault(b.pop('sequence')['value'], []).append(b)
+
+    return info
+
+
+def count_loci_alleles(server, virtuoso_graph, loci_uris):
+    """ Counts the alleles of a set of loci.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL server.
+        virtuoso_graph: str
+            URI of the default graph.
+        loci_uris: list
+            List with loci URIs.
+
+        Returns
+        -------
+        counts: dict
+            Dictionary with loci URIs as keys and the
+            number of alleles of each locus as values.
+
+        Raises
+        ------
+        Exception
+            If the loci in a VALUES block could not
+            be counted.
+    """
+
+    terms = ['<{0}>'.format(uri) for uri in set(loci_uris)]
+    bindings = get_values_bindings(server, sq.COUNT_LOCI_ALLELES,
+                                   virtuoso_graph, terms)
+
+    counts = {b['locus']['value']: int(b['count']['value'])
+              for b in bindings}
+
+    return counts
+
+
+def read_profiles_tsv(lines):
+    """ Reads allele call profiles in the TSV format created
+        by chewBBACA's AlleleCall process.
+
+        Parameters
+        ----------
+        lines: iterable
+            Lines of the TSV file. The first line has the
+            headers and each of the following lines has the
+            name of a genome and its allele identifiers.
+
+        Returns
+        -------
+        headers: list
+            Headers of the file.
+        profiles: generator
+            Generator that yields a tuple with the genome name
+            and the list of allele identifiers for each line.
+            Lines are read when the generator is consumed.
+    """
+
+    lines = iter(lines)
+    headers = next(lines, '').rstrip('\r\n').split('\t')
+
+    def profiles():
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if line == '':
+                continue
+            fields = line.split('\t')
+            yield fields[0], fields[1:]
+
+    return headers, profiles()
 
 
 def get_read_run_info_ena(ena_id):
@@ -1350,58 +1860,6 @@ def sanitize_input(mystring):
     return mystring
 
 
-def send_data(sparql_query, url_send_local_virtuoso, virtuoso_user, virtuoso_pass):
-    """ Sends data to Virtuoso.
-
-        Parameters
-        ----------
-        sparql_query: str
-            SPARQL query to perform.
-        url_send_local_virtuoso: str
-            URL of the SPARQL server.
-        virtuoso_user: str
-            Virtuoso username.
-        virtuoso_pass: str
-            Virtuoso password.
-
-        Returns
-        -------
-        r: str
-            Request response
-    """
-
-    tries = 0
-    max_tries = 3
-    success = False
-    while success is False and tries < max_tries:
-        url = url_send_local_virtuoso
-        headers = {'content-type': 'application/sparql-query'}
-        r = requests.post(url, data=sparql_query, headers=headers,
-                          auth=requests.auth.HTTPBasicAuth(virtuoso_user, virtuoso_pass))
-
-        if r.status_code > 201:
-            tries += 1
-        else:
-            success = True
-
-    return r
-
-
-def send_big_query(server, sparql_query):
-    """ Sends a big query to Virtuoso
-    """
-    try:
-        server.setQuery(sparql_query)
-        server.setReturnFormat(JSON)
-        server.method = "POST"
-        result = server.query().convert()
-
-    except Exception as e:
-        result = e
-
-    return result
-
-
 def check_len(arg):
     """ Check string length.
 
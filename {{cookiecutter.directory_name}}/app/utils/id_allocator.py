@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module attributes integer identifiers to new loci, alleles
+and schema parts.
+
+Each sequence of identifiers (all loci, the alleles of a locus or
+the parts of a schema) has a counter in Redis with the last
+identifier that was attributed. Identifiers are reserved with
+INCRBY, so concurrent writers never get the same identifier and a
+block of identifiers can be reserved with a single call. A counter
+is seeded with the highest identifier stored in Virtuoso the first
+time it is used, which is the only query sent to Virtuoso.
+
+If Redis cannot be reached, a single identifier is determined from
+the highest identifier in Virtuoso, which is not safe for concurrent
+writers. Blocks of identifiers are never reserved without Redis, the
+writers that need them fail instead (`AllocationError`), because
+concurrent uploads would get overlapping blocks.
+
+Code documentation
+------------------
+"""
+
+
+import logging
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from config import Config
+from app.utils import sparql_client
+from app.utils import sparql_queries as sq
+
+
+# prefix for all keys stored in Redis
+REDIS_PREFIX = 'ns:ids:'
+
+# counter for the identifiers of all loci in the NS
+LOCI_COUNTER = 'loci'
+
+# increments a counter only if it was already seeded
+INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+# seeds a counter if no other writer did it and increments it
+SEED_SCRIPT = """
+redis.call('SETNX', KEYS[1], ARGV[1])
+return redis.call('INCRBY', KEYS[1], ARGV[2])
+"""
+
+# moves a counter forward if an identifier was attributed elsewhere
+ENSURE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]))
+if current ~= nil and current < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return redis.call('GET', KEYS[1])
+"""
+
+
+class AllocationError(Exception):
+    """ Exception raised when a block of identifiers cannot
+        be reserved.
+    """
+
+
+class IdAllocator(object):
+    """ Attributes identifiers from counters stored in Redis.
+
+        Parameters
+        ----------
+        redis_url: str
+            URL of the Redis database.
+    """
+
+    def __init__(self, redis_url):
+        self.redis_url = redis_url
+        self._redis = None
+        self._scripts = {}
+
+    @property
+    def redis(self):
+        """ Redis client or None if Redis is not available. """
+
+        if self._redis is None and self.redis_url and redis is not None:
+            self._redis = redis.Redis.from_url(self.redis_url)
+            self._scripts = {'increment': self._redis.register_script(INCREMENT_SCRIPT),
+                             'seed': self._redis.register_script(SEED_SCRIPT),
+                             'ensure': self._redis.register_script(ENSURE_SCRIPT)}
+
+        return self._redis
+
+    def reserve(self, counter, seed, count=1):
+        """ Reserves a block of consecutive identifiers.
+
+            Parameters
+            ----------
+            counter: str
+                Name of the counter.
+            seed: function
+                Function without arguments that returns the
+                highest identifier stored in Virtuoso. Only
+                called if the counter does not exist.
+            count: int
+                Number of identifiers to reserve.
+
+            Returns
+            -------
+            int
+                First identifier of the block. The block has
+                the identifiers from this value up to this
+                value plus `count` minus 1.
+
+            Raises
+            ------
+            AllocationError
+                If Redis cannot be reached and more than one
+                identifier was requested.
+        """
+
+        key = REDIS_PREFIX + counter
+        if self.redis is not None:
+            try:
+                last = self._scripts['increment'](keys=[key], args=[count])
+                if last is None:
+                    last = self._scripts['seed'](keys=[key], args=[seed(), count])
+                return int(last) - count + 1
+            except redis.RedisError as e:
+                logging.warning('Identifier allocator could not reach '
+                                'Redis: {0}'.format(e))
+
+        if count > 1:
+            raise AllocationError('Could not reserve {0} identifiers for {1}, '
+                                  'Redis is not available.'.format(count, counter))
+
+        return seed() + 1
+
+    def ensure(self, counter, identifier):
+        """ Makes sure that a counter does not reserve an
+            identifier that was attributed without the
+            allocator (e.g. provided by the client).
+
+            Parameters
+            ----------
+            counter: str
+                Name of the counter.
+            identifier: int
+                Identifier that was attributed.
+        """
+
+        if self.redis is not None:
+            try:
+                self._scripts['ensure'](keys=[REDIS_PREFIX + counter],
+                                        args=[identifier])
+            except redis.RedisError as e:
+                logging.warning('Identifier allocator could not reach '
+                                'Redis: {0}'.format(e))
+
+
+allocator = IdAllocator(Config.ID_ALLOCATOR_REDIS_URL)
+
+
+def highest_id(server, query):
+    """ Gets the highest identifier returned by a query.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        query: str
+            Query that returns the highest identifier
+            in the 'max_id' variable.
+
+        Returns
+        -------
+        int
+            The highest identifier, 0 if there are
+            no identifiers.
+
+        Raises
+        ------
+        Exception
+            If the query failed.
+    """
+
+    result = sparql_client.get_data(server, query)
+    try:
+        bindings = result['results']['bindings']
+    except Exception:
+        raise Exception('Could not determine highest identifier: {0}'.format(result))
+
+    if len(bindings) == 0 or 'max_id' not in bindings[0]:
+        return 0
+
+    return int(bindings[0]['max_id']['value'])
+
+
+def reserve_loci(server, virtuoso_graph, count=1):
+    """ Reserves identifiers for new loci.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        virtuoso_graph: str
+            URI of the default graph.
+        count: int
+            Number of identifiers to reserve.
+
+        Returns
+        -------
+        int
+            First identifier of the reserved block.
+    """
+
+    def seed():
+        result = sparql_client.get_data(server,
+                                        sq.SELECT_HIGHEST_LOCUS.format(virtuoso_graph))
+        try:
+            highest_locus = result['results']['bindings']
+        except Exception:
+            raise Exception('Could not determine highest locus: {0}'.format(result))
+
+        if len(highest_locus) == 0:
+            return 0
+
+        return int(highest_locus[0]['locus']['value'].split('/')[-1])
+
+    return allocator.reserve(LOCI_COUNTER, seed, count)
+
+
+def reserve_alleles(server, virtuoso_graph, locus_uri, count=1):
+    """ Reserves identifiers for new alleles of a locus.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        virtuoso_graph: str
+            URI of the default graph.
+        locus_uri: str
+            URI of the locus.
+        count: int
+            Number of identifiers to reserve.
+
+        Returns
+        -------
+        int
+            First identifier of the reserved block.
+    """
+
+    def seed():
+        return highest_id(server, sq.SELECT_HIGHEST_ALLELE_ID.format(virtuoso_graph,
+                                                                     locus_uri))
+
+    return allocator.reserve('alleles:' + locus_uri, seed, count)
+
+
+def reserve_schema_parts(server, virtuoso_graph, schema_uri, count=1):
+    """ Reserves identifiers for new parts (loci links) of a schema.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        virtuoso_graph: str
+            URI of the default graph.
+        schema_uri: str
+            URI of the schema.
+        count: int
+            Number of identifiers to reserve.
+
+        Returns
+        -------
+        int
+            First identifier of the reserved block.
+    """
+
+    def seed():
+        return highest_id(server, sq.SELECT_HIGHEST_SCHEMA_PART.format(virtuoso_graph,
+                                                                       schema_uri))
+
+    return allocator.reserve('parts:' + schema_uri, seed, count)
+
+
+def ensure_allele(locus_uri, allele_id):
+    """ Registers the identifier of an allele that was attributed
+        by the client, see `IdAllocator.ensure`.
+    """
+
+    allocator.ensure('alleles:' + locus_uri, allele_id)
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the store with the allele lengths of a schema
+used to compute the statistics files of the frontend.
+
+The store of a schema is the `<species>_<schema>_lengths` directory
+in `PRE_COMPUTE` and has the following append-only files:
+
+- ``lengths.bin``: contiguous little-endian 32-bit allele lengths.
+- ``keys.bin``: the allele identifiers, one per line, in the same
+  order as the lengths. They are used to ignore alleles that were
+  already added.
+- ``index.bin``: fixed-size records with the locus identifier and
+  the position of each segment of lengths and identifiers.
+- ``aggregates.bin`` and ``histograms.bin``: the number of alleles,
+  sum, sum of squares, minimum, maximum and length histogram of
+  each segment, one record per index record.
+
+Adding alleles appends a segment to the data files and then its
+record to the index, so readers never see partial segments and
+updates never rewrite data. The lengths are memory-mapped when read,
+so the lengths of a locus with a single segment are a view of the
+file and statistics scan them without copying.
+
+The aggregates of a segment are computed when it is added, so only
+the loci that received alleles are updated and the statistics of a
+locus are computed by merging the histograms of its segments,
+without reading its lengths.
+
+Stores created before this module had one pickled
+{locus_uri: {allele: length}} file per locus. They are migrated
+the first time they are used.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import fcntl
+import pickle
+import logging
+import contextlib
+
+import numpy as np
+
+from config import Config
+
+
+# record of each segment in the index
+INDEX_DTYPE = np.dtype([('locus', '<i8'),
+                        ('start', '<i8'),
+                        ('count', '<i8'),
+                        ('keys_start', '<i8'),
+                        ('keys_size', '<i8')])
+
+LENGTH_DTYPE = np.dtype('<i4')
+
+# aggregates of each segment, in the same order as the index
+AGGREGATE_DTYPE = np.dtype([('hist_start', '<i8'),
+                            ('hist_count', '<i8'),
+                            ('count', '<i8'),
+                            ('sum', '<i8'),
+                            ('sumsq', '<i8'),
+                            ('min', '<i8'),
+                            ('max', '<i8')])
+
+# number of alleles with each length in a segment
+HISTOGRAM_DTYPE = np.dtype([('length', '<i4'),
+                            ('count', '<i8')])
+
+LENGTHS_FILE = 'lengths.bin'
+KEYS_FILE = 'keys.bin'
+INDEX_FILE = 'index.bin'
+AGGREGATES_FILE = 'aggregates.bin'
+HISTOGRAMS_FILE = 'histograms.bin'
+LOCK_FILE = '.lock'
+
+STORE_FILES = (LENGTHS_FILE, KEYS_FILE, INDEX_FILE,
+               AGGREGATES_FILE, HISTOGRAMS_FILE, LOCK_FILE)
+
+
+def aggregate(lengths):
+    """ Computes the aggregates of a set of allele lengths.
+
+        Parameters
+        ----------
+        lengths : numpy.ndarray
+            Allele lengths.
+
+        Returns
+        -------
+        dict
+            The distinct lengths ('values', sorted) and the
+            number of alleles with each one ('counts'), and
+            the number of alleles, sum, sum of squares,
+            minimum and maximum of the lengths.
+    """
+
+    values, counts = np.unique(lengths, return_counts=True)
+
+    return histogram_aggregate(values, counts)
+
+
+def histogram_aggregate(values, counts):
+    """ Computes the aggregates of a length histogram.
+        See :py:func:`aggregate`.
+    """
+
+    values = np.asarray(values, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    return {'values': values,
+            'counts': counts,
+            'count': int(counts.sum()),
+            'sum': int((values*counts).sum()),
+            'sumsq': int((values*values*counts).sum()),
+            'min': int(values[0]) if len(values) > 0 else 0,
+            'max': int(values[-1]) if len(values) > 0 else 0}
+
+
+def merge_aggregates(aggregates):
+    """ Merges the aggregates of several sets of lengths.
+        See :py:func:`aggregate`.
+    """
+
+    if len(aggregates) == 1:
+        return aggregates[0]
+
+    values = np.concatenate([a['values'] for a in aggregates])
+    counts = np.concatenate([a['counts'] for a in aggregates])
+    merged_values, inverse = np.unique(values, return_inverse=True)
+    merged_counts = np.bincount(inverse, weights=counts).astype(np.int64)
+
+    return {'values': merged_values,
+            'counts': merged_counts,
+            'count': sum(a['count'] for a in aggregates),
+            'sum': sum(a['sum'] for a in aggregates),
+            'sumsq': sum(a['sumsq'] for a in aggregates),
+            'min': min(a['min'] for a in aggregates),
+            'max': max(a['max'] for a in aggregates)}
+
+
+class LengthsStore(object):
+    """ Append-only store with the allele lengths of a schema.
+
+        Parameters
+        ----------
+        directory : str
+            Path to the directory of the store.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, filename):
+        """ Gets the path to a file of the store. """
+
+        return os.path.join(self.directory, filename)
+
+    def exists(self):
+        """ Determines if the store has been created. """
+
+        return os.path.isdir(self.directory)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """ Acquires the lock used to add alleles. """
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(LOCK_FILE), 'w') as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def legacy_files(self):
+        """ Lists the pickled files of the previous format. """
+
+        if not self.exists():
+            return []
+
+        return [os.path.join(self.directory, f)
+                for f in os.listdir(self.directory)
+                if f not in STORE_FILES and not f.startswith('.')]
+
+    def migrate(self):
+        """ Adds the alleles in the pickled files of the previous
+            format to the store and removes those files.
+
+            Alleles are added one locus at a time and files are
+            only removed after their alleles are added, so the
+            migration can be resumed if it is interrupted.
+
+            Returns
+            -------
+            int
+                Number of migrated files.
+        """
+
+        with self.lock():
+            return self._migrate()
+
+    def _migrate(self):
+        """ Migrates the pickled files of the previous format.
+            Must be called while holding the lock.
+        """
+
+        legacy_files = self.legacy_files()
+        for file in legacy_files:
+            with open(file, 'rb') as lf:
+                locus_data = pickle.load(lf)
+
+            self._append({int(locus_uri.split('/')[-1]): alleles
+                          for locus_uri, alleles in locus_data.items()})
+            os.remove(file)
+
+        if len(legacy_files) > 0:
+            logging.info('Migrated {0} allele lengths files in '
+                         '{1}.'.format(len(legacy_files), self.directory))
+
+        return len(legacy_files)
+
+    def index(self):
+        """ Reads the records of the segments in the store. """
+
+        try:
+            with open(self.path(INDEX_FILE), 'rb') as infile:
+                data = infile.read()
+        except FileNotFoundError:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+
+        # ignore a record that is still being written
+        size = len(data) - len(data) % INDEX_DTYPE.itemsize
+
+        return np.frombuffer(data[:size], dtype=INDEX_DTYPE)
+
+    def lengths(self, index=None):
+        """ Memory-maps the lengths file.
+
+            Returns
+            -------
+            numpy.ndarray
+                Lengths of all segments in the index.
+        """
+
+        index = self.index() if index is None else index
+        if len(index) == 0:
+            return np.zeros(0, dtype=LENGTH_DTYPE)
+
+        end = int((index['start'] + index['count']).max())
+        if end == 0:
+            return np.zeros(0, dtype=LENGTH_DTYPE)
+
+        return np.memmap(self.path(LENGTHS_FILE), dtype=LENGTH_DTYPE,
+                         mode='r', shape=(end,))
+
+    def loci_lengths(self):
+        """ Gets the allele lengths of each locus.
+
+            Returns
+            -------
+            loci_lengths : dict
+                Locus identifiers as keys and arrays with the
+                lengths of their alleles as values.
+        """
+
+        if len(self.legacy_files()) > 0:
+            self.migrate()
+
+        index = self.index()
+        lengths = self.lengths(index)
+
+        segments = {}
+        for record in index:
+            segments.setdefault(int(record['locus']), []).append(
+                lengths[record['start']:record['start']+record['count']])
+
+        return {locus: s[0] if len(s) == 1 else np.concatenate(s)
+                for locus, s in segments.items()}
+
+    def aggregates(self, index):
+        """ Reads the aggregates of the segments in the index.
+
+            Segments added before aggregates were stored have no
+            record and their aggregates are computed from their
+            lengths.
+
+            Returns
+            -------
+            aggregates : list
+                Aggregates of each segment (see :py:func:`aggregate`),
+                in the same order as the index.
+        """
+
+        try:
+            with open(self.path(AGGREGATES_FILE), 'rb') as infile:
+                data = infile.read()
+        except FileNotFoundError:
+            data = b''
+
+        # ignore records of segments that are not in the index
+        size = min(len(data) // AGGREGATE_DTYPE.itemsize, len(index))
+        records = np.frombuffer(data[:size*AGGREGATE_DTYPE.itemsize],
+                                dtype=AGGREGATE_DTYPE)
+
+        histograms = np.zeros(0, dtype=HISTOGRAM_DTYPE)
+        if size > 0:
+            end = int((records['hist_start'] + records['hist_count']).max())
+            if end > 0:
+                histograms = np.memmap(self.path(HISTOGRAMS_FILE),
+                                       dtype=HISTOGRAM_DTYPE,
+                                       mode='r', shape=(end,))
+
+        aggregates = []
+        for record in records:
+            histogram = histograms[record['hist_start']:record['hist_start']+record['hist_count']]
+            aggregates.append({'values': histogram['length'].astype(np.int64),
+                               'counts': histogram['count'].astype(np.int64),
+                               'count': int(record['count']),
+                               'sum': int(record['sum']),
+                               'sumsq': int(record['sumsq']),
+                               'min': int(record['min']),
+                               'max': int(record['max'])})
+
+        if size < len(index):
+            lengths = self.lengths(index)
+            for record in index[size:]:
+                aggregates.append(aggregate(
+                    lengths[record['start']:record['start']+record['count']]))
+
+        return aggregates
+
+    def loci_aggregates(self):
+        """ Gets the aggregates of the allele lengths of each
+            locus without reading the lengths.
+
+            Returns
+            -------
+            dict
+                Locus identifiers as keys and the aggregates of
+                the lengths of their alleles as values (see
+                :py:func:`aggregate`).
+        """
+
+        if len(self.legacy_files()) > 0:
+            self.migrate()
+
+        index = self.index()
+
+        segments = {}
+        for record, segment in zip(index, self.aggregates(index)):
+            segments.setdefault(int(record['locus']), []).append(segment)
+
+        return {locus: merge_aggregates(s) for locus, s in segments.items()}
+
+    def locus_keys(self, index, locus_id):
+        """ Reads the identifiers of the alleles of a locus. """
+
+        keys = set()
+        records = index[index['locus'] == locus_id]
+        if len(records) == 0:
+            return keys
+
+        with open(self.path(KEYS_FILE), 'rb') as kf:
+            for record in records:
+                kf.seek(int(record['keys_start']))
+                keys.update(kf.read(int(record['keys_size'])).decode().splitlines())
+
+        return keys
+
+    def append(self, loci_alleles):
+        """ Adds alleles to the store. Alleles that were already
+            added are ignored.
+
+            Parameters
+            ----------
+            loci_alleles : dict
+                Locus identifiers as keys and dictionaries with
+                allele identifiers as keys and lengths as values.
+
+            Returns
+            -------
+            int
+                Number of alleles that were added.
+        """
+
+        with self.lock():
+            # the lock is held, migrating through `migrate`
+            # would block on a second lock of the same file
+            self._migrate()
+            return self._append(loci_alleles)
+
+    def _append(self, loci_alleles):
+        """ Adds alleles to the store. Must be called while
+            holding the lock.
+        """
+
+        index = self.index()
+        self._sync_aggregates(index)
+
+        records = []
+        segments = []
+        with open(self.path(LENGTHS_FILE), 'ab') as lf, \
+                open(self.path(KEYS_FILE), 'ab') as kf:
+            # discard data of interrupted appends that
+            # are not aligned with the lengths dtype
+            padding = -lf.tell() % LENGTH_DTYPE.itemsize
+            lf.write(b'\x00' * padding)
+
+            for locus_id, alleles in loci_alleles.items():
+                existing = self.locus_keys(index, locus_id)
+                new_alleles = [(str(k), v) for k, v in alleles.items()
+                               if str(k) not in existing]
+                if len(new_alleles) == 0:
+                    continue
+
+                keys_data = ''.join('{0}\n'.format(k) for k, v in new_alleles).encode()
+                records.append((locus_id,
+                                lf.tell() // LENGTH_DTYPE.itemsize,
+                                len(new_alleles),
+                                kf.tell(),
+                                len(keys_data)))
+                lengths = np.array([v for k, v in new_alleles], dtype=LENGTH_DTYPE)
+                lf.write(lengths.tobytes())
+                kf.write(keys_data)
+                segments.append(aggregate(lengths))
+
+            lf.flush()
+            kf.flush()
+            os.fsync(lf.fileno())
+            os.fsync(kf.fileno())
+
+        if len(records) > 0:
+            self._write_aggregates(segments)
+            with open(self.path(INDEX_FILE), 'ab') as xf:
+                # discard a partial record of an interrupted append
+                xf.truncate(xf.tell() - xf.tell() % INDEX_DTYPE.itemsize)
+                xf.seek(0, os.SEEK_END)
+                xf.write(np.array(records, dtype=INDEX_DTYPE).tobytes())
+
+        return sum(r[2] for r in records)
+
+    def _write_aggregates(self, segments):
+        """ Appends the aggregates of new segments. Must be
+            called while holding the lock and before adding
+            the segments to the index.
+        """
+
+        records = []
+        with open(self.path(HISTOGRAMS_FILE), 'ab') as hf:
+            # discard a partial histogram of an interrupted append
+            hf.truncate(hf.tell() - hf.tell() % HISTOGRAM_DTYPE.itemsize)
+            hf.seek(0, os.SEEK_END)
+            for segment in segments:
+                histogram = np.zeros(len(segment['values']), dtype=HISTOGRAM_DTYPE)
+                histogram['length'] = segment['values']
+                histogram['count'] = segment['counts']
+                records.append((hf.tell() // HISTOGRAM_DTYPE.itemsize,
+                                len(histogram),
+                                segment['count'],
+                                segment['sum'],
+                                segment['sumsq'],
+                                segment['min'],
+                                segment['max']))
+                hf.write(histogram.tobytes())
+
+            hf.flush()
+            os.fsync(hf.fileno())
+
+        with open(self.path(AGGREGATES_FILE), 'ab') as af:
+            af.write(np.array(records, dtype=AGGREGATE_DTYPE).tobytes())
+            af.flush()
+            os.fsync(af.fileno())
+
+    def _sync_aggregates(self, index):
+        """ Aligns the aggregates with the index. Must be called
+            while holding the lock.
+
+            Records of segments that were not added to the index
+            because an append was interrupted are discarded and
+            the aggregates of segments added before aggregates
+            were stored are computed and written.
+        """
+
+        path = self.path(AGGREGATES_FILE)
+        size = os.path.getsize(path) if os.path.isfile(path) else 0
+        stored = min(size // AGGREGATE_DTYPE.itemsize, len(index))
+        if size != stored * AGGREGATE_DTYPE.itemsize:
+            with open(path, 'r+b') as af:
+                af.truncate(stored * AGGREGATE_DTYPE.itemsize)
+
+        if stored < len(index):
+            self._write_aggregates(self.aggregates(index)[stored:])
+
+
+def schema_store(species_id, schema_id):
+    """ Gets the store with the allele lengths of a schema. """
+
+    return LengthsStore(os.path.join(Config.PRE_COMPUTE,
+                                     '{0}_{1}_lengths'.format(species_id, schema_id)))
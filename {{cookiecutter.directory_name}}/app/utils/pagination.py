@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains functions to retrieve the results of
+SPARQL queries that are split into pages.
+
+Pages are selected with OFFSET and LIMIT or, for queries over
+large sets of rows, with the key of the last row of the previous
+page (keyset paging). Sorted pages with OFFSET and LIMIT sort all
+rows for every page and Virtuoso rejects them when OFFSET + LIMIT
+is larger than `MaxSortedTopRows`, so queries that need a stable
+order over all rows must use keyset paging.
+
+OFFSET pages are requested concurrently, with a bounded number of
+pages in flight, and rows are yielded in page order. Keyset pages
+depend on the previous page and are requested one at a time. Pages
+that fail are retried individually. Paging ends at the first page
+that has less rows than the page size, so it always finishes even
+if the data changes while the pages are retrieved.
+
+Code documentation
+------------------
+"""
+
+
+import time
+import logging
+import concurrent.futures
+from collections import deque
+
+from config import Config
+from app.utils import sparql_client
+
+
+class PageError(Exception):
+    """ Exception raised when a page cannot be retrieved.
+
+        Parameters
+        ----------
+        offset: int
+            Offset of the page that failed. All rows before
+            this offset were yielded, so the retrieval can be
+            resumed by passing this value as `offset`.
+        error: Exception
+            Error returned by the last attempt.
+        key: tuple
+            Key of the last row before the page that failed,
+            for keyset paging. The retrieval can be resumed
+            by passing this value as `start`.
+    """
+
+    def __init__(self, offset, error, key=None):
+        position = 'at offset {0}'.format(offset) if key is None \
+            else 'after key {0}'.format(key)
+        super().__init__('Could not get page {0}: {1}'.format(position, error))
+        self.offset = offset
+        self.error = error
+        self.key = key
+
+
+def escape_literal(value):
+    """ Escapes a value included in a SPARQL string literal. """
+
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def fetch_page(server, template, params, offset, limit, max_tries, key=None):
+    """ Gets a single page of results.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        template: str
+            Query template. The offset (or the values of the
+            key) and limit are passed after `params` when
+            formatting the template.
+        params: list
+            Values used to format the template.
+        offset: int
+            Offset of the first row in the page.
+        limit: int
+            Maximum number of rows in the page.
+        max_tries: int
+            Maximum number of attempts.
+        key: tuple
+            Key of the last row of the previous page. The
+            page is selected with the key instead of the
+            offset if it is not None.
+
+        Returns
+        -------
+        rows: list
+            Bindings in the page.
+
+        Raises
+        ------
+        PageError
+            If the page could not be retrieved.
+    """
+
+    if key is None:
+        query = template.format(*params, offset, limit)
+    else:
+        query = template.format(*params, *map(escape_literal, key), limit)
+    for attempt in range(1, max_tries+1):
+        result = sparql_client.get_data(server, query)
+        try:
+            return result['results']['bindings']
+        except (TypeError, KeyError):
+            logging.warning('Could not get page at offset {0} '
+                            '(attempt {1}): {2}'.format(offset, attempt, result))
+        if attempt < max_tries:
+            time.sleep(sparql_client.backoff_delay(attempt))
+
+    raise PageError(offset, result, key)
+
+
+def fetch_pages(server, template, params, page_size, total=None,
+                stop=None, offset=0, workers=None, max_tries=3,
+                key=None, start=None):
+    """ Gets all rows of a paged query.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        template: str
+            Query template. The offset and limit are passed
+            after `params` when formatting the template.
+        params: list
+            Values used to format the template.
+        page_size: int
+            Number of rows per page.
+        total: int
+            Expected number of rows of the query. Pages up
+            to this number are requested concurrently and
+            later pages are requested one at a time. Pages
+            are always requested concurrently if it is None.
+        stop: function
+            Function that receives the rows of a page and
+            returns True if no more pages should be requested.
+        offset: int
+            Offset of the first row, used to resume a retrieval
+            that failed (see `PageError`).
+        workers: int
+            Maximum number of pages requested at the same
+            time. Uses the value of `SPARQL_BATCH_WORKERS`
+            in the configuration if it is None.
+        max_tries: int
+            Maximum number of attempts per page.
+        key: function
+            Function that receives a row and returns the
+            values of its key, in the order used to sort the
+            rows. If it is not None, pages are selected with
+            the key of the last row of the previous page and
+            the template must filter and sort the rows by
+            that key (see `fetch_key_pages`).
+        start: tuple
+            Key values of the first page, used to resume a
+            retrieval that failed (see `PageError`).
+
+        Yields
+        ------
+        dict
+            Rows in the order of the pages.
+
+        Raises
+        ------
+        PageError
+            If a page could not be retrieved.
+    """
+
+    if key is not None:
+        yield from fetch_key_pages(server, template, params, page_size,
+                                   key, start, stop, max_tries)
+        return
+
+    workers = workers or Config.SPARQL_BATCH_WORKERS
+    next_offset = offset
+    pending = deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            while True:
+                # pages that are expected to have rows are requested in
+                # advance, pages after the expected total one at a time
+                while len(pending) < workers and (total is None or next_offset < total):
+                    pending.append(executor.submit(fetch_page, server, template,
+                                                   params, next_offset, page_size,
+                                                   max_tries))
+                    next_offset += page_size
+                if len(pending) == 0:
+                    pending.append(executor.submit(fetch_page, server, template,
+                                                   params, next_offset, page_size,
+                                                   max_tries))
+                    next_offset += page_size
+
+                rows = pending.popleft().result()
+                offset += len(rows)
+                yield from rows
+
+                # a page that is not full is the last page
+                if len(rows) < page_size or (stop is not None and stop(rows)):
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+
+    if total is not None and offset != total:
+        logging.warning('Expected {0} rows but got {1}, data changed while '
+                        'pages were retrieved.'.format(total, offset))
+
+
+def fetch_key_pages(server, template, params, page_size, key, start,
+                    stop=None, max_tries=3):
+    """ Gets all rows of a query with keyset paging.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        template: str
+            Query template. The values of the key of the last
+            row of the previous page, escaped for string
+            literals, and the limit are passed after `params`
+            when formatting the template. The template must
+            only select rows with a larger key and sort them
+            by key, without OFFSET.
+        params: list
+            Values used to format the template.
+        page_size: int
+            Number of rows per page.
+        key: function
+            Function that receives a row and returns the
+            values of its key.
+        start: tuple
+            Key values of the first page. Values must be
+            smaller than the key of any row (e.g. empty
+            strings).
+        stop: function
+            Function that receives the rows of a page and
+            returns True if no more pages should be requested.
+        max_tries: int
+            Maximum number of attempts per page.
+
+        Yields
+        ------
+        dict
+            Rows in key order.
+
+        Raises
+        ------
+        PageError
+            If a page could not be retrieved.
+    """
+
+    last_key = tuple(start)
+    offset = 0
+    while True:
+        rows = fetch_page(server, template, params, offset,
+                          page_size, max_tries, last_key)
+        offset += len(rows)
+        yield from rows
+
+        # a page that is not full is the last page
+        if len(rows) < page_size or (stop is not None and stop(rows)):
+            break
+        last_key = tuple(key(rows[-1]))
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains a cache for the results of read queries
+sent to the local Virtuoso instance.
+
+Results are keyed by the name of the query template in the
+`sparql_queries` module and by the parameters used to format
+the template. Each key also includes:
+
+- the generation of every scope (e.g. a schema or locus URI)
+  the result depends on. Write paths call `invalidate` to
+  increase the generation of the scopes they modify, which
+  makes previous entries unreachable.
+- an optional version string. Read endpoints for schema data
+  use the schema's last modification date and locking state
+  (`schema_version`), so that results are refreshed as soon as
+  a schema is modified, even if the modification was performed
+  by another process.
+
+Streamed results (`stream_data`) are cached while they are sent
+to the client, as long as they do not exceed `QUERY_CACHE_MAX_ROWS`
+rows or `QUERY_CACHE_MAX_BYTES` bytes.
+
+Entries are stored in a LRU bounded in-memory tier and in a Redis
+tier that is shared by all workers. Generations are also stored in
+Redis, so invalidations made by the scripts that modify the data
+(e.g. the inserters and `rm_functions`), which run in other
+processes, reach the API workers. If Redis is not configured or
+cannot be reached, generations are local to each process and only
+results with a version are cached, so results without a version
+are never served after another process modified the data.
+
+Code documentation
+------------------
+"""
+
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from config import Config
+from app.utils import sparql_client
+from app.utils import sparql_queries as sq
+
+
+# prefix for all keys stored in Redis
+REDIS_PREFIX = 'ns:query_cache:'
+
+# scope for species data
+SPECIES_SCOPE = 'species'
+# scope shared by all schemas, used when the modified
+# schemas are not known (e.g. when loci are deleted)
+SCHEMAS_SCOPE = 'schemas'
+
+
+class QueryCache(object):
+    """ Two-tier cache for SPARQL query results.
+
+        Parameters
+        ----------
+        max_entries: int
+            Maximum number of results kept in memory.
+        ttl: int
+            Number of seconds that results are kept.
+        max_rows: int
+            Results with more bindings than this value
+            are not cached.
+        max_bytes: int
+            Streamed results larger than this value
+            are not cached.
+        redis_url: str
+            URL of the Redis database used as second
+            tier. Only the in-memory tier is used if
+            it is None.
+    """
+
+    def __init__(self, max_entries, ttl, max_rows, max_bytes,
+                 redis_url=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.redis_url = redis_url
+        self._redis = None
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        """ Redis client or None if the Redis tier is disabled. """
+
+        if self._redis is None and self.redis_url and redis is not None:
+            self._redis = redis.Redis.from_url(self.redis_url)
+
+        return self._redis
+
+    def generations(self, scopes):
+        """ Gets the current generation of a set of scopes.
+
+            Parameters
+            ----------
+            scopes: list
+                Identifiers of the scopes.
+
+            Returns
+            -------
+            list
+                The generation of each scope and True if the
+                generations are shared by all processes.
+        """
+
+        local = [self._generations.get(scope, 0) for scope in scopes]
+        if self.redis is not None:
+            try:
+                shared = self.redis.mget([REDIS_PREFIX + 'gen:' + scope
+                                          for scope in scopes]) if len(scopes) > 0 else []
+                return [['{0}.{1}'.format(int(g or 0), l) for g, l in zip(shared, local)],
+                        True]
+            except redis.RedisError as e:
+                logging.warning('Query cache could not reach Redis: {0}'.format(e))
+
+        return [[str(l) for l in local], False]
+
+    def invalidate(self, *scopes):
+        """ Invalidates all results that depend on the given scopes.
+
+            Parameters
+            ----------
+            *scopes: str
+                Identifiers of the scopes that were modified.
+        """
+
+        with self._lock:
+            for scope in scopes:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+
+        if self.redis is not None:
+            try:
+                pipe = self.redis.pipeline()
+                for scope in scopes:
+                    pipe.incr(REDIS_PREFIX + 'gen:' + scope)
+                pipe.execute()
+            except redis.RedisError as e:
+                logging.warning('Query cache could not reach Redis: {0}'.format(e))
+
+    def make_key(self, template, params, scopes, version):
+        """ Creates the key of a query result.
+
+            Parameters
+            ----------
+            template: str
+                Name of the query template.
+            params: list
+                Values used to format the template.
+            scopes: list
+                Scopes the result depends on.
+            version: str
+                Version of the data the result depends on.
+
+            Returns
+            -------
+            str
+                Digest that identifies the query result. None
+                if the result has no version and the generations
+                are not shared, in which case invalidations made
+                by other processes would not be seen and the
+                result must not be cached.
+        """
+
+        generations, shared = self.generations(list(scopes))
+        if version == '' and shared is False:
+            return None
+
+        key_data = json.dumps([template, list(params), list(scopes),
+                               generations, version])
+
+        return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        """ Gets a serialized result from the cache.
+
+            Parameters
+            ----------
+            key: str
+                Key of the result.
+
+            Returns
+            -------
+            payload: bytes
+                JSON serialized result or None
+                if the key is not in the cache.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+
+        payload = None
+        if self.redis is not None:
+            try:
+                payload = self.redis.get(REDIS_PREFIX + key)
+            except redis.RedisError as e:
+                logging.warning('Query cache could not reach Redis: {0}'.format(e))
+            if payload is not None:
+                self.store(key, payload, shared=False)
+
+        return payload
+
+    def store(self, key, payload, shared=True):
+        """ Adds a serialized result to the cache.
+
+            Parameters
+            ----------
+            key: str
+                Key of the result.
+            payload: bytes
+                JSON serialized result.
+            shared: bool
+                True to also store the result in Redis.
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        if shared is True and self.redis is not None:
+            try:
+                self.redis.setex(REDIS_PREFIX + key, self.ttl, payload)
+            except redis.RedisError as e:
+                logging.warning('Query cache could not reach Redis: {0}'.format(e))
+
+    def get_data(self, server, template, params, scopes=(), version=''):
+        """ Gets the result of a query from the cache or from
+            the SPARQL endpoint if it is not cached.
+
+            Parameters
+            ----------
+            server: str
+                URL of the SPARQL endpoint.
+            template: str
+                Name of the query template in the
+                `sparql_queries` module.
+            params: list
+                Values used to format the template.
+            scopes: list
+                Scopes the result depends on.
+            version: str
+                Version of the data the result depends on.
+                Results are not cached if it is None.
+
+            Returns
+            -------
+            result: dict
+                JSON response from the server. Returns the
+                exception if the request failed.
+        """
+
+        query = getattr(sq, template).format(*params)
+        if version is None:
+            return sparql_client.get_data(server, query)
+
+        key = self.make_key(template, params, scopes, version)
+        if key is None:
+            return sparql_client.get_data(server, query)
+
+        payload = self.lookup(key)
+        if payload is not None:
+            return json.loads(payload)
+
+        result = sparql_client.get_data(server, query)
+        # do not cache errors or results that are too large
+        if isinstance(result, dict):
+            rows = len(result.get('results', {}).get('bindings', []))
+            if rows <= self.max_rows:
+                self.store(key, json.dumps(result).encode('utf-8'))
+
+        return result
+
+    def stream_data(self, server, template, params, scopes=(), version=''):
+        """ Gets the bindings of a query from the cache or
+            streams them from the SPARQL endpoint if they are
+            not cached.
+
+            Parameters
+            ----------
+            server: str
+                URL of the SPARQL endpoint.
+            template: str
+                Name of the query template in the
+                `sparql_queries` module.
+            params: list
+                Values used to format the template.
+            scopes: list
+                Scopes the result depends on.
+            version: str
+                Version of the data the result depends on.
+                Results are not cached if it is None.
+
+            Returns
+            -------
+            bindings: iterable
+                Bindings of the result. Returns the
+                exception if the request failed.
+        """
+
+        query = getattr(sq, template).format(*params)
+        if version is None:
+            return sparql_client.stream_data(server, query)
+
+        key = self.make_key(template, params, scopes, version)
+        if key is None:
+            return sparql_client.stream_data(server, query)
+
+        payload = self.lookup(key)
+        if payload is not None:
+            return json.loads(payload)['results']['bindings']
+
+        stream = sparql_client.stream_data(server, query)
+        if isinstance(stream, Exception):
+            return stream
+
+        return self._store_stream(key, stream)
+
+    def _store_stream(self, key, stream):
+        """ Yields the bindings of a stream and caches them
+            if the stream is fully consumed and the result is
+            not too large.
+        """
+
+        parts = []
+        size = 0
+        for binding in stream:
+            if parts is not None:
+                parts.append(json.dumps(binding))
+                size += len(parts[-1])
+                if len(parts) > self.max_rows or size > self.max_bytes:
+                    parts = None
+            yield binding
+
+        if parts is not None:
+            payload = '{{"head": {0}, "results": {{"bindings": [{1}]}}}}'
+            payload = payload.format(json.dumps(stream.head), ','.join(parts))
+            self.store(key, payload.encode('utf-8'))
+
+
+cache = QueryCache(Config.QUERY_CACHE_MAX_ENTRIES,
+                   Config.QUERY_CACHE_TTL,
+                   Config.QUERY_CACHE_MAX_ROWS,
+                   Config.QUERY_CACHE_MAX_BYTES,
+                   Config.QUERY_CACHE_REDIS_URL)
+
+
+def get_data(server, template, params, scopes=(), version=''):
+    """ Gets the result of a query through the process cache.
+        See `QueryCache.get_data`.
+    """
+
+    return cache.get_data(server, template, params, scopes, version)
+
+
+def stream_data(server, template, params, scopes=(), version=''):
+    """ Streams the bindings of a query through the process
+        cache. See `QueryCache.stream_data`.
+    """
+
+    return cache.stream_data(server, template, params, scopes, version)
+
+
+def invalidate(*scopes):
+    """ Invalidates cached results for the given scopes in the
+        process cache. See `QueryCache.invalidate`.
+    """
+
+    cache.invalidate(*scopes)
+
+
+def schema_version(server, virtuoso_graph, schema_uri):
+    """ Determines the version of a schema.
+
+        Parameters
+        ----------
+        server: str
+            URL of the SPARQL endpoint.
+        virtuoso_graph: str
+            URI of the default graph.
+        schema_uri: str
+            URI of the schema.
+
+        Returns
+        -------
+        str
+            The last modification date and locking state
+            of the schema. None if they could not be
+            determined, which disables caching.
+    """
+
+    result = sparql_client.get_data(server,
+                                    sq.SELECT_SCHEMA_VERSION.format(virtuoso_graph,
+                                                                    schema_uri))
+    try:
+        properties = result['results']['bindings'][0]
+        return '{0}|{1}'.format(properties['last_modified']['value'],
+                                properties['Schema_lock']['value'])
+    except (TypeError, KeyError, IndexError):
+        return None
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains a local index that maps the SHA-256 hashes
+of the DNA sequences in the NS to the sequence URIs and to the
+alleles that have each sequence.
+
+The index is a SQLite database stored in `SEQUENCE_INDEX_PATH`.
+The database is memory-mapped (`SEQUENCE_INDEX_MMAP_SIZE`) and
+uses write-ahead logging, so all workers share the same pages in
+the OS cache and read it concurrently while writers update it.
+Hash lookups are a single primary key search and do not reach
+Virtuoso.
+
+The index is updated by the processes that insert alleles and by
+the functions that delete alleles and loci. It can be rebuilt from
+Virtuoso with `sequence_index_builder.py`. Lookups return None
+while the index has not been built or is being rebuilt, and callers
+must then send the query to Virtuoso.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import sqlite3
+import logging
+import threading
+from itertools import islice
+
+from config import Config
+from app.utils import pagination
+from app.utils import sparql_queries as sq
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sequences (hash TEXT PRIMARY KEY,
+                                      uri TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS alleles (hash TEXT NOT NULL,
+                                    allele TEXT NOT NULL,
+                                    PRIMARY KEY (hash, allele)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS alleles_by_uri ON alleles (allele);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY,
+                                 value TEXT) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS removed (uri TEXT PRIMARY KEY,
+                                    is_locus INTEGER NOT NULL) WITHOUT ROWID;
+"""
+
+
+def sequence_hash(sequence_uri):
+    """ Gets the hash of a sequence from its URI. """
+
+    return sequence_uri.rsplit('/', 1)[-1]
+
+
+def row_key(row):
+    """ Gets the key used to page the rows of the query
+        that rebuilds the index (sequence and allele URIs).
+    """
+
+    return (row['sequence']['value'],
+            row['allele']['value'] if 'allele' in row else '')
+
+
+def locus_range(locus_uri):
+    """ Gets the bounds of the URIs of the alleles of a locus.
+
+        Allele URIs are '<locus_uri>/alleles/<id>', so all
+        allele URIs of a locus are equal or greater than the
+        first bound and lower than the second bound.
+    """
+
+    return (locus_uri + '/alleles/', locus_uri + '/alleles0')
+
+
+class SequenceIndex(object):
+    """ Index of the sequences in the NS keyed by hash.
+
+        Parameters
+        ----------
+        path: str
+            Path to the SQLite database.
+        mmap_size: int
+            Maximum number of bytes of the database that
+            are memory-mapped.
+    """
+
+    def __init__(self, path, mmap_size):
+        self.path = path
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        """ Connection of the current thread, opened on first use
+            and after the process forks.
+        """
+
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA mmap_size={0}'.format(int(self.mmap_size)))
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = pid
+
+        return self._local.connection
+
+    def is_complete(self, connection):
+        """ Determines if the index has all sequences in the NS. """
+
+        row = connection.execute('SELECT value FROM meta '
+                                 "WHERE key = 'complete'").fetchone()
+
+        return row is not None and row[0] == '1'
+
+    def contains(self, seq_hash):
+        """ Determines if a sequence is in the NS.
+
+            Parameters
+            ----------
+            seq_hash: str
+                SHA-256 hash of the DNA sequence.
+
+            Returns
+            -------
+            bool
+                True if the sequence is in the NS, False
+                otherwise. None if the index is not available.
+        """
+
+        if not os.path.isfile(self.path):
+            return None
+
+        try:
+            connection = self.connection
+            if not self.is_complete(connection):
+                return None
+            row = connection.execute('SELECT 1 FROM sequences WHERE hash = ?',
+                                     (seq_hash,)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning('Could not read sequence index: {0}'.format(e))
+            return None
+
+        return row is not None
+
+    def lookup(self, seq_hash):
+        """ Gets the URI of a sequence and the alleles that
+            have the sequence.
+
+            Parameters
+            ----------
+            seq_hash: str
+                SHA-256 hash of the DNA sequence.
+
+            Returns
+            -------
+            list
+                The sequence URI (None if the sequence is not
+                in the NS) and the list of allele URIs. None
+                if the index is not available.
+        """
+
+        if not os.path.isfile(self.path):
+            return None
+
+        try:
+            connection = self.connection
+            if not self.is_complete(connection):
+                return None
+            row = connection.execute('SELECT uri FROM sequences WHERE hash = ?',
+                                     (seq_hash,)).fetchone()
+            if row is None:
+                return [None, []]
+            alleles = connection.execute('SELECT allele FROM alleles WHERE hash = ?',
+                                         (seq_hash,)).fetchall()
+        except sqlite3.Error as e:
+            logging.warning('Could not read sequence index: {0}'.format(e))
+            return None
+
+        return [row[0], [a[0] for a in alleles]]
+
+    def write(self, statements):
+        """ Executes statements in a single transaction.
+
+            Parameters
+            ----------
+            statements: list
+                Tuples with a SQL statement and a list of
+                parameters for each execution.
+
+            Returns
+            -------
+            bool
+                True if the transaction was committed. The
+                index is marked as incomplete if it fails,
+                so it must be rebuilt.
+        """
+
+        try:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                for statement, params in statements:
+                    connection.executemany(statement, params)
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logging.warning('Could not update sequence index, it must be '
+                            'rebuilt: {0}'.format(e))
+            try:
+                self.connection.execute('INSERT OR REPLACE INTO meta '
+                                        "VALUES ('complete', '0')")
+            except sqlite3.Error:
+                pass
+            return False
+
+        return True
+
+    def add(self, entries):
+        """ Adds sequences and alleles to the index.
+
+            Parameters
+            ----------
+            entries: iterable
+                Tuples with a sequence URI and the URI of
+                an allele with that sequence. The allele URI
+                can be None.
+        """
+
+        entries = list(entries)
+        sequences = [(sequence_hash(s), s) for s, a in entries]
+        alleles = [(sequence_hash(s), a) for s, a in entries if a is not None]
+
+        return self.write([('INSERT OR IGNORE INTO sequences VALUES (?, ?)', sequences),
+                           ('INSERT OR IGNORE INTO alleles VALUES (?, ?)', alleles)])
+
+    def remove_alleles(self, allele_uris):
+        """ Removes alleles from the index. Sequences are
+            kept because they are not deleted from the NS.
+
+            Parameters
+            ----------
+            allele_uris: list
+                URIs of the alleles.
+        """
+
+        params = [(uri,) for uri in allele_uris]
+
+        return self.write([('DELETE FROM alleles WHERE allele = ?', params),
+                           ('INSERT OR REPLACE INTO removed '
+                            'SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM meta '
+                            "WHERE key = 'complete' AND value = '1')", params)])
+
+    def remove_loci(self, loci_uris):
+        """ Removes the alleles of loci from the index.
+
+            Parameters
+            ----------
+            loci_uris: list
+                URIs of the loci.
+        """
+
+        return self.write([('DELETE FROM alleles WHERE allele >= ? AND allele < ?',
+                            [locus_range(uri) for uri in loci_uris]),
+                           ('INSERT OR REPLACE INTO removed '
+                            'SELECT ?, 1 WHERE NOT EXISTS (SELECT 1 FROM meta '
+                            "WHERE key = 'complete' AND value = '1')",
+                            [(uri,) for uri in loci_uris])])
+
+    def rebuild(self, server, virtuoso_graph, page_size=10000):
+        """ Rebuilds the index with the sequences and alleles
+            in Virtuoso.
+
+            The index is emptied and marked as incomplete
+            until all rows are retrieved. Alleles and loci
+            that are removed while the index is rebuilt are
+            removed again at the end, because the pages that
+            include them might have been retrieved before
+            they were deleted.
+
+            Parameters
+            ----------
+            server: str
+                URL of the SPARQL endpoint.
+            virtuoso_graph: str
+                URI of the default graph.
+            page_size: int
+                Number of rows per page.
+
+            Returns
+            -------
+            total: int
+                Number of rows added to the index.
+
+            Raises
+            ------
+            PageError
+                If a page could not be retrieved.
+        """
+
+        self.write([("INSERT OR REPLACE INTO meta VALUES ('complete', ?)", [('0',)]),
+                    ('DELETE FROM removed', [()]),
+                    ('DELETE FROM alleles', [()]),
+                    ('DELETE FROM sequences', [()])])
+
+        rows = pagination.fetch_pages(server, sq.SELECT_SEQUENCE_INDEX,
+                                      [virtuoso_graph], page_size,
+                                      key=row_key, start=('', ''))
+        total = 0
+        while True:
+            page = list(islice(rows, page_size))
+            if len(page) == 0:
+                break
+            if not self.add((r['sequence']['value'],
+                             r['allele']['value'] if 'allele' in r else None)
+                            for r in page):
+                raise sqlite3.Error('Could not add rows to the sequence index.')
+            total += len(page)
+
+        removed = self.connection.execute('SELECT uri, is_locus FROM removed').fetchall()
+        self.write([('DELETE FROM alleles WHERE allele = ?',
+                     [(r[0],) for r in removed if r[1] == 0]),
+                    ('DELETE FROM alleles WHERE allele >= ? AND allele < ?',
+                     [locus_range(r[0]) for r in removed if r[1] == 1]),
+                    ('DELETE FROM removed', [()]),
+                    ("INSERT OR REPLACE INTO meta VALUES ('complete', ?)", [('1',)])])
+
+        return total
+
+
+index = SequenceIndex(Config.SEQUENCE_INDEX_PATH,
+                      Config.SEQUENCE_INDEX_MMAP_SIZE)
+
+
+def contains(seq_hash):
+    """ Determines if a sequence is in the NS with the process
+        index. See `SequenceIndex.contains`.
+    """
+
+    return index.contains(seq_hash)
+
+
+def lookup(seq_hash):
+    """ Gets the URI and alleles of a sequence with the process
+        index. See `SequenceIndex.lookup`.
+    """
+
+    return index.lookup(seq_hash)
+
+
+def add(entries):
+    """ Adds sequences and alleles to the process index.
+        See `SequenceIndex.add`.
+    """
+
+    return index.add(entries)
+
+
+def remove_alleles(allele_uris):
+    """ Removes alleles from the process index.
+        See `SequenceIndex.remove_alleles`.
+    """
+
+    return index.remove_alleles(allele_uris)
+
+
+def remove_loci(loci_uris):
+    """ Removes the alleles of loci from the process index.
+        See `SequenceIndex.remove_loci`.
+    """
+
+    return index.remove_loci(loci_uris)
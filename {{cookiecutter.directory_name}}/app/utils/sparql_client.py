@@ -0,0 +1,652 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the client used to communicate with the
+SPARQL endpoints (local Virtuoso instance and UniProt).
+
+Each process keeps a single `requests.Session` with a pool of
+keep-alive connections that is shared by all threads of that
+process. Requests are retried with jittered exponential backoff
+until they succeed, fail with a non-retriable error or exceed
+the deadline defined for the call.
+
+The `get_data`, `send_data` and `send_big_query` functions accept
+the same arguments as the functions with the same name that were
+previously defined in the `auxiliary_functions` module and return
+the same type of objects.
+
+Functions registered with `add_listener` are called after each
+query with the name of the client function, the query, the time
+it took and whether it failed. They are used to collect metrics.
+
+`stream_data` returns a `BindingsStream` that parses the JSON
+response incrementally and yields one binding at a time, so that
+large results can be sent to clients without being fully loaded
+in memory.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import json
+import time
+import codecs
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+
+
+# return format accepted from SPARQL endpoints
+JSON_ACCEPT = 'application/sparql-results+json,application/json'
+
+# queries longer than this are sent with POST to avoid
+# exceeding the maximum URL length accepted by Virtuoso
+MAX_GET_QUERY_LENGTH = 8000
+
+# HTTP status codes that indicate a transient failure
+RETRIABLE_STATUS = {429, 500, 502, 503, 504}
+
+# one session per process, sessions cannot be shared after fork
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# functions called after each query
+_listeners = []
+
+
+class SPARQLClientError(Exception):
+    """ Exception returned when a request to a SPARQL endpoint fails.
+
+        Parameters
+        ----------
+        message: str
+            Description of the error.
+        status_code: int
+            HTTP status code returned by the endpoint or
+            None if the endpoint did not return a response.
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class BindingsStream(object):
+    """ Iterates over the bindings of a SPARQL JSON response
+        while the response is downloaded.
+
+        Only the text of the binding being parsed and of the
+        chunk that was last read is kept in memory. Members that
+        precede "results" are parsed normally and the "head"
+        member is available in the `head` attribute once the
+        first binding has been yielded.
+
+        Parameters
+        ----------
+        response: requests.Response
+            Response to a query sent with `stream=True`.
+            The response is closed when the iteration
+            ends.
+        chunk_size: int
+            Number of bytes read from the response at
+            a time.
+
+        Raises
+        ------
+        SPARQLClientError
+            If the connection fails or the response is not
+            a valid SPARQL JSON document. Bindings yielded
+            before the error are valid.
+    """
+
+    def __init__(self, response, chunk_size=None):
+        self.response = response
+        self.head = None
+        chunk_size = chunk_size or Config.SPARQL_STREAM_CHUNK_SIZE
+        self._chunks = response.iter_content(chunk_size=chunk_size)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+
+    def __iter__(self):
+        try:
+            yield from self._parse()
+        except ValueError as e:
+            raise SPARQLClientError('Invalid JSON response: {0}'.format(e),
+                                    self.response.status_code)
+        except requests.RequestException as e:
+            raise SPARQLClientError(str(e))
+        finally:
+            self.close()
+
+    def close(self):
+        """ Closes the response and releases its connection. """
+
+        self.response.close()
+
+    def _parse(self):
+        self._expect('{')
+        key = self._member_key()
+        while key is not None:
+            if key == 'results':
+                self._expect('{')
+                key = self._member_key()
+                while key is not None:
+                    if key == 'bindings':
+                        yield from self._array()
+                        # read the end of the document so that
+                        # the connection can be reused
+                        for chunk in self._chunks:
+                            pass
+                        return
+                    self._value()
+                    key = self._member_key()
+                return
+            value = self._value()
+            if key == 'head':
+                self.head = value
+            key = self._member_key()
+
+    def _fill(self):
+        """ Reads the next chunk of the response. Returns
+            False if there is nothing left to read.
+        """
+
+        if self._exhausted is True:
+            return False
+
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            text = self._decoder.decode(b'', final=True)
+        else:
+            text = self._decoder.decode(chunk)
+
+        # discard the text that was already parsed
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+
+        return True
+
+    def _peek(self):
+        """ Skips whitespace and returns the next character. """
+
+        while True:
+            while self._pos < len(self._buffer):
+                char = self._buffer[self._pos]
+                if char not in ' \t\n\r':
+                    return char
+                self._pos += 1
+            if self._fill() is False:
+                raise ValueError('unexpected end of response')
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('expected {0!r} at position {1}'.format(char, self._pos))
+        self._pos += 1
+
+    def _value(self):
+        """ Decodes the next JSON value. """
+
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+                # numbers and literals may continue in the next chunk
+                if end < len(self._buffer) or self._exhausted is True:
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._exhausted is True:
+                    raise
+            self._fill()
+
+    def _member_key(self):
+        """ Gets the key of the next member of an object.
+            Returns None at the end of the object.
+        """
+
+        char = self._peek()
+        if char == ',':
+            self._pos += 1
+            char = self._peek()
+        if char == '}':
+            self._pos += 1
+            return None
+
+        key = self._value()
+        self._expect(':')
+
+        return key
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self._value()
+            char = self._peek()
+            self._pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('expected \',\' at position {0}'.format(self._pos - 1))
+
+
+def add_listener(listener):
+    """ Registers a function that is called after each query.
+
+        Parameters
+        ----------
+        listener: function
+            Function that receives the name of the client
+            function that sent the query, the query, the
+            number of seconds it took and True if it failed.
+    """
+
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def notify(function, sparql_query, start, result):
+    """ Passes the outcome of a query to the registered listeners.
+
+        Parameters
+        ----------
+        function: str
+            Name of the client function that sent the query.
+        sparql_query: str
+            SPARQL query that was sent.
+        start: float
+            Value of `time.monotonic` when the query was sent.
+        result
+            Value returned by the client function or the
+            exception that it raised.
+    """
+
+    if not _listeners:
+        return
+
+    seconds = time.monotonic() - start
+    if isinstance(result, requests.Response):
+        failed = result.status_code >= 400
+    else:
+        failed = isinstance(result, Exception)
+
+    for listener in _listeners:
+        try:
+            listener(function, sparql_query, seconds, failed)
+        except Exception:
+            logging.exception('SPARQL client listener failed.')
+
+
+def get_session():
+    """ Gets the HTTP session of the current process.
+
+        Returns
+        -------
+        session: requests.Session
+            Session with a pool of keep-alive connections.
+            A new session is created the first time this
+            function is called in a process.
+    """
+
+    pid = os.getpid()
+    session = _sessions.get(pid)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(pid)
+            if session is None:
+                # discard sessions inherited from the parent process
+                _sessions.clear()
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=Config.SPARQL_POOL_SIZE,
+                                      pool_maxsize=Config.SPARQL_POOL_SIZE,
+                                      max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[pid] = session
+
+    return session
+
+
+def endpoint_url(server):
+    """ Gets the URL of a SPARQL endpoint.
+
+        Parameters
+        ----------
+        server: str or SPARQLWrapper
+            URL of the SPARQL endpoint or
+            SPARQLWrapper object for the endpoint.
+
+        Returns
+        -------
+        str
+            URL of the SPARQL endpoint.
+    """
+
+    return getattr(server, 'endpoint', server)
+
+
+def backoff_delay(attempt):
+    """ Determines how long to wait before retrying a request.
+
+        Parameters
+        ----------
+        attempt: int
+            Number of failed attempts.
+
+        Returns
+        -------
+        float
+            Number of seconds to wait. Uses "full jitter", a
+            random value between 0 and an exponentially growing
+            ceiling, so that workers that failed at the same time
+            do not retry at the same time.
+    """
+
+    ceiling = min(Config.SPARQL_BACKOFF_MAX,
+                  Config.SPARQL_BACKOFF_BASE * (2 ** (attempt - 1)))
+
+    return random.uniform(0, ceiling)
+
+
+def request_with_retries(method, url, max_tries, deadline, **kwargs):
+    """ Sends a HTTP request and retries it if it fails with a
+        transient error.
+
+        Parameters
+        ----------
+        method: str
+            HTTP method ('GET' or 'POST').
+        url: str
+            URL of the SPARQL endpoint.
+        max_tries: int
+            Maximum number of attempts.
+        deadline: float
+            Maximum number of seconds that all attempts
+            may take. Uses the value of `SPARQL_DEADLINE`
+            in the configuration if it is None.
+        **kwargs
+            Keyword arguments passed to `requests.Session.request`.
+
+        Returns
+        -------
+        response: requests.Response
+            The last response received from the endpoint.
+
+        Raises
+        ------
+        requests.RequestException
+            If no response was received from the endpoint.
+    """
+
+    deadline = Config.SPARQL_DEADLINE if deadline is None else deadline
+    stop_time = time.monotonic() + deadline
+    session = get_session()
+
+    tries = 0
+    while True:
+        tries += 1
+        remaining = stop_time - time.monotonic()
+        timeout = (Config.SPARQL_CONNECT_TIMEOUT,
+                   max(min(Config.SPARQL_TIMEOUT, remaining), 1))
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+            if response.status_code not in RETRIABLE_STATUS:
+                return response
+            error = None
+        except (requests.ConnectionError, requests.Timeout) as e:
+            response = None
+            error = e
+
+        delay = backoff_delay(tries)
+        if tries >= max_tries or time.monotonic() + delay >= stop_time:
+            if response is not None:
+                return response
+            raise error
+
+        # release the connection of streamed responses
+        if response is not None:
+            response.close()
+
+        time.sleep(delay)
+
+
+def send_query(server, sparql_query, method, deadline, stream=False):
+    """ Sends a SPARQL query that returns results in JSON format.
+
+        Parameters
+        ----------
+        server: str or SPARQLWrapper
+            URL of the SPARQL endpoint or
+            SPARQLWrapper object for the endpoint.
+        sparql_query: str
+            SPARQL query to perform.
+        method: str
+            HTTP method ('GET' or 'POST').
+        deadline: float
+            Maximum number of seconds for the request.
+        stream: bool
+            True to defer downloading the response body.
+
+        Returns
+        -------
+        response: requests.Response
+            The last response received from the endpoint.
+
+        Raises
+        ------
+        requests.RequestException
+            If no response was received from the endpoint.
+    """
+
+    url = endpoint_url(server)
+    params = {'query': sparql_query, 'format': 'json'}
+    headers = {'Accept': JSON_ACCEPT}
+
+    if method == 'GET':
+        request_args = {'params': params}
+    else:
+        request_args = {'data': params}
+
+    return request_with_retries(method, url,
+                                Config.SPARQL_MAX_TRIES,
+                                deadline,
+                                headers=headers,
+                                stream=stream,
+                                **request_args)
+
+
+def query_endpoint(server, sparql_query, method, deadline):
+    """ Sends a SPARQL query and parses the JSON response.
+
+        Parameters
+        ----------
+        server: str or SPARQLWrapper
+            URL of the SPARQL endpoint or
+            SPARQLWrapper object for the endpoint.
+        sparql_query: str
+            SPARQL query to perform.
+        method: str
+            HTTP method ('GET' or 'POST').
+        deadline: float
+            Maximum number of seconds for the request.
+
+        Returns
+        -------
+        result: dict or SPARQLClientError
+            JSON response from the server or the
+            exception if the request failed.
+    """
+
+    try:
+        response = send_query(server, sparql_query, method, deadline)
+    except requests.RequestException as e:
+        return SPARQLClientError(str(e))
+
+    if response.status_code != 200:
+        return SPARQLClientError(response.text, response.status_code)
+
+    try:
+        result = response.json()
+    except ValueError as e:
+        result = SPARQLClientError('Invalid JSON response: {0}'.format(e),
+                                   response.status_code)
+
+    return result
+
+
+def get_data(server, sparql_query, deadline=None):
+    """ Gets data from Virtuoso.
+
+        Parameters
+        ----------
+        server: str or SPARQLWrapper
+            URL of the SPARQL server.
+        sparql_query: str
+            SPARQL query to perform.
+        deadline: float
+            Maximum number of seconds for the request,
+            including retries.
+
+        Returns
+        -------
+        result: dict
+            JSON response from the server. Returns the
+            exception if the request failed.
+    """
+
+    method = 'POST' if len(sparql_query) > MAX_GET_QUERY_LENGTH else 'GET'
+
+    start = time.monotonic()
+    result = query_endpoint(server, sparql_query, method, deadline)
+    notify('get_data', sparql_query, start, result)
+
+    return result
+
+
+def send_data(sparql_query, url_send_local_virtuoso, virtuoso_user,
+              virtuoso_pass, deadline=None):
+    """ Sends data to Virtuoso.
+
+        Parameters
+        ----------
+        sparql_query: str
+            SPARQL query to perform.
+        url_send_local_virtuoso: str
+            URL of the SPARQL server.
+        virtuoso_user: str
+            Virtuoso username.
+        virtuoso_pass: str
+            Virtuoso password.
+        deadline: float
+            Maximum number of seconds for the request,
+            including retries.
+
+        Returns
+        -------
+        r: requests.Response
+            Request response
+    """
+
+    headers = {'content-type': 'application/sparql-query'}
+    start = time.monotonic()
+    try:
+        r = request_with_retries('POST', url_send_local_virtuoso,
+                                 Config.SPARQL_SEND_MAX_TRIES,
+                                 deadline,
+                                 data=sparql_query.encode('utf-8'),
+                                 headers=headers,
+                                 auth=requests.auth.HTTPBasicAuth(virtuoso_user,
+                                                                  virtuoso_pass))
+    except requests.RequestException as e:
+        notify('send_data', sparql_query, start, e)
+        raise
+
+    notify('send_data', sparql_query, start, r)
+
+    return r
+
+
+def send_big_query(server, sparql_query, deadline=None):
+    """ Sends a big query to Virtuoso.
+
+        Parameters
+        ----------
+        server: str or SPARQLWrapper
+            URL of the SPARQL server.
+        sparql_query: str
+            SPARQL query to perform. The query is sent in
+            the body of a POST request.
+        deadline: float
+            Maximum number of seconds for the request,
+            including retries.
+
+        Returns
+        -------
+        result: dict
+            JSON response from the server. Returns the
+            exception if the request failed.
+    """
+
+    start = time.monotonic()
+    result = query_endpoint(server, sparql_query, 'POST', deadline)
+    notify('send_big_query', sparql_query, start, result)
+
+    return result
+
+
+def stream_data(server, sparql_query, deadline=None):
+    """ Gets data from Virtuoso without loading the whole
+        response in memory.
+
+        Parameters
+        ----------
+        server: str or SPARQLWrapper
+            URL of the SPARQL server.
+        sparql_query: str
+            SPARQL SELECT query to perform.
+        deadline: float
+            Maximum number of seconds to receive the
+            response headers, including retries.
+
+        Returns
+        -------
+        result: BindingsStream
+            Iterable over the bindings in the response.
+            Returns the exception if the request failed.
+    """
+
+    method = 'POST' if len(sparql_query) > MAX_GET_QUERY_LENGTH else 'GET'
+
+    # only the time until the response headers arrive is measured
+    start = time.monotonic()
+    try:
+        response = send_query(server, sparql_query, method, deadline,
+                              stream=True)
+    except requests.RequestException as e:
+        error = SPARQLClientError(str(e))
+        notify('stream_data', sparql_query, start, error)
+        return error
+
+    notify('stream_data', sparql_query, start, response)
+    if response.status_code != 200:
+        error = SPARQLClientError(response.text, response.status_code)
+        response.close()
+        return error
+
+    return BindingsStream(response)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains a Flask extension that counts and times the
+queries sent to Virtuoso while each request is handled.
+
+Queries are tagged with the name of the template in the
+`sparql_queries` module that they were created from ('unknown' if
+they do not match any template). The extension keeps, per process:
+
+- for each endpoint, histograms of the number of queries and of
+  the time spent in queries per request.
+- for each template, a histogram of the query times and the
+  number of failed queries.
+- the most recent requests that sent more queries than
+  `SPARQL_METRICS_MAX_QUERIES`, which usually means that a handler
+  sends one query per item (N+1 queries).
+
+The number of queries and the time spent in queries are added to
+the response headers if `SPARQL_METRICS_HEADERS` is True.
+
+Only queries sent from the thread that handles the request are
+counted. Queries sent by worker threads (e.g. batched or paged
+queries) are included in the template histograms but not in the
+endpoint histograms.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import re
+import time
+import bisect
+import logging
+import threading
+import string
+from collections import Counter, deque
+
+from flask import g, request, has_request_context
+
+from app.utils import sparql_client
+from app.utils import sparql_queries as sq
+
+
+# upper bounds of the buckets for query times, in seconds
+SECONDS_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 300]
+
+# upper bounds of the buckets for the number of queries per request
+QUERIES_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000]
+
+# number of flagged requests kept
+MAX_FLAGGED = 50
+
+
+class Histogram(object):
+    """ Histogram with fixed buckets.
+
+        Parameters
+        ----------
+        buckets: list
+            Sorted upper bounds of the buckets. Values
+            above the last bound go to a '+Inf' bucket.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """ Adds a value to the histogram. """
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        """ Cumulative counts per bucket, as in Prometheus. """
+
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+
+        return {'count': self.count,
+                'sum': round(self.sum, 6),
+                'buckets': buckets}
+
+
+def compile_templates():
+    """ Creates regular expressions that match the queries
+        created from each template in `sparql_queries`.
+
+        Returns
+        -------
+        templates: list
+            Tuples with the literal text that precedes the
+            first placeholder, the template name and the
+            regular expression. Templates with more literal
+            text come first so that the most specific
+            template is selected.
+    """
+
+    formatter = string.Formatter()
+    templates = []
+    for name, value in vars(sq).items():
+        if not name.isupper() or not isinstance(value, str):
+            continue
+        try:
+            parts = list(formatter.parse(value))
+        except ValueError:
+            continue
+
+        pattern = ''.join(re.escape(literal) + ('.*?' if field is not None else '')
+                          for literal, field, spec, conversion in parts)
+        literal_length = sum(len(part[0]) for part in parts)
+        templates.append((literal_length, parts[0][0] if parts else '',
+                          name, re.compile(pattern, re.DOTALL)))
+
+    templates.sort(key=lambda t: -t[0])
+
+    return [t[1:] for t in templates]
+
+
+class SPARQLMetrics(object):
+    """ Collects metrics about the queries sent to Virtuoso.
+
+        Parameters
+        ----------
+        app: flask.Flask
+            Application to instrument. The application
+            can also be passed later to `init_app`.
+    """
+
+    def __init__(self, app=None):
+        self.max_queries = None
+        self.headers = False
+        self._templates = None
+        self._endpoints = {}
+        self._template_stats = {}
+        self._flagged = deque(maxlen=MAX_FLAGGED)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ Registers the hooks that collect metrics.
+
+            Parameters
+            ----------
+            app: flask.Flask
+                Application to instrument.
+        """
+
+        self.max_queries = app.config['SPARQL_METRICS_MAX_QUERIES']
+        self.headers = app.config['SPARQL_METRICS_HEADERS']
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        sparql_client.add_listener(self.record)
+
+    def template_name(self, sparql_query):
+        """ Determines the template a query was created from.
+
+            Parameters
+            ----------
+            sparql_query: str
+                SPARQL query.
+
+            Returns
+            -------
+            str
+                Name of the template in the `sparql_queries`
+                module or 'unknown'.
+        """
+
+        if self._templates is None:
+            self._templates = compile_templates()
+
+        for prefix, name, pattern in self._templates:
+            if sparql_query.startswith(prefix) and pattern.fullmatch(sparql_query):
+                return name
+
+        return 'unknown'
+
+    def record(self, function, sparql_query, seconds, failed):
+        """ Records a query. Registered as a listener of
+            the SPARQL client.
+        """
+
+        template = self.template_name(sparql_query)
+        with self._lock:
+            stats = self._template_stats.get(template)
+            if stats is None:
+                stats = {'functions': Counter(),
+                         'failed': 0,
+                         'seconds': Histogram(SECONDS_BUCKETS)}
+                self._template_stats[template] = stats
+            stats['functions'][function] += 1
+            stats['failed'] += int(failed)
+            stats['seconds'].observe(seconds)
+
+        if has_request_context() and 'sparql_calls' in g:
+            g.sparql_calls.append((template, seconds))
+
+    def before_request(self):
+        g.sparql_calls = []
+        g.sparql_start = time.monotonic()
+
+    def after_request(self, response):
+        calls = g.pop('sparql_calls', None)
+        if calls is None:
+            return response
+
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        endpoint = '{0} {1}'.format(request.method, rule)
+        total_seconds = sum(c[1] for c in calls)
+        flagged = len(calls) > self.max_queries
+
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = {'requests': 0,
+                         'flagged': 0,
+                         'queries': Histogram(QUERIES_BUCKETS),
+                         'seconds': Histogram(SECONDS_BUCKETS)}
+                self._endpoints[endpoint] = stats
+            stats['requests'] += 1
+            stats['flagged'] += int(flagged)
+            stats['queries'].observe(len(calls))
+            stats['seconds'].observe(total_seconds)
+
+        if flagged is True:
+            templates = Counter(c[0] for c in calls).most_common(5)
+            self._flagged.append({'endpoint': endpoint,
+                                  'path': request.path,
+                                  'queries': len(calls),
+                                  'seconds': round(total_seconds, 6),
+                                  'request_seconds': round(time.monotonic() - g.sparql_start, 6),
+                                  'templates': dict(templates)})
+            logging.warning('{0} sent {1} SPARQL queries (most frequent: '
+                            '{2}).'.format(endpoint, len(calls), templates))
+
+        if self.headers is True:
+            response.headers.set('X-SPARQL-Queries', str(len(calls)))
+            response.headers.set('X-SPARQL-Time', '{0:.3f}'.format(total_seconds))
+            if flagged is True:
+                response.headers.set('X-SPARQL-Flagged', 'true')
+
+        return response
+
+    def snapshot(self):
+        """ Gets the metrics collected by this process.
+
+            Returns
+            -------
+            dict
+                Histograms per endpoint and per template
+                and the last flagged requests.
+        """
+
+        with self._lock:
+            endpoints = {k: {'requests': v['requests'],
+                             'flagged': v['flagged'],
+                             'queries': v['queries'].to_dict(),
+                             'seconds': v['seconds'].to_dict()}
+                         for k, v in self._endpoints.items()}
+            templates = {k: {'functions': dict(v['functions']),
+                             'failed': v['failed'],
+                             'seconds': v['seconds'].to_dict()}
+                         for k, v in self._template_stats.items()}
+            flagged = list(self._flagged)
+
+        return {'pid': os.getpid(),
+                'max_queries': self.max_queries,
+                'endpoints': endpoints,
+                'templates': templates,
+                'flagged': flagged}
+
+
+metrics = SPARQLMetrics()
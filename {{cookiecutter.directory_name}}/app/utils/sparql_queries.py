@@ -251,11 +251,39 @@ COUNT_LOCUS_ALLELES = ('SELECT (COUNT(?alleles) AS ?count)'
                        'WHERE '
                        '{{ ?alleles typon:isOfLocus <{1}> .}}')
 
+# {1} is a VALUES block with loci URIs, e.g. '<uri1> <uri2>'
+COUNT_LOCI_ALLELES = ('SELECT ?locus (COUNT(?alleles) AS ?count) '
+                      'FROM <{0}> '
+                      'WHERE '
+                      '{{ VALUES ?locus {{ {1} }}'
+                        ' ?alleles typon:isOfLocus ?locus .}} '
+                      'GROUP BY ?locus')
+
 SELECT_SEQ_FASTA = ('SELECT (str(?nucSeq) AS ?nucSeq) '
                     'FROM <{0}>'
                     'WHERE '
                     '{{ <{1}> typon:nucleotideSequence ?nucSeq .}}')
 
+# {1} is a VALUES block with sequence URIs, e.g. '<uri1> <uri2>'
+SELECT_SEQS_FASTA = ('SELECT ?sequence (str(?nucSeq) AS ?nucSeq) '
+                     'FROM <{0}> '
+                     'WHERE '
+                     '{{ VALUES ?sequence {{ {1} }}'
+                       ' ?sequence typon:nucleotideSequence ?nucSeq .}}')
+
+SELECT_EXISTING_ALLELES = ('SELECT ?allele '
+                           'FROM <{0}> '
+                           'WHERE '
+                           '{{ VALUES ?allele {{ {1} }}'
+                             ' ?locus a typon:Locus;'
+                             ' typon:hasDefinedAllele ?allele .}}')
+
+SELECT_EXISTING_ISOLATES = ('SELECT ?isolate '
+                            'FROM <{0}> '
+                            'WHERE '
+                            '{{ VALUES ?isolate {{ {1} }}'
+                              ' ?isolate a typon:Isolate .}}')
+
 SELECT_SCHEMA_ADMIN = ('SELECT ?schema ?admin '
                        'FROM <{0}> '
                        'WHERE {{ <{1}> a typon:Schema;'
@@ -348,6 +376,13 @@ SELECT_SCHEMA_DATE = ('SELECT (str(?description) AS ?name) '
                       '{{ <{1}> typon:schemaName ?description;'
                         ' typon:last_modified ?last_modified .}}')
 
+SELECT_SCHEMA_VERSION = ('SELECT (str(?last_modified) AS ?last_modified) '
+                         '(str(?Schema_lock) AS ?Schema_lock) '
+                         'FROM <{0}> '
+                         'WHERE '
+                         '{{ <{1}> typon:last_modified ?last_modified;'
+                           ' typon:Schema_lock ?Schema_lock .}}')
+
 SELECT_SCHEMA_DESCRIPTION = ('SELECT ?name ?description '
                              'FROM <{0}> '
                              'WHERE '
@@ -378,6 +413,22 @@ SELECT_SCHEMA_LOCI = ('SELECT '
                         ' FILTER NOT EXISTS {{ ?part typon:deprecated  "true"^^xsd:boolean }} }}'
                       'ORDER BY (?name) ')
 
+# number of alleles per locus inserted before a date ({2}) and
+# number of those alleles inserted after another date ({3})
+SELECT_SCHEMA_LOCI_CHANGES = ('SELECT '
+                              '?locus '
+                              '(COUNT(?alleles) AS ?count) '
+                              '(SUM(IF(?date >= "{3}"^^xsd:dateTime, 1, 0)) AS ?new) '
+                              'FROM <{0}> '
+                              'WHERE '
+                              '{{ <{1}> typon:hasSchemaPart ?part .'
+                                ' ?part typon:hasLocus ?locus .'
+                                ' ?alleles typon:isOfLocus ?locus;'
+                                ' typon:dateEntered ?date .'
+                                ' FILTER ( ?date < "{2}"^^xsd:dateTime )'
+                                ' FILTER NOT EXISTS {{ ?part typon:deprecated  "true"^^xsd:boolean }} }}'
+                              'GROUP BY ?locus')
+
 SELECT_SCHEMA_LATEST_FASTA = ('SELECT '
                                 '?locus_name '
                                 '?allele_id '
@@ -404,6 +455,24 @@ SELECT_SCHEMA_LATEST_FASTA = ('SELECT '
                                    'ORDER BY ASC(?date) }} '
                                 '}} LIMIT 50000')
 
+# date of the last allele returned by SELECT_SCHEMA_LATEST_FASTA
+SELECT_SCHEMA_LATEST_DATE = ('SELECT '
+                             '(MAX(?date) AS ?last_date) '
+                             'FROM <{0}> '
+                             'WHERE {{ '
+                             '{{ SELECT '
+                                '?date '
+                                'FROM <{0}> '
+                                'WHERE {{ <{1}> typon:hasSchemaPart ?part.'
+                                        ' ?part typon:hasLocus ?locus .'
+                                        ' ?alleles typon:isOfLocus ?locus;'
+                                        ' typon:dateEntered ?date .'
+                                        ' FILTER ( ?date > "{2}"^^xsd:dateTime && ?date < "{3}"^^xsd:dateTime ).'
+                                        ' FILTER NOT EXISTS {{ ?part typon:deprecated  "true"^^xsd:boolean }}.}} '
+                                'ORDER BY ASC(?date) '
+                                'LIMIT 50000 }} '
+                             '}}')
+
 SELECT_SCHEMA_LATEST_ALLELES = ('SELECT '
                                 '?locus_name '
                                 '?allele_id '
@@ -448,6 +517,16 @@ SELECT_HIGHEST_LOCUS = ('SELECT ?locus '
                         'BIND((strafter(str(?locus), "loci/") AS ?lastChar)) }}'
                         'ORDER BY DESC(xsd:integer(?lastChar)) LIMIT 1')
 
+SELECT_HIGHEST_ALLELE_ID = ('SELECT (MAX(xsd:integer(?id)) AS ?max_id) '
+                            'FROM <{0}> '
+                            'WHERE {{ ?alleles typon:isOfLocus <{1}>;'
+                                    ' typon:id ?id .}}')
+
+SELECT_HIGHEST_SCHEMA_PART = ('SELECT (MAX(xsd:integer(?index)) AS ?max_id) '
+                              'FROM <{0}> '
+                              'WHERE {{ <{1}> typon:hasSchemaPart ?part .'
+                                      ' ?part typon:index ?index .}}')
+
 INSERT_USER = ('INSERT DATA IN GRAPH <{0}> '
                '{{ <{1}> a <http://xmlns.com/foaf/0.1/Agent>;'
                  ' typon:Role "{2}"^^xsd:string }}')
@@ -679,6 +758,7 @@ COUNT_SCHEMA_ALLELES = ('SELECT '
 # that needs to be returned exceeds MaxSortedTopRows value
 # in virtuoso.ini
 SELECT_ALLELES_LENGTH = ('SELECT '
+                         '?allele '
                          '?locus '
                          '(str(?name) AS ?name) '
                          '(strlen(?nucSeq) AS ?nucSeqLen) '
@@ -692,8 +772,11 @@ SELECT_ALLELES_LENGTH = ('SELECT '
                            ' typon:isOfLocus ?locus .'
                            ' ?allele typon:hasSequence ?sequence .'
                            ' ?sequence typon:nucleotideSequence ?nucSeq .'
-                           ' FILTER NOT EXISTS {{ ?part typon:deprecated "true"^^xsd:boolean }} }} '
-                         ' OFFSET {2} LIMIT {3}')
+                           ' FILTER NOT EXISTS {{ ?part typon:deprecated "true"^^xsd:boolean }}'
+                           # keyset paging, rows after the last allele
+                           ' FILTER (STR(?allele) > "{2}") }} '
+                         'ORDER BY STR(?allele) '
+                         'LIMIT {3}')
 
 SELECT_SCHEMA_LOCI_ANNOTATIONS = ('SELECT DISTINCT '
                                   '?locus '
@@ -776,6 +859,44 @@ SELECT_SPECIES_SCHEMA = ('SELECT ?schema '
                            ' typon:Schema_lock ?Schema_lock;'
                            ' typon:SchemaDescription ?SchemaDescription .}}')
 
+SELECT_SCHEMAS_PROPERTIES = ('SELECT ?schema '
+                             '?species '
+                             '?description AS ?name '
+                             '?bsr AS ?bsr '
+                             '?chewBBACA_version AS ?chewBBACA_version '
+                             '?ptf AS ?prodigal_training_file '
+                             '?trans AS ?translation_table '
+                             '?min_locus_len AS ?minimum_locus_length '
+                             '?st AS ?size_threshold '
+                             '?word_size AS ?word_size '
+                             '?cluster_sim AS ?cluster_sim '
+                             '?representative_filter AS ?representative_filter '
+                             '?intraCluster_filter AS ?intraCluster_filter '
+                             '?dateEntered AS ?dateEntered '
+                             '?last_modified AS ?last_modified '
+                             '?Schema_lock AS ?Schema_lock '
+                             '?SchemaDescription AS ?SchemaDescription '
+                             'FROM <{0}> '
+                             'WHERE '
+                             '{{ ?schema a typon:Schema;'
+                               ' typon:isFromTaxon ?species;'
+                               ' typon:schemaName ?description;'
+                               ' typon:bsr ?bsr;'
+                               ' typon:chewBBACA_version ?chewBBACA_version;'
+                               ' typon:ptf ?ptf;'
+                               ' typon:translation_table ?trans;'
+                               ' typon:minimum_locus_length ?min_locus_len;'
+                               ' typon:size_threshold ?st;'
+                               ' typon:word_size ?word_size;'
+                               ' typon:cluster_sim ?cluster_sim;'
+                               ' typon:representative_filter ?representative_filter;'
+                               ' typon:intraCluster_filter ?intraCluster_filter;'
+                               ' typon:dateEntered ?dateEntered;'
+                               ' typon:last_modified ?last_modified;'
+                               ' typon:Schema_lock ?Schema_lock;'
+                               ' typon:SchemaDescription ?SchemaDescription .{1}'
+                               ' FILTER NOT EXISTS {{ ?schema typon:deprecated "true"^^xsd:boolean .}} }}')
+
 SELECT_SPECIES_SCHEMAS = ('SELECT '
                           '?schemas '
                           '?name '
@@ -863,6 +984,32 @@ SELECT_SEQUENCE_INFO_BY_DNA = ('SELECT '
                                  ' OPTIONAL {{ <{1}> typon:hasUniprotSequence ?uniprot .}} .'
                                  ' OPTIONAL {{ <{1}> typon:hasUniprotLabel ?label .}} }}')
 
+# {1} is a VALUES block with sequence URIs, e.g. '<uri1> <uri2>'
+SELECT_SEQUENCES_INFO = ('SELECT '
+                         '?sequence '
+                         '?schemas '
+                         '?locus '
+                         '?alleles '
+                         '?uniprot '
+                         '?label '
+                         '?name '
+                         'FROM <{0}> '
+                         'WHERE '
+                         '{{ VALUES ?sequence {{ {1} }}'
+                           ' ?alleles typon:hasSequence ?sequence;'
+                           ' typon:isOfLocus ?locus .'
+                           ' ?locus a typon:Locus;'
+                           ' typon:isOfTaxon ?taxon .'
+                           ' ?taxon a <http://purl.uniprot.org/core/Taxon>;'
+                           ' typon:name ?name .'
+                           ' ?schemas a typon:Schema;'
+                           ' typon:hasSchemaPart ?part .'
+                           ' ?part a typon:SchemaPart;'
+                           ' typon:hasLocus ?locus .'
+                           ' {2}'
+                           ' OPTIONAL {{ ?sequence typon:hasUniprotSequence ?uniprot .}} .'
+                           ' OPTIONAL {{ ?sequence typon:hasUniprotLabel ?label .}} }}')
+
 SELECT_SEQUENCE_INFO_BY_HASH = ('SELECT '
                                 '?schemas '
                                 '?locus '
@@ -957,6 +1104,20 @@ DELETE_LOCUS_ALLELES = ('DELETE WHERE {{ GRAPH <{0}> '
 
 MULTIPLE_INSERT_LINK_SEQUENCE = ('')
 
+SELECT_SEQUENCE_INDEX = ('SELECT '
+                         '?sequence '
+                         '?allele '
+                         'FROM <{0}> '
+                         'WHERE '
+                         '{{ ?sequence a typon:Sequence .'
+                           ' OPTIONAL {{ ?allele a typon:Allele;'
+                           ' typon:hasSequence ?sequence . }}'
+                           # keyset paging, rows after the last (sequence, allele)
+                           ' FILTER (STR(?sequence) > "{1}" ||'
+                                   ' (STR(?sequence) = "{1}" && BOUND(?allele) && STR(?allele) > "{2}")) }} '
+                         'ORDER BY STR(?sequence) STR(?allele) '
+                         'LIMIT {3}')
+
 SELECT_SEQUENCE_LOCI = ('SELECT '
                         '?locus '
                         '(str(?name) AS ?name) '
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module contains the in-memory cache of the pre-computed
+statistics files served by the `stats` endpoints.
+
+Each file is parsed once per process and kept with the responses
+created from it, already serialized and with their ETag. Responses
+with the entries of a single schema use an index of the entries of
+each schema, so they do not filter the whole file.
+
+Entries are invalidated when the inode, modification time or size
+of their file changes. The statistics files are written with a
+temporary name and renamed (see `stats_engine`), so every update
+creates a new inode and is detected even if it happens within the
+resolution of the modification time. Checking a file only needs a
+`stat` call, so responses are served from memory while the file
+does not change.
+
+Responses include an ETag computed from their content and requests
+with a matching If-None-Match header get a 304 response without
+a body, so clients can revalidate their copies cheaply.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import request, make_response
+
+from config import Config
+
+
+class StatsCache(object):
+    """ LRU cache with the contents of statistics files.
+
+        Parameters
+        ----------
+        max_entries : int
+            Maximum number of files kept in memory.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(path):
+        """ Gets the values that change when a file is updated.
+
+            Raises FileNotFoundError if the file does not exist.
+        """
+
+        stat = os.stat(path)
+
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def entry(self, path):
+        """ Gets the cache entry of a file, reading the file if
+            it is not cached or if it changed.
+
+            Parameters
+            ----------
+            path : str
+                Path to the statistics file.
+
+            Returns
+            -------
+            entry : dict
+                The parsed data ('data'), the entries of each
+                schema ('schemas', indexed on demand) and the
+                serialized responses ('responses').
+        """
+
+        signature = self.signature(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry['signature'] == signature:
+                self._entries.move_to_end(path)
+                return entry
+
+        with open(path, 'r') as json_file:
+            data = json.load(json_file)
+
+        entry = {'signature': signature,
+                 'data': data,
+                 'schemas': {},
+                 'responses': {}}
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return entry
+
+    def schema_entries(self, entry, uri_field, schema_id):
+        """ Gets the entries of a schema in a file shared by
+            all schemas of a species.
+
+            Parameters
+            ----------
+            entry : dict
+                Cache entry of the file.
+            uri_field : str
+                Name of the field with the schema URI.
+            schema_id : str
+                The identifier of the schema in the Chewie-NS.
+
+            Returns
+            -------
+            list
+                Entries of the schema in the 'message' list.
+        """
+
+        index = entry['schemas'].get(uri_field)
+        if index is None:
+            index = {}
+            for e in entry['data']['message']:
+                index.setdefault(e[uri_field].split('/')[-1], []).append(e)
+            entry['schemas'][uri_field] = index
+
+        return index.get(str(schema_id), [])
+
+    def data(self, path, uri_field=None, schema_id=None):
+        """ Gets the data of a file or the entries of a schema.
+            The returned objects are shared and must not be
+            modified.
+
+            Parameters
+            ----------
+            path : str
+                Path to the statistics file.
+            uri_field : str
+                Name of the field with the schema URI.
+            schema_id : str
+                Only get the entries of this schema if it
+                is not None.
+        """
+
+        entry = self.entry(path)
+        if schema_id is None:
+            return entry['data']
+
+        return self.schema_entries(entry, uri_field, schema_id)
+
+    def payload(self, path, uri_field=None, schema_id=None):
+        """ Gets the serialized data of a file or of the entries
+            of a schema and its ETag.
+
+            Parameters
+            ----------
+            See :py:meth:`data`.
+
+            Returns
+            -------
+            list
+                The JSON serialized data and its ETag.
+        """
+
+        entry = self.entry(path)
+        key = (uri_field, schema_id)
+        response = entry['responses'].get(key)
+        if response is None:
+            response = serialize(self.data(path, uri_field, schema_id))
+            entry['responses'][key] = response
+
+        return response
+
+
+cache = StatsCache(Config.STATS_CACHE_MAX_ENTRIES)
+
+
+def serialize(data):
+    """ Serializes data to JSON and computes its ETag. """
+
+    payload = json.dumps(data).encode('utf-8')
+
+    return [payload, hashlib.sha1(payload).hexdigest()]
+
+
+def json_response(payload, etag):
+    """ Creates the response with serialized data. Returns a
+        304 response if the request has a matching ETag.
+    """
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(payload)
+        response.headers['Content-Type'] = 'application/json'
+
+    response.set_etag(etag)
+    # clients must revalidate before using their copy
+    response.headers['Cache-Control'] = 'no-cache'
+
+    return response
+
+
+def stats_data(filename, uri_field=None, schema_id=None):
+    """ Gets the data of a file in `PRE_COMPUTE` through the
+        process cache. See `StatsCache.data`.
+    """
+
+    return cache.data(os.path.join(Config.PRE_COMPUTE, filename),
+                      uri_field, schema_id)
+
+
+def stats_response(filename, uri_field=None, schema_id=None):
+    """ Creates the response with the data of a file in
+        `PRE_COMPUTE` through the process cache. See
+        `StatsCache.payload`.
+    """
+
+    payload, etag = cache.payload(os.path.join(Config.PRE_COMPUTE, filename),
+                                  uri_field, schema_id)
+
+    return json_response(payload, etag)
+
+
+def data_response(data):
+    """ Creates the response with data that is not cached
+        (e.g. after replacing user identifiers by names).
+    """
+
+    payload, etag = serialize(data)
+
+    return json_response(payload, etag)
@@ -0,0 +1,707 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module computes the pre-computed statistics files used by
+the frontend for a schema:
+
+- ``totals_<species>.json``: number of loci and alleles and the
+  properties of each schema of a species.
+- ``loci_<species>.json``: number of alleles per locus of each
+  schema of a species.
+- ``mode_<species>_<schema>.json``: allele length mode, number of
+  alleles and length summary per locus (scatter plot data).
+- ``annotations_<species>_<schema>.json``: loci annotations with
+  the allele length mode, minimum and maximum.
+- ``boxplot_<species>_<schema>.json``: five-number summary, mean
+  and standard deviation of the allele lengths per locus.
+
+The aggregates of the allele lengths of each locus (from
+`lengths_store` or, if the schema has no store, computed from the
+lengths in Virtuoso) and the schema metadata are loaded once and all
+outdated files are computed in a single pass over the loci. The
+statistics are computed from the length histograms of the loci, so
+their cost does not depend on the number of alleles. Files
+are written with a temporary name and renamed, so the API never
+reads partial files, and the files shared by all schemas of a
+species are updated while holding a file lock.
+
+The functions in this module do not exit the process, so they can
+be called by the scripts that insert alleles and by Celery tasks.
+When the files of several schemas are updated, the properties and
+locking state of all schemas are retrieved with a single query and
+the schemas are updated concurrently, each one isolated from the
+failures of the others.
+The `schema_stats.py` script exposes them in the command line.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import json
+import math
+import fcntl
+import logging
+import tempfile
+import contextlib
+import concurrent.futures
+
+import numpy as np
+
+from config import Config
+from app.utils import pagination
+from app.utils import lengths_store
+from app.utils import sparql_queries as sq
+from app.utils import auxiliary_functions as aux
+
+
+# names of the statistics files
+OUTPUTS = ('totals', 'loci', 'mode', 'annotations', 'boxplot')
+
+# files shared by all schemas of a species
+SPECIES_OUTPUTS = ('totals', 'loci')
+
+# number of rows per page when lengths are fetched from Virtuoso
+LENGTHS_PAGE_SIZE = 10000
+
+
+def output_paths(species_id, schema_id, computed_dir=None):
+    """ Gets the paths to the statistics files of a schema.
+
+        Parameters
+        ----------
+        species_id : str
+            The identifier of the species in the Chewie-NS.
+        schema_id : str
+            The identifier of the schema in the Chewie-NS.
+        computed_dir : str
+            Directory with the pre-computed files. Uses
+            `PRE_COMPUTE` if it is None.
+
+        Returns
+        -------
+        dict
+            Output names as keys and paths as values.
+    """
+
+    computed_dir = computed_dir or Config.PRE_COMPUTE
+
+    return {'totals': os.path.join(computed_dir, 'totals_{0}.json'.format(species_id)),
+            'loci': os.path.join(computed_dir, 'loci_{0}.json'.format(species_id)),
+            'mode': os.path.join(computed_dir, 'mode_{0}_{1}.json'.format(species_id, schema_id)),
+            'annotations': os.path.join(computed_dir, 'annotations_{0}_{1}.json'.format(species_id, schema_id)),
+            'boxplot': os.path.join(computed_dir, 'boxplot_{0}_{1}.json'.format(species_id, schema_id))}
+
+
+def read_json(path, default):
+    """ Reads a JSON file. Returns `default` if the
+        file does not exist.
+    """
+
+    try:
+        with open(path, 'r') as json_file:
+            return json.load(json_file)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(path, data):
+    """ Writes a JSON file with a temporary name and
+        renames it to replace the previous file.
+    """
+
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                         prefix='.tmp')
+    try:
+        with os.fdopen(handle, 'w') as json_outfile:
+            json.dump(data, json_outfile)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """ Acquires an exclusive lock to update a file that
+        is shared by several schemas.
+
+        The lock is a hidden file in the same directory
+        locked with `flock`, so it is released if the
+        process that holds it is terminated.
+    """
+
+    lock_file = os.path.join(os.path.dirname(path),
+                             '.{0}.lock'.format(os.path.basename(path)))
+    with open(lock_file, 'w') as lf:
+        fcntl.flock(lf, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def schema_entry(data, key, schema_uri):
+    """ Gets the index of the entry of a schema in
+        the message of a species file.
+    """
+
+    schema_id = schema_uri.split('/')[-1]
+    for i, entry in enumerate(data['message']):
+        if entry[key].split('/')[-1] == schema_id:
+            return i
+
+    return None
+
+
+def outdated_outputs(paths, schema_uri, last_modified, outputs):
+    """ Determines the statistics files that are not
+        up-to-date with the last modification date
+        of a schema.
+
+        Parameters
+        ----------
+        paths : dict
+            Paths returned by :py:func:`output_paths`.
+        schema_uri : str
+            The URI of the schema in the Chewie-NS.
+        last_modified : str
+            Last modification date of the schema.
+        outputs : list
+            Names of the files to check.
+
+        Returns
+        -------
+        outdated : list
+            Names of the files that need to be updated.
+    """
+
+    outdated = []
+    for output in outputs:
+        if output in SPECIES_OUTPUTS:
+            data = read_json(paths[output], {'message': []})
+            key = 'uri' if output == 'totals' else 'schema'
+            index = schema_entry(data, key, schema_uri)
+            current = data['message'][index] if index is not None else {}
+        else:
+            current = read_json(paths[output], {})
+
+        if current.get('last_modified') != last_modified:
+            outdated.append(output)
+
+    return outdated
+
+
+def stored_aggregates(store, base_url):
+    """ Reads the aggregates of the allele lengths sent with
+        the schema.
+
+        Parameters
+        ----------
+        store : lengths_store.LengthsStore
+            The store with the allele lengths of the schema.
+        base_url : str
+            Base URL of the Chewie-NS.
+
+        Returns
+        -------
+        dict
+            Locus URIs as keys and the aggregates of the
+            lengths of the alleles as values (see
+            `lengths_store.aggregate`).
+    """
+
+    return {'{0}loci/{1}'.format(base_url, locus_id): aggregate
+            for locus_id, aggregate in store.loci_aggregates().items()}
+
+
+def fetch_lengths(schema_uri, virtuoso_graph, local_sparql):
+    """ Gets the allele lengths of a schema from Virtuoso.
+
+        Parameters
+        ----------
+        schema_uri : str
+            The URI of the schema in the Chewie-NS.
+        virtuoso_graph : str
+            Name of the Virtuoso graph.
+        local_sparql : str
+            URL of the SPARQL endpoint.
+
+        Returns
+        -------
+        list
+            A dictionary with locus URIs as keys and arrays
+            with allele lengths as values and a dictionary
+            with locus URIs as keys and names as values.
+    """
+
+    lengths = {}
+    loci_names = {}
+    # sorted OFFSET pages fail in large schemas (MaxSortedTopRows)
+    for row in pagination.fetch_pages(local_sparql, sq.SELECT_ALLELES_LENGTH,
+                                      [virtuoso_graph, schema_uri],
+                                      LENGTHS_PAGE_SIZE,
+                                      key=lambda r: (r['allele']['value'],),
+                                      start=('',)):
+        locus_uri = row['locus']['value']
+        loci_names[locus_uri] = row['name']['value']
+        lengths.setdefault(locus_uri, []).append(int(row['nucSeqLen']['value']))
+
+    loci_lengths = {k: np.array(v, dtype=np.int64) for k, v in lengths.items()}
+
+    return [loci_lengths, loci_names]
+
+
+def histogram_median(values, cumulative, first, size):
+    """ Computes the median of a range of the sorted lengths
+        represented by a histogram (same value as
+        `statistics.median`).
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            Distinct lengths, sorted.
+        cumulative : numpy.ndarray
+            Cumulative number of alleles with each length.
+        first : int
+            Position of the first length of the range in
+            the sorted lengths.
+        size : int
+            Number of lengths in the range.
+    """
+
+    def nth(position):
+        return int(values[np.searchsorted(cumulative, position, side='right')])
+
+    half = first + size // 2
+    if size % 2 == 1:
+        return nth(half)
+
+    return (nth(half-1) + nth(half)) / 2
+
+
+def locus_stats(aggregate):
+    """ Computes the statistics of the allele lengths of
+        a locus from their aggregates.
+
+        Parameters
+        ----------
+        aggregate : dict
+            Aggregates of the lengths of the alleles of the
+            locus (see `lengths_store.aggregate`).
+
+        Returns
+        -------
+        dict
+            Number of alleles, mode (the smallest of the
+            most frequent lengths), mean, median, quartiles
+            (medians of the lower and upper halves), minimum,
+            maximum and sample standard deviation.
+    """
+
+    values = aggregate['values']
+    counts = aggregate['counts']
+    cumulative = np.cumsum(counts)
+    nr_alleles = aggregate['count']
+    total = aggregate['sum']
+
+    if nr_alleles > 1:
+        half = nr_alleles // 2
+        q1 = histogram_median(values, cumulative, 0, half)
+        q3 = histogram_median(values, cumulative, nr_alleles-half, half)
+        # exact integer numerator to avoid cancellation
+        variance = (nr_alleles*aggregate['sumsq'] - total*total) / (nr_alleles*(nr_alleles-1))
+        sd = math.sqrt(max(variance, 0))
+    else:
+        q1 = q3 = int(values[0])
+        sd = 0.0
+
+    return {'nr_alleles': nr_alleles,
+            'mode': int(values[np.argmax(counts)]),
+            'mean': round(total/nr_alleles),
+            'median': round(histogram_median(values, cumulative, 0, nr_alleles)),
+            'q1': q1,
+            'q3': q3,
+            'min': aggregate['min'],
+            'max': aggregate['max'],
+            'sd': sd}
+
+
+def schema_loci_names(schema_uri, virtuoso_graph, local_sparql):
+    """ Gets the names of the loci of a schema. """
+
+    loci = aux.get_data(local_sparql,
+                        sq.SELECT_SCHEMA_LOCI.format(virtuoso_graph, schema_uri))
+
+    return {l['locus']['value']: l['name']['value']
+            for l in loci['results']['bindings']}
+
+
+def loci_annotations(schema_uri, virtuoso_graph, local_sparql, max_tries=5):
+    """ Gets the annotations of the loci of a schema.
+
+        Returns
+        -------
+        annotations : list
+            A dictionary with the annotations of each locus.
+            None if the annotations could not be retrieved.
+    """
+
+    query = sq.SELECT_SCHEMA_LOCI_ANNOTATIONS.format(virtuoso_graph, schema_uri)
+    for i in range(max_tries):
+        result = aux.get_data(local_sparql, query)
+        try:
+            rows = result['results']['bindings']
+            break
+        except (TypeError, KeyError):
+            logging.warning('Could not get annotations for schema '
+                            '{0}: {1}'.format(schema_uri, result))
+    else:
+        return None
+
+    fields = ['locus', 'name', 'original_name', 'UniprotName',
+              'UniprotURI', 'UserAnnotation', 'CustomAnnotation']
+
+    return [{f: r[f]['value'] for f in fields} for r in rows]
+
+
+def schema_properties(schema_uri, virtuoso_graph, local_sparql):
+    """ Gets the properties of a schema. Returns None if the
+        schema does not exist.
+    """
+
+    result = aux.get_data(local_sparql,
+                          sq.SELECT_SPECIES_SCHEMA.format(virtuoso_graph, schema_uri))
+    rows = result['results']['bindings']
+    if len(rows) == 0:
+        return None
+
+    return {k: v['value'] for k, v in rows[0].items()}
+
+
+def update_totals(path, schema_uri, properties, loci_aggregates,
+                  virtuoso_graph, local_sparql):
+    """ Updates the entry of a schema in the totals file
+        of its species.
+    """
+
+    with file_lock(path):
+        data = read_json(path, {'message': []})
+        index = schema_entry(data, 'uri', schema_uri)
+        if index is not None:
+            entry = data['message'][index]
+            entry['last_modified'] = properties['last_modified']
+        else:
+            # determine user that uploaded the schema
+            admin = aux.get_data(local_sparql,
+                                 sq.SELECT_SCHEMA_ADMIN.format(virtuoso_graph, schema_uri))
+            entry = {k: v for k, v in properties.items() if k != 'Schema_lock'}
+            entry['user'] = admin['results']['bindings'][0]['admin']['value']
+            entry['uri'] = schema_uri
+            data['message'].append(entry)
+
+        entry['nr_loci'] = str(len(loci_aggregates))
+        entry['nr_alleles'] = str(sum(v['count'] for v in loci_aggregates.values()))
+        write_json(path, data)
+
+
+def update_loci(path, schema_uri, last_modified, loci_aggregates):
+    """ Updates the entry of a schema in the file with
+        the number of alleles per locus of its species.
+    """
+
+    loci = sorted(loci_aggregates, key=lambda x: int(x.split('/')[-1]))
+    entry = {'schema': schema_uri,
+             'last_modified': last_modified,
+             'loci': [{'locus': locus, 'nr_alleles': loci_aggregates[locus]['count']}
+                      for locus in loci]}
+
+    with file_lock(path):
+        data = read_json(path, {'message': []})
+        index = schema_entry(data, 'schema', schema_uri)
+        if index is not None:
+            data['message'][index] = entry
+        else:
+            data['message'].append(entry)
+        write_json(path, data)
+
+
+def mode_data(schema_uri, last_modified, stats):
+    """ Creates the data of the mode file of a schema. """
+
+    modes = []
+    totals = []
+    scatter = []
+    for name, s in stats:
+        modes.append({'locus_name': name, 'alleles_mode': s['mode']})
+        totals.append({'locus_name': name, 'nr_alleles': s['nr_alleles']})
+        scatter.append({'locus_name': name,
+                        'locus_id': name.split('-')[-1],
+                        'nr_alleles': s['nr_alleles'],
+                        'alleles_mean': s['mean'],
+                        'alleles_median': s['median'],
+                        'alleles_min': s['min'],
+                        'alleles_max': s['max'],
+                        'alleles_mode': s['mode']})
+
+    return {'schema': schema_uri,
+            'last_modified': last_modified,
+            'mode': modes,
+            'total_alleles': totals,
+            'scatter_data': scatter}
+
+
+def annotations_data(schema_uri, last_modified, stats, annotations):
+    """ Creates the data of the annotations file of a schema.
+        Loci without alleles are not included.
+    """
+
+    loci_stats = dict(stats)
+    message = []
+    for a in annotations:
+        s = loci_stats.get(a['name'])
+        if s is None:
+            continue
+        a['mode'] = s['mode']
+        a['nr_alleles'] = s['nr_alleles']
+        a['min'] = s['min']
+        a['max'] = s['max']
+        message.append(a)
+
+    return {'schema': schema_uri,
+            'last_modified': last_modified,
+            'message': message}
+
+
+def boxplot_data(schema_uri, last_modified, stats):
+    """ Creates the data of the boxplot file of a schema. """
+
+    data = {'schema': schema_uri,
+            'last_modified': last_modified,
+            'loci': [name for name, s in stats]}
+    for key in ('min', 'q1', 'median', 'q3', 'max', 'mean', 'sd', 'nr_alleles'):
+        data[key] = [s[key] for name, s in stats]
+
+    return data
+
+
+def single_schema(species_id, schema_id, virtuoso_graph, local_sparql,
+                  base_url, outputs=OUTPUTS, properties=None, force=False):
+    """ Updates the statistics files of a schema.
+
+        Parameters
+        ----------
+        species_id : str
+            The identifier of the species in the Chewie-NS.
+        schema_id : str
+            The identifier of the schema in the Chewie-NS.
+        virtuoso_graph : str
+            Name of the Virtuoso graph.
+        local_sparql : str
+            URL of the SPARQL endpoint.
+        base_url : str
+            Base URL of the Chewie-NS.
+        outputs : list
+            Names of the files to update (see `OUTPUTS`).
+        properties : dict
+            Properties of the schema. They are retrieved
+            from Virtuoso if it is None.
+        force : bool
+            True to update files that are up-to-date.
+
+        Returns
+        -------
+        updated : list
+            Names of the files that were updated. False if
+            the schema does not exist.
+    """
+
+    schema_uri = '{0}species/{1}/schemas/{2}'.format(base_url, species_id, schema_id)
+    if properties is None:
+        properties = schema_properties(schema_uri, virtuoso_graph, local_sparql)
+        if properties is None:
+            logging.warning('Could not find properties values for schema '
+                            '{0}.'.format(schema_uri))
+            return False
+
+    last_modified = properties['last_modified']
+    computed_dir = Config.PRE_COMPUTE
+    paths = output_paths(species_id, schema_id, computed_dir)
+
+    outdated = list(outputs) if force else \
+        outdated_outputs(paths, schema_uri, last_modified, outputs)
+    if len(outdated) == 0:
+        logging.info('Statistics for schema {0} are up-to-date.'.format(schema_uri))
+        return []
+
+    # load the allele lengths aggregates only once for all files
+    store = lengths_store.schema_store(species_id, schema_id)
+    if store.exists():
+        loci_aggregates = stored_aggregates(store, base_url)
+        loci_names = None
+    else:
+        loci_lengths, loci_names = fetch_lengths(schema_uri, virtuoso_graph, local_sparql)
+        loci_aggregates = {locus: lengths_store.aggregate(lengths)
+                           for locus, lengths in loci_lengths.items()}
+
+    if 'totals' in outdated:
+        update_totals(paths['totals'], schema_uri, properties,
+                      loci_aggregates, virtuoso_graph, local_sparql)
+    if 'loci' in outdated:
+        update_loci(paths['loci'], schema_uri, last_modified, loci_aggregates)
+
+    schema_outputs = [o for o in outdated if o not in SPECIES_OUTPUTS]
+    if len(schema_outputs) > 0:
+        if loci_names is None:
+            loci_names = schema_loci_names(schema_uri, virtuoso_graph, local_sparql)
+
+        # sort by locus identifier
+        loci = sorted((locus for locus in loci_aggregates if locus in loci_names),
+                      key=lambda x: int(x.split('/')[-1]))
+        stats = [(loci_names[locus], locus_stats(loci_aggregates[locus]))
+                 for locus in loci if loci_aggregates[locus]['count'] > 0]
+
+        if 'mode' in outdated:
+            write_json(paths['mode'], mode_data(schema_uri, last_modified, stats))
+        if 'boxplot' in outdated:
+            write_json(paths['boxplot'], boxplot_data(schema_uri, last_modified, stats))
+        if 'annotations' in outdated:
+            annotations = loci_annotations(schema_uri, virtuoso_graph, local_sparql)
+            if annotations is not None:
+                write_json(paths['annotations'],
+                           annotations_data(schema_uri, last_modified,
+                                            stats, annotations))
+            else:
+                outdated.remove('annotations')
+
+    logging.info('Updated {0} statistics for schema '
+                 '{1}.'.format(', '.join(outdated), schema_uri))
+
+    return outdated
+
+
+def schemas_properties(virtuoso_graph, local_sparql, species_uri=None):
+    """ Gets the properties of all schemas, or of all schemas
+        of a species, with a single query.
+
+        Parameters
+        ----------
+        virtuoso_graph : str
+            Name of the Virtuoso graph.
+        local_sparql : str
+            URL of the SPARQL endpoint.
+        species_uri : str
+            Only get the schemas of this species if it
+            is not None.
+
+        Returns
+        -------
+        schemas : dict
+            Schema URIs as keys and lists with the identifier
+            of the species and the properties of the schema
+            (as returned by :py:func:`schema_properties`) as
+            values. Deprecated schemas are not included.
+    """
+
+    species_filter = '' if species_uri is None \
+        else ' FILTER (?species = <{0}>)'.format(species_uri)
+    result = aux.get_data(local_sparql,
+                          sq.SELECT_SCHEMAS_PROPERTIES.format(virtuoso_graph, species_filter))
+
+    schemas = {}
+    for row in result['results']['bindings']:
+        properties = {k: v['value'] for k, v in row.items()}
+        schema_uri = properties.pop('schema')
+        species_id = properties.pop('species').split('/')[-1]
+        schemas.setdefault(schema_uri, [species_id, properties])
+
+    return schemas
+
+
+def update_schemas(schemas, virtuoso_graph, local_sparql, base_url,
+                   outputs=OUTPUTS, force=False, workers=None):
+    """ Updates the statistics files of several schemas
+        concurrently. Locked schemas are skipped and a schema
+        that fails does not stop the others.
+
+        Parameters
+        ----------
+        schemas : dict
+            Schema URIs as keys and lists with the identifier
+            of the species and the properties of the schema
+            as values (see :py:func:`schemas_properties`).
+        workers : int
+            Number of schemas updated at the same time
+            (`STATS_WORKERS` by default).
+
+        See :py:func:`single_schema` for the other parameters.
+
+        Returns
+        -------
+        updated : dict
+            Schema URIs as keys and the names of the files
+            that were updated as values (None if the update
+            failed).
+    """
+
+    unlocked = []
+    for schema_uri in sorted(schemas, key=lambda x: int(x.split('/')[-1])):
+        if schemas[schema_uri][1]['Schema_lock'] != 'Unlocked':
+            logging.warning('Schema {0} is locked.'.format(schema_uri))
+            continue
+        unlocked.append(schema_uri)
+
+    updated = {}
+    workers = workers or Config.STATS_WORKERS
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(single_schema, schemas[schema_uri][0],
+                                   schema_uri.split('/')[-1], virtuoso_graph,
+                                   local_sparql, base_url, outputs,
+                                   schemas[schema_uri][1], force): schema_uri
+                   for schema_uri in unlocked}
+        for future in concurrent.futures.as_completed(futures):
+            schema_uri = futures[future]
+            try:
+                updated[schema_uri] = future.result()
+            except Exception:
+                logging.exception('Could not update statistics for schema '
+                                  '{0}.'.format(schema_uri))
+                updated[schema_uri] = None
+
+    failed = [schema_uri for schema_uri, files in updated.items() if files is None]
+    if len(failed) > 0:
+        logging.warning('Could not update statistics for {0} of {1} '
+                        'schemas.'.format(len(failed), len(unlocked)))
+
+    return {schema_uri: updated[schema_uri] for schema_uri in unlocked}
+
+
+def single_species(species_id, virtuoso_graph, local_sparql, base_url,
+                   outputs=OUTPUTS, force=False, workers=None):
+    """ Updates the statistics files of all unlocked schemas
+        of a species. See :py:func:`update_schemas`.
+    """
+
+    species_uri = '{0}species/{1}'.format(base_url, species_id)
+    schemas = schemas_properties(virtuoso_graph, local_sparql, species_uri)
+    if len(schemas) == 0:
+        logging.info('Species {0} has no schemas.'.format(species_id))
+
+    return update_schemas(schemas, virtuoso_graph, local_sparql,
+                          base_url, outputs, force, workers)
+
+
+def global_species(virtuoso_graph, local_sparql, base_url,
+                   outputs=OUTPUTS, force=False, workers=None):
+    """ Updates the statistics files of all unlocked schemas
+        of all species. See :py:func:`update_schemas`.
+    """
+
+    schemas = schemas_properties(virtuoso_graph, local_sparql)
+
+    return update_schemas(schemas, virtuoso_graph, local_sparql,
+                          base_url, outputs, force, workers)
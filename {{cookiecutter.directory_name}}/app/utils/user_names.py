@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+This module resolves the user URIs stored in Virtuoso and in the
+pre-computed statistics files to the usernames stored in Postgres.
+
+Usernames are kept in a LRU bounded in-memory cache and the users
+that are not cached are fetched with a single query, instead of one
+query per user. The routes that modify users call `invalidate`, which
+removes them from the cache of the process that handled the request.
+Entries expire after `USER_NAMES_CACHE_TTL` seconds, so changes made
+through other processes are also visible after that time.
+
+Code documentation
+------------------
+"""
+
+
+import time
+import threading
+from collections import OrderedDict
+
+from config import Config
+from app.models import User
+
+
+class UserNameResolver(object):
+    """ Cache with the usernames of users.
+
+        Parameters
+        ----------
+        max_entries : int
+            Maximum number of usernames kept in memory.
+        ttl : int
+            Number of seconds that usernames are kept.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def names(self, user_ids):
+        """ Gets the usernames of a set of users.
+
+            Parameters
+            ----------
+            user_ids : iterable
+                Identifiers of the users in Postgres.
+
+            Returns
+            -------
+            names : dict
+                User identifiers as keys and usernames as
+                values. Users that do not exist are not
+                included.
+        """
+
+        names = {}
+        missing = set()
+        now = time.monotonic()
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    names[user_id] = entry[1]
+                else:
+                    missing.add(user_id)
+
+        if len(missing) > 0:
+            rows = User.query.with_entities(User.id, User.username) \
+                       .filter(User.id.in_(missing)).all()
+            with self._lock:
+                for user_id, username in rows:
+                    names[user_id] = username
+                    self._entries[user_id] = (now + self.ttl, username)
+                    self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return names
+
+    def invalidate(self, *user_ids):
+        """ Removes users from the cache.
+
+            Parameters
+            ----------
+            *user_ids : int
+                Identifiers of the users that were modified.
+        """
+
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(int(user_id), None)
+
+
+cache = UserNameResolver(Config.USER_NAMES_CACHE_MAX_ENTRIES,
+                         Config.USER_NAMES_CACHE_TTL)
+
+
+def user_id(user_uri):
+    """ Gets the identifier of a user from its URI. """
+
+    return int(user_uri.rsplit('/', 1)[-1])
+
+
+def resolve(user_uris):
+    """ Gets the usernames of the users with the given URIs.
+
+        Parameters
+        ----------
+        user_uris : iterable
+            URIs of the users (e.g. '<base_url>users/1').
+
+        Returns
+        -------
+        dict
+            User URIs as keys and usernames as values. Users
+            that do not exist are not included.
+    """
+
+    user_uris = set(user_uris)
+    names = cache.names(user_id(uri) for uri in user_uris)
+
+    return {uri: names[user_id(uri)] for uri in user_uris
+            if user_id(uri) in names}
+
+
+def invalidate(*user_ids):
+    """ Removes users from the process cache. See
+        `UserNameResolver.invalidate`.
+    """
+
+    cache.invalidate(*user_ids)
@@ -60,6 +60,78 @@ class Config(object):
 
     URL_SEND_LOCAL_VIRTUOSO = os.environ.get('URL_SEND_LOCAL_VIRTUOSO')
 
+    # SPARQL CLIENT CONFIGS
+    # maximum number of keep-alive connections per process
+    SPARQL_POOL_SIZE = int(os.environ.get('SPARQL_POOL_SIZE', 10))
+    # seconds to establish a connection and to wait for a response
+    SPARQL_CONNECT_TIMEOUT = 10
+    SPARQL_TIMEOUT = int(os.environ.get('SPARQL_TIMEOUT', 300))
+    # maximum seconds per call, including retries
+    SPARQL_DEADLINE = int(os.environ.get('SPARQL_DEADLINE', 600))
+    SPARQL_MAX_TRIES = 5
+    SPARQL_SEND_MAX_TRIES = 3
+    # retry delays grow exponentially from base up to max seconds
+    SPARQL_BACKOFF_BASE = 0.5
+    SPARQL_BACKOFF_MAX = 16
+    # maximum length of VALUES blocks in batched queries
+    SPARQL_VALUES_MAX_LENGTH = int(os.environ.get('SPARQL_VALUES_MAX_LENGTH', 6000))
+    # maximum number of batched queries sent concurrently per request
+    SPARQL_BATCH_WORKERS = int(os.environ.get('SPARQL_BATCH_WORKERS', 4))
+    # bytes read at a time from streamed query results
+    SPARQL_STREAM_CHUNK_SIZE = 65536
+
+    # PROFILE UPLOAD CONFIGS
+    # number of profiles inserted per query
+    PROFILE_BATCH_SIZE = int(os.environ.get('PROFILE_BATCH_SIZE', 20))
+    # maximum length of VALUES blocks used to validate alleles
+    PROFILE_VALUES_MAX_LENGTH = int(os.environ.get('PROFILE_VALUES_MAX_LENGTH', 200000))
+
+    # SPARQL METRICS CONFIGS
+    # requests that send more queries are flagged
+    SPARQL_METRICS_MAX_QUERIES = int(os.environ.get('SPARQL_METRICS_MAX_QUERIES', 50))
+    # add the number and duration of queries to the response headers
+    SPARQL_METRICS_HEADERS = os.environ.get('SPARQL_METRICS_HEADERS', 'false').lower() == 'true'
+
+    # IDENTIFIER ALLOCATOR CONFIGS
+    # Redis database with the counters used to attribute
+    # loci, alleles and schema parts identifiers, separate
+    # from the Celery (0) and query cache (1) databases
+    ID_ALLOCATOR_REDIS_URL = os.environ.get('ID_ALLOCATOR_REDIS_URL', 'redis://172.19.1.4:6379/2')
+
+    # SEQUENCE INDEX CONFIGS
+    # SQLite database that maps sequence hashes to sequences and alleles
+    SEQUENCE_INDEX_PATH = os.environ.get('SEQUENCE_INDEX_PATH', './sequence_index.sqlite')
+    # maximum number of bytes of the index that are memory-mapped
+    SEQUENCE_INDEX_MMAP_SIZE = int(os.environ.get('SEQUENCE_INDEX_MMAP_SIZE', 4294967296))
+
+    # ADAPTED LOCI CACHE CONFIGS
+    # directory with the adapted loci reused by the schema compressor
+    ADAPTED_CACHE_PATH = os.environ.get('ADAPTED_CACHE_PATH', './adapted_cache')
+    # least recently used loci are removed above this size (in bytes)
+    ADAPTED_CACHE_MAX_SIZE = int(os.environ.get('ADAPTED_CACHE_MAX_SIZE', 10737418240))
+
+    # BULK SEQUENCE LOOKUP CONFIGS
+    # maximum number of sequences or hashes per request
+    SEQUENCE_LOOKUP_MAX_INPUTS = int(os.environ.get('SEQUENCE_LOOKUP_MAX_INPUTS', 100000))
+    # number of sequences resolved before their results are sent
+    SEQUENCE_LOOKUP_BATCH_SIZE = int(os.environ.get('SEQUENCE_LOOKUP_BATCH_SIZE', 1000))
+
+    # QUERY CACHE CONFIGS
+    QUERY_CACHE_MAX_ENTRIES = int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 256))
+    QUERY_CACHE_TTL = int(os.environ.get('QUERY_CACHE_TTL', 300))
+    # results with more rows are not cached
+    QUERY_CACHE_MAX_ROWS = int(os.environ.get('QUERY_CACHE_MAX_ROWS', 100000))
+    # streamed results larger than this (in bytes) are not cached
+    QUERY_CACHE_MAX_BYTES = int(os.environ.get('QUERY_CACHE_MAX_BYTES', 16777216))
+    # shares entries and invalidations with the scripts and Celery workers,
+    # uses a different database than Celery, set to '' to disable
+    QUERY_CACHE_REDIS_URL = os.environ.get('QUERY_CACHE_REDIS_URL', 'redis://172.19.1.4:6379/1')
+
+    # USERNAMES CACHE CONFIGS
+    USER_NAMES_CACHE_MAX_ENTRIES = int(os.environ.get('USER_NAMES_CACHE_MAX_ENTRIES', 4096))
+    # changes made by other workers are visible after this time
+    USER_NAMES_CACHE_TTL = int(os.environ.get('USER_NAMES_CACHE_TTL', 300))
+
     # CELERY CONFIG
     CELERY_BROKER_URL = 'redis://172.19.1.4:6379/0'
     CELERY_RESULT_BACKEND = 'redis://172.19.1.4:6379/0'
@@ -70,10 +142,32 @@ class Config(object):
 
     # file transfer configs
     SCHEMAS_PTF = './prodigal_training_files'
+    # number of loci downloaded at the same time when compressing schemas
+    COMPRESSOR_DOWNLOAD_WORKERS = int(os.environ.get('COMPRESSOR_DOWNLOAD_WORKERS', 8))
+    # number of downloaded loci adapted together while other loci are downloaded
+    COMPRESSOR_ADAPT_BATCH_SIZE = int(os.environ.get('COMPRESSOR_ADAPT_BATCH_SIZE', 500))
+    # total number of cores used to compress schemas at the same time
+    COMPRESSOR_CPU_BUDGET = int(os.environ.get('COMPRESSOR_CPU_BUDGET', os.cpu_count() or 6))
+    # schemas get one core per this number of alleles
+    COMPRESSOR_ALLELES_PER_CORE = int(os.environ.get('COMPRESSOR_ALLELES_PER_CORE', 50000))
+    # default number of cores used to compress a schema
+    COMPRESSOR_CORES = 6
+    # select representatives with k-mer pre-clustering to reduce BLAST runs (opt-in)
+    COMPRESSOR_PRECLUSTER = os.environ.get('COMPRESSOR_PRECLUSTER', 'false').lower() == 'true'
+    # format of the compressed schemas, 'zip' or 'tar.zst' (needs zstandard)
+    COMPRESSOR_ARCHIVE_FORMAT = os.environ.get('COMPRESSOR_ARCHIVE_FORMAT', 'zip')
+    # compression level of ZIP archives (0-9)
+    COMPRESSOR_ZIP_LEVEL = int(os.environ.get('COMPRESSOR_ZIP_LEVEL', 6))
+    # compression level of Zstandard archives (1-22)
+    COMPRESSOR_ZSTD_LEVEL = int(os.environ.get('COMPRESSOR_ZSTD_LEVEL', 10))
     SCHEMAS_ZIP = './compressed_schemas'
 
     # pre-computed stats for frontend
     PRE_COMPUTE = './pre-computed-data'
+    # number of stats files kept in memory by each worker
+    STATS_CACHE_MAX_ENTRIES = int(os.environ.get('STATS_CACHE_MAX_ENTRIES', 512))
+    # number of schemas whose stats are updated concurrently
+    STATS_WORKERS = int(os.environ.get('STATS_WORKERS', 4))
 
     # schema upload directory
     SCHEMA_UP = './schema_insertion_temp'
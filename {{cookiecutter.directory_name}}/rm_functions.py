@@ -32,9 +32,10 @@ import logging
 import argparse
 import subprocess
 import datetime as dt
-from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import query_cache as qc
+from app.utils import sequence_index
 from app.utils import sparql_queries as sq
 from app.utils import auxiliary_functions as aux
 from app.utils import PrepExternalSchema
@@ -126,6 +127,8 @@ def collapse_loci(loci_uris, virtuoso_graph, local_sparql,
 		multiple_delete(sq.DELETE_LOCUS_ALLELES, loci_uris, virtuoso_graph,
 			local_sparql, virtuoso_user, virtuoso_pass)
 
+	sequence_index.remove_loci([uri[0] for uri in loci_uris])
+
 	deleted_triples += triples
 	total_alleles = int(triples/8)
 	stdout_text = ('Deleted alleles for {0} loci ({1} alleles, {2} '
@@ -183,7 +186,7 @@ def rm_schema(identifier, species_id, virtuoso_graph, local_sparql,
 	logging.info('Started rm process for schema {0}.'.format(schema_uri))
 
 	# check if schema exists
-	schema_result = aux.get_data(SPARQLWrapper(local_sparql),
+	schema_result = aux.get_data(local_sparql,
                                  (sq.ASK_SCHEMA.format(schema_uri)))
 
 	if schema_result['boolean'] is not True:
@@ -193,7 +196,7 @@ def rm_schema(identifier, species_id, virtuoso_graph, local_sparql,
 	print('\nDeleting loci and alleles for schema: {0}'.format(schema_uri))
 
 	# get schema's loci
-	schema_result = aux.get_data(SPARQLWrapper(local_sparql),
+	schema_result = aux.get_data(local_sparql,
                                  (sq.SELECT_SCHEMA_LOCI.format(virtuoso_graph, schema_uri)))
 
 	schema_result = schema_result['results']['bindings']
@@ -213,7 +216,7 @@ def rm_schema(identifier, species_id, virtuoso_graph, local_sparql,
 		total_triples += results[0]
 
 	# delete description
-	schema_desc = aux.get_data(SPARQLWrapper(local_sparql),
+	schema_desc = aux.get_data(local_sparql,
                                 (sq.SELECT_SCHEMA_DESCRIPTION.format(virtuoso_graph, schema_uri)))
 
 	schema_desc = schema_desc['results']['bindings'][0]['description']['value']
@@ -222,9 +225,10 @@ def rm_schema(identifier, species_id, virtuoso_graph, local_sparql,
 		subprocess.call(['rm', desc_file])
 
 	# delete compressed version
-	zip_file = [f for f in os.listdir(Config.SCHEMAS_ZIP) if f.startswith('{0}_{1}'.format(species_id, identifier))]
-	if len(zip_file) > 0:
-		zip_file = '{0}/{1}'.format(Config.SCHEMAS_ZIP, zip_file[0])
+	zip_files = aux.compressed_versions(os.listdir(Config.SCHEMAS_ZIP),
+	                                    '{0}_{1}'.format(species_id, identifier))
+	for zip_file in zip_files:
+		zip_file = '{0}/{1}'.format(Config.SCHEMAS_ZIP, zip_file)
 		subprocess.call(['rm', zip_file])
 		print('Deleted compressed version ({0})'.format(zip_file))
 		logging.info('Deleted compressed version ({0})'.format(zip_file))
@@ -302,6 +306,8 @@ def rm_schema(identifier, species_id, virtuoso_graph, local_sparql,
 		logging.info('Failed to delete {0}'.format(schema_uri))
 		logging.info('Failed stderr:\n{0}'.format(message))
 
+	qc.invalidate(qc.SPECIES_SCOPE, qc.SCHEMAS_SCOPE, schema_uri)
+
 	print('\nDeleted a total of {0} triples.'.format(total_triples))
 	print('({0} loci, {1} species links, {2} schema links, '
 		  '{3} alleles)'.format(results[2], results[3],
@@ -342,7 +348,7 @@ def rm_loci(identifier, virtuoso_graph, local_sparql,
 	# check if loci exist
 	invalid = []
 	for locus in loci_uris:
-		locus_result = aux.get_data(SPARQLWrapper(local_sparql),
+		locus_result = aux.get_data(local_sparql,
 	                                (sq.ASK_LOCUS.format(locus)))
 
 		if locus_result['boolean'] is not True:
@@ -358,6 +364,9 @@ def rm_loci(identifier, virtuoso_graph, local_sparql,
                             virtuoso_user, virtuoso_pass)
 	total_triples += results[0]
 
+	# the schemas of the deleted loci are not known
+	qc.invalidate(qc.SCHEMAS_SCOPE, *loci_uris)
+
 	print('\nDeleted a total of {0} triples.'.format(total_triples))
 	logging.info('Deleted a total of {0} triples.'.format(total_triples))
 	print('({0} loci, {1} species links, {2} schema links, '
@@ -411,6 +420,9 @@ def rm_alleles(identifier, locus_id, virtuoso_graph, local_sparql,
 		multiple_delete(sq.DELETE_ALLELE, uris, virtuoso_graph,
 			local_sparql, virtuoso_user, virtuoso_pass)
 
+	qc.invalidate(*alleles_ids.keys())
+	sequence_index.remove_alleles([uri[0] for uri in uris])
+
 	total_alleles = triples/8
 	stdout_text = 'Deleted {0} alleles ({1} triples).'.format(deleted, triples)
 	log_results(stdout_text, stderr, noeffect)
@@ -446,7 +458,7 @@ def rm_loci_links(mode, identifier, virtuoso_graph, local_sparql,
 	# check if loci exist
 	invalid = []
 	for locus in loci_uris:
-		locus_result = aux.get_data(SPARQLWrapper(local_sparql),
+		locus_result = aux.get_data(local_sparql,
 	                                (sq.ASK_LOCUS.format(locus)))
 
 		if locus_result['boolean'] is not True:
@@ -467,6 +479,8 @@ def rm_loci_links(mode, identifier, virtuoso_graph, local_sparql,
 		multiple_delete(statement, loci_uris, virtuoso_graph,
 			local_sparql, virtuoso_user, virtuoso_pass)
 
+	qc.invalidate(qc.SCHEMAS_SCOPE, *[l[0] for l in loci_uris])
+
 	total_links = int(triples) if mode == 'splinks' else int(triples/4)
 	stdout_text = 'Deleted {0} {1} ({2} triples).'.format(deleted, mode, triples)
 	log_results(stdout_text, stderr, noeffect)
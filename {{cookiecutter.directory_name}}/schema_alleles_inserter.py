@@ -47,6 +47,9 @@ from collections import Counter
 from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import query_cache as qc
+from app.utils import stats_engine
+from app.utils import sequence_index
 from app.utils import sparql_queries as sq
 from app.utils import auxiliary_functions as aux
 
@@ -104,6 +107,7 @@ def change_date(schema_uri, date_type, date_value, virtuoso_graph, local_sparql,
 									   local_sparql,
 									   virtuoso_user,
 									   virtuoso_pass)
+        qc.invalidate(schema_uri)
         ins_status = insdate_result.status_code
         if ins_status > 201:
             return [False, insdate_result.content]
@@ -149,6 +153,7 @@ def change_lock(schema_uri, action, virtuoso_graph, local_sparql, virtuoso_user,
                                         local_sparql,
                                         virtuoso_user,
                                         virtuoso_pass)
+        qc.invalidate(schema_uri)
         add_status = add_lock_result.status_code
         if add_status > 201:
             return [False, add_lock_result.content]
@@ -174,12 +179,13 @@ def create_single_insert(alleles, species, locus_uri, user_uri, base_url, virtuo
 		Returns
 		-------
 		queries : list
-		    A list with two elements: the locus URI and
+		    A list with three elements: the locus URI,
 		    a sublist with the single-insert queries to
-		    insert alleles.
+		    insert alleles and a sublist with the sequence
+		    and allele URIs inserted by each query.
 	"""
 
-	queries = [locus_uri, []]
+	queries = [locus_uri, [], []]
 	allele_id = 1
 	for a in alleles:
 		sequence = a
@@ -197,6 +203,7 @@ def create_single_insert(alleles, species, locus_uri, user_uri, base_url, virtuo
 													  locus_uri, insert_date,
 													  allele_id))
 		queries[1].append(query)
+		queries[2].append([(seq_uri, allele_uri)])
 
 		allele_id += 1
 
@@ -221,14 +228,16 @@ def create_multiple_insert(alleles, species, locus_uri, user_uri, base_url, virt
         Returns
         -------
         queries : list
-			A list with two elements: the locus URI and
+			A list with three elements: the locus URI,
 		    a sublist with the multi-insert queries to
-		    insert alleles.
+		    insert alleles and a sublist with the sequence
+		    and allele URIs inserted by each query.
 	"""
 
-	queries = [locus_uri, []]
+	queries = [locus_uri, [], []]
 	allele_id = 1
 	allele_set = []
+	entries = []
 	max_alleles = 100
 	for i, a in enumerate(alleles):
 		sequence = a
@@ -249,11 +258,14 @@ def create_multiple_insert(alleles, species, locus_uri, user_uri, base_url, virt
 													 '<{0}>'.format(locus_uri),
 													 '"{0}"^^xsd:dateTime'.format(insert_date),
 													 '"{0}"^^xsd:integer'.format(allele_id)))
+		entries.append((seq_uri, allele_uri))
 
 		if len(allele_set) == max_alleles or i == (len(alleles)-1):
 			query = (sq.MULTIPLE_INSERT_NEW_SEQUENCE.format(virtuoso_graph, ' '.join(allele_set)))
 			queries[1].append(query)
+			queries[2].append(entries)
 			allele_set = []
+			entries = []
 
 		allele_id += 1
 
@@ -359,11 +371,12 @@ def post_alleles(input_file, local_sparql, virtuoso_user, virtuoso_pass):
 		locus_data = pickle.load(f)
 		locus = locus_data[0]
 		queries = locus_data[1]
+		entries = locus_data[2]
 
 	responses = [locus, []]
 	session = get_session()
 	headers = {'content-type': 'application/sparql-query'}
-	for q in queries:
+	for q, e in zip(queries, entries):
 		tries = 0
 		max_tries = 5
 		max_wait = 5
@@ -391,6 +404,8 @@ def post_alleles(input_file, local_sparql, virtuoso_user, virtuoso_pass):
 		if status_code > 201:
 			logging.warning('Could not execute query for locus {0}'
 				            '\nQuery:\n{1}\n'.format(locus, q))
+		else:
+			sequence_index.add(e)
 
 	return responses
 
@@ -553,21 +568,12 @@ def main(temp_dir, graph, sparql, base_url, user, password):
 		      	               				   user, password))
 
 	# create pre-computed frontend files
-	os.system('python schema_totals.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python loci_totals.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python loci_mode.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python annotations.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
-	os.system('python loci_boxplot.py -m single_schema '
-		      '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-		      ''.format(species_id, schema_id, graph, sparql, base_url))
+	try:
+		stats_engine.single_schema(species_id, schema_id, graph,
+		                           sparql, base_url)
+	except Exception:
+		logging.exception('Could not update statistics for schema '
+		                  '{0}.'.format(schema_uri))
 
 	# unlock schema
 	unlocked = change_lock(schema_uri, 'Unlocked',
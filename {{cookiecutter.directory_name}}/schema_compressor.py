@@ -14,6 +14,34 @@ Both modes verify if there is a compressed version for each
 schema and if it is necessary to update it based on the last
 modification date of the schema.
 
+Outdated compressed versions are updated incrementally. Only the
+loci that have alleles inserted after the previous compression
+date or that have a different number of alleles are downloaded
+and adapted again. The adapted files of the other loci are copied
+from the previous compressed version. The ``--full`` argument
+forces the adaptation of all loci.
+
+Each schema is compressed while holding a file lock, so that
+compression processes started by the insertion processes and the
+global mode never compress the same schema at the same time. The
+global mode compresses several schemas at the same time. Each
+schema gets a number of cores proportional to its number of alleles
+and schemas are started while there are free cores in the
+``COMPRESSOR_CPU_BUDGET``. The ``--cpu`` argument replaces the
+budget in the global mode and the number of cores used to adapt
+the schema in the single mode.
+
+Compressed versions are written as the loci are adapted, without
+creating a directory with the adapted schema. The archive is a ZIP
+file or, if ``COMPRESSOR_ARCHIVE_FORMAT`` is ``tar.zst`` and the
+``zstandard`` package is installed, a TAR file compressed with
+Zstandard. Archives are created with a temporary name and renamed
+when they are complete.
+
+Adapted loci are stored in the adapted loci cache. Loci whose alleles
+and adaptation parameters match a cache entry are added to the
+archive from the cache and only the other loci are adapted.
+
 Expected input
 --------------
 
@@ -40,16 +68,32 @@ Code documentation
 """
 
 
+import io
 import os
 import sys
+import math
+import time
+import fcntl
 import pickle
 import shutil
 import logging
+import tarfile
+import zipfile
+import tempfile
 import argparse
+import itertools
+import contextlib
 import datetime as dt
-from SPARQLWrapper import SPARQLWrapper
+import concurrent.futures
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 from config import Config
+from app.utils import query_cache as qc
+from app.utils import adapted_cache
 from app.utils import sparql_queries as sq
 from app.utils import auxiliary_functions as aux
 from app.utils import PrepExternalSchema
@@ -100,6 +144,7 @@ def change_lock(schema_uri, action, virtuoso_graph, local_sparql, virtuoso_user,
                                         local_sparql,
                                         virtuoso_user,
                                         virtuoso_pass)
+        qc.invalidate(schema_uri)
         add_status = add_lock_result.status_code
         if add_status > 201:
             return [False, add_lock_result.content]
@@ -122,7 +167,7 @@ def get_species(local_sparql, virtuoso_graph):
     """
 
     # get the list of species in NS
-    species_result = aux.get_data(SPARQLWrapper(local_sparql),
+    species_result = aux.get_data(local_sparql,
                                   (sq.SELECT_SPECIES.format(virtuoso_graph,
                                                             ' typon:name ?name. ')))
 
@@ -157,7 +202,7 @@ def species_schemas(species_uri, schemas, local_sparql, virtuoso_graph):
           that schema.
     """
 
-    result = aux.get_data(SPARQLWrapper(local_sparql),
+    result = aux.get_data(local_sparql,
                           (sq.SELECT_SPECIES_SCHEMAS.format(virtuoso_graph,
                                                             species_uri)))
 
@@ -194,7 +239,7 @@ def determine_date(schema_uri, local_sparql, virtuoso_graph):
     """
 
     # get schema last modification date
-    date_result = aux.get_data(SPARQLWrapper(local_sparql),
+    date_result = aux.get_data(local_sparql,
                                (sq.SELECT_SPECIES_SCHEMA.format(virtuoso_graph, schema_uri)))
 
     schema_info = date_result['results']['bindings'][0]
@@ -280,7 +325,8 @@ def compress_determiner(schemas, species_id, sp_name, compressed_schemas,
         chewie_version = schema_info['chewBBACA_version']['value']
 
         # get all compressed versions that have the schema prefix
-        comp_schema = [f for f in compressed_schemas if f.startswith(schema_prefix)]
+        # schemas being compressed are detected by the schema lock
+        comp_schema = aux.compressed_versions(compressed_schemas, schema_prefix)
         # there is no compressed version
         if len(comp_schema) == 0:
             to_compress.append([schema_uri, schema_date, schema_bsr,
@@ -290,9 +336,9 @@ def compress_determiner(schemas, species_id, sp_name, compressed_schemas,
             logging.info('{0} ({1}) is novel schema to compress.'.format(schema_uri, schema_name))
             old_zips[schema_uri] = None
         # there is a compressed version
-        elif len(comp_schema) == 1:
-            comp_date = comp_schema[0].split('_')[-1]
-            comp_date = comp_date.split('.zip')[0]
+        # older versions are only left if a compression was interrupted
+        else:
+            comp_date = aux.archive_date(comp_schema[-1])
 
             # check if schema has been altered since compression date
             if comp_date != schema_date:
@@ -302,13 +348,10 @@ def compress_determiner(schemas, species_id, sp_name, compressed_schemas,
                                     schema_prefix, schema_name, schema_lock])
                 logging.info('{0} ({1}) compressed version is '
                              'outdated.'.format(schema_uri, schema_name))
-                old_zips[schema_uri] = comp_schema[0]
+                old_zips[schema_uri] = comp_schema[-1]
             else:
                 logging.info('{0} ({1}) is up-to-date.'.format(schema_uri, schema_name))
 
-        elif len(comp_schema) > 1:
-            logging.warning('{0} ({1}) is already being compressed.'.format(schema_uri, schema_name))
-
     return [to_compress, old_zips]
 
 
@@ -328,7 +371,7 @@ def schema_loci(schema_uri, local_sparql, virtuoso_graph):
     """
 
     # get loci
-    loci_result = aux.get_data(SPARQLWrapper(local_sparql),
+    loci_result = aux.get_data(local_sparql,
                                (sq.SELECT_SCHEMA_LOCI.format(virtuoso_graph, schema_uri)))
 
     # check if schema has loci
@@ -360,21 +403,21 @@ def fasta_sequences(locus, date, local_sparql, virtuoso_graph):
 
     # setting [SPARQL] ResultSetMaxRows = 400000 in virtuoso.ini
     # is important to return all sequences at once
-    fasta_result = aux.get_data(SPARQLWrapper(local_sparql),
+    fasta_result = aux.get_data(local_sparql,
                                 (sq.SELECT_LOCUS_FASTA_BY_DATE.format(virtuoso_graph, locus, date)))
 
     # virtuoso returned an error because request length exceeded maximum value of Temp Col
-    # get each allele separately
+    # get the sequence hashes and then the sequences in batches
     try:
         fasta_seqs = fasta_result['results']['bindings']
     # virtuoso returned an error
     # probably because sequence/request length exceeded maximum value
     except:
         logging.warning('Could not retrieve FASTA records for locus {0}\n'
-                        'Response content:\n{1}\nTrying to get each sequence '
-                        'separately...\n'.format(locus, fasta_result))
-        # get each allele separately
-        result = aux.get_data(SPARQLWrapper(local_sparql),
+                        'Response content:\n{1}\nTrying to get sequences '
+                        'in batches...\n'.format(locus, fasta_result))
+        # get the sequence hashes and then the sequences in batches
+        result = aux.get_data(local_sparql,
                               (sq.SELECT_LOCUS_SEQS_BY_DATE.format(virtuoso_graph, locus, date)))
         try:
             fasta_seqs = result['results']['bindings']
@@ -386,23 +429,74 @@ def fasta_sequences(locus, date, local_sparql, virtuoso_graph):
                             'for locus {0}.'.format(locus))
             return False
 
-        total = 0
-        hashes = []
-        for s in range(len(fasta_seqs)):
-            # get the sequence corresponding to the hash
-            result2 = aux.get_data(SPARQLWrapper(local_sparql),
-                                   (sq.SELECT_SEQ_FASTA.format(virtuoso_graph, fasta_seqs[s]['sequence']['value'])))
-            hashes.append(fasta_seqs[s]['sequence']['value'])
-
-            fasta_seqs[s]['nucSeq'] = result2['results']['bindings'][0]['nucSeq']
-            total += 1
+        # get the sequences corresponding to the hashes in batches
+        try:
+            sequences = aux.get_sequences(local_sparql, virtuoso_graph,
+                                          [f['sequence']['value'] for f in fasta_seqs])
+            for f in fasta_seqs:
+                f['nucSeq'] = sequences[f['sequence']['value']]
+        except Exception as e:
+            logging.warning('Could not retrieve sequences '
+                            'for locus {0}: {1}'.format(locus, e))
+            return False
 
     return fasta_seqs
 
 
-def create_fasta(loci_list, date, temp_dir, local_sparql, virtuoso_graph):
+def write_fasta(locus, date, temp_dir, local_sparql, virtuoso_graph):
+    """ Downloads the alleles of a locus and writes them
+        to a FASTA file.
+
+        Parameters
+        ----------
+        locus : tup
+            A tuple with the locus name and the locus URI.
+        date : str
+            Last modification date of the schema. The
+            function will get all sequences that were
+            inserted before this date.
+        temp_dir : str
+            The path to the directory where the FASTA file
+            will be created.
+
+        Returns
+        -------
+        temp_file : str
+            Path to the FASTA file that was created.
+            False if the sequences could not be retrieved.
+    """
+
+    locus_name = locus[0]
+    locus_uri = locus[1]
+    sequences = fasta_sequences(locus_uri, date, local_sparql, virtuoso_graph)
+    if sequences is False:
+        return False
+
+    # sort alleles so that the file only changes if the alleles
+    # change and the locus is found in the adapted loci cache
+    fasta_seqs = sorted(((f['allele_id']['value'], f['nucSeq']['value']) for f in sequences),
+                        key=lambda s: int(s[0]))
+
+    fasta_lines = ['>{0}_{1}\n{2}'.format(locus_name, s[0], s[1]) for s in fasta_seqs]
+
+    fasta_text = '\n'.join(fasta_lines)
+
+    temp_file = '{0}/{1}.fasta'.format(temp_dir, locus_name)
+    with open(temp_file, 'w') as f:
+        f.write(fasta_text)
+
+    return temp_file
+
+
+def download_fasta(loci_list, date, temp_dir, local_sparql, virtuoso_graph,
+                   workers=None):
     """ Creates FASTA files for the loci of a schema.
 
+        Loci are downloaded concurrently and each FASTA
+        file is written as soon as the alleles of its locus
+        are retrieved. Remaining downloads are cancelled as
+        soon as one locus cannot be retrieved.
+
         Parameters
         ----------
         loci_list : list of tup
@@ -416,41 +510,629 @@ def create_fasta(loci_list, date, temp_dir, local_sparql, virtuoso_graph):
         temp_dir : str
             The path to the directory where the FASTA files
             will be created.
+        workers : int
+            Maximum number of loci downloaded at the same
+            time. Uses the value of `COMPRESSOR_DOWNLOAD_WORKERS`
+            in the configuration if it is None.
+
+        Yields
+        ------
+        temp_file : str
+            Path to each FASTA file, in the order the
+            downloads finish.
+
+        Raises
+        ------
+        Exception
+            If the sequences of one or more loci could
+            not be retrieved.
+    """
+
+    workers = workers or Config.COMPRESSOR_DOWNLOAD_WORKERS
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_fasta, locus, date, temp_dir,
+                                   local_sparql, virtuoso_graph): locus
+                   for locus in loci_list}
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    temp_file = future.result()
+                except Exception as e:
+                    logging.warning('Could not retrieve sequences for locus '
+                                    '{0}: {1}'.format(futures[future][1], e))
+                    temp_file = False
+
+                if temp_file is False:
+                    failed.append(futures[future])
+                    break
+
+                yield temp_file
+        finally:
+            for future in futures:
+                future.cancel()
+
+    # report other loci that failed while the downloads were stopped
+    for future, locus in futures.items():
+        if future.cancelled() or locus in failed:
+            continue
+        if future.exception() is not None or future.result() is False:
+            failed.append(locus)
+
+    if len(failed) > 0:
+        not_downloaded = sum(1 for future in futures if future.cancelled())
+        raise Exception('Could not retrieve sequences for {0} loci ({1}), '
+                        '{2} downloads were cancelled.'.format(len(failed),
+                                                               ','.join(l[1] for l in failed),
+                                                               not_downloaded))
+
+
+def adapt_fasta(temp_files, temp_dir, output_directory, schema, cores):
+    """ Adapts a set of FASTA files with PrepExternalSchema.
+
+        Parameters
+        ----------
+        temp_files : list
+            Paths to the FASTA files to adapt.
+        temp_dir : str
+            The path to the directory with the FASTA files.
+        output_directory : str
+            Path to the directory with the adapted schema.
+        schema : list
+            One of the sublists with data about a schema returned
+            by the :py:func:`compress_determiner` function.
+        cores : int
+            Number of processes used by PrepExternalSchema.
 
         Returns
         -------
+        True if the files were adapted, False otherwise.
+    """
+
+    # PrepExternalSchema accepts a file with the paths
+    # to the FASTA files and deletes it at the end
+    handle, genes_file = tempfile.mkstemp(suffix='.txt', dir=temp_dir)
+    with os.fdopen(handle, 'w') as gf:
+        gf.write('\n'.join(temp_files) + '\n')
+
+    bsr, min_len, trans_tbl, size_threshold, precluster = adapt_params(schema)
+
+    return PrepExternalSchema.main(genes_file, output_directory, cores,
+                                   bsr, min_len, trans_tbl, schema[5],
+                                   size_threshold, os.path.join('/app', logfile),
+                                   precluster=precluster)
+
+
+def adapt_params(schema):
+    """ Gets the parameters used to adapt the loci of a schema.
+
+        Parameters
+        ----------
+        schema : list
+            One of the sublists with data about a schema returned
+            by the :py:func:`compress_determiner` function.
+
+        Returns
+        -------
+        list
+            The BLAST Score Ratio, the minimum sequence length,
+            the translation table, the size threshold and if
+            representatives are selected with pre-clustering.
+    """
+
+    return [float(schema[2]), 0, int(schema[4]), None,
+            Config.COMPRESSOR_PRECLUSTER]
+
+
+def loci_changes(schema_uri, date, previous_date, local_sparql, virtuoso_graph):
+    """ Gets the number of alleles of each locus of a schema
+        and the number of alleles inserted after a date.
+
+        Parameters
+        ----------
+        schema_uri : str
+            The URI of the schema in the Chewie-NS.
+        date : str
+            Last modification date of the schema. Only
+            alleles inserted before this date are counted.
+        previous_date : str
+            Date of the previous compressed version.
+
+        Returns
+        -------
+        changes : dict
+            A dictionary with loci URIs as keys and a list
+            with the number of alleles and the number of
+            alleles inserted after `previous_date` as values.
+            None if the query failed.
+    """
+
+    result = aux.get_data(local_sparql,
+                          (sq.SELECT_SCHEMA_LOCI_CHANGES.format(virtuoso_graph, schema_uri,
+                                                                date, previous_date)))
+
+    try:
+        changes = {r['locus']['value']: [int(r['count']['value']), int(r['new']['value'])]
+                   for r in result['results']['bindings']}
+    except Exception:
+        logging.warning('Could not determine changed loci for schema '
+                        '{0}:\n{1}'.format(schema_uri, result))
+        return None
+
+    return changes
+
+
+class SchemaArchive(object):
+    """ Compressed version of a schema that is written as
+        files are added to it.
+
+        The archive is written to a temporary file that is
+        only renamed to its final name by :py:meth:`commit`,
+        so incomplete archives are never listed as
+        compressed versions.
+
+        Parameters
+        ----------
+        path : str
+            Final path of the archive. Archives with the
+            '.tar.zst' extension are TAR files compressed
+            with Zstandard, other archives are ZIP files.
+        temp_path : str
+            Path of the file written while the archive is
+            created. Must be in the same file system as `path`.
+        level : int
+            Compression level.
+    """
+
+    def __init__(self, path, temp_path, level):
+        self.path = path
+        self.temp_path = temp_path
+        self.names = []
+        self._zip = None
+        self._tar = None
+        if path.endswith('.tar.zst'):
+            self._raw = open(temp_path, 'wb')
+            self._stream = zstandard.ZstdCompressor(level=level).stream_writer(self._raw)
+            self._tar = tarfile.open(fileobj=self._stream, mode='w|')
+        else:
+            self._zip = zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED,
+                                        compresslevel=level)
+
+    def add_directory(self, arcname):
+        """ Adds a directory entry to the archive. """
+
+        if self._zip is not None:
+            self._zip.writestr(arcname.rstrip('/') + '/', b'')
+        else:
+            info = tarfile.TarInfo(arcname.rstrip('/'))
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = time.time()
+            self._tar.addfile(info)
+
+    def add_stream(self, arcname, fileobj, size):
+        """ Adds a file to the archive from a file object.
+
+            Parameters
+            ----------
+            arcname : str
+                Path of the file in the archive.
+            fileobj : file
+                Binary file object with the contents.
+            size : int
+                Number of bytes in the file object.
+        """
+
+        if self._zip is not None:
+            with self._zip.open(arcname, 'w') as outfile:
+                shutil.copyfileobj(fileobj, outfile)
+        else:
+            info = tarfile.TarInfo(arcname)
+            info.size = size
+            info.mode = 0o644
+            info.mtime = time.time()
+            self._tar.addfile(info, fileobj)
+
+        self.names.append(arcname)
+
+    def add_file(self, path, arcname):
+        """ Adds a file in the file system to the archive. """
+
+        with open(path, 'rb') as infile:
+            self.add_stream(arcname, infile, os.fstat(infile.fileno()).st_size)
+
+    def add_bytes(self, arcname, data):
+        """ Adds a file with the given contents to the archive. """
+
+        self.add_stream(arcname, io.BytesIO(data), len(data))
+
+    def close(self):
+        """ Finishes writing the temporary file. """
+
+        if self._zip is not None:
+            self._zip.close()
+        elif self._tar is not None:
+            self._tar.close()
+            self._stream.close()
+            if not self._raw.closed:
+                self._raw.close()
+
+    def commit(self):
+        """ Closes the archive and renames it to its final name. """
+
+        self.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        """ Closes the archive and deletes the temporary file. """
+
+        try:
+            self.close()
+        except Exception:
+            pass
+        if os.path.isfile(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def archive_format():
+    """ Determines the format and compression level of the
+        compressed versions created by this process.
+
+        Returns
+        -------
+        list
+            The archive extension and the compression level.
+            ZIP files are created if `COMPRESSOR_ARCHIVE_FORMAT`
+            is 'tar.zst' but the zstandard package is not
+            installed.
+    """
+
+    if Config.COMPRESSOR_ARCHIVE_FORMAT == 'tar.zst':
+        if zstandard is not None:
+            return ['.tar.zst', Config.COMPRESSOR_ZSTD_LEVEL]
+        logging.warning('The zstandard package is not installed, '
+                        'creating ZIP archives instead.')
+
+    return ['.zip', Config.COMPRESSOR_ZIP_LEVEL]
+
+
+def archive_members(path, names):
+    """ Reads files from a compressed version of a schema.
+
+        Parameters
+        ----------
+        path : str
+            Path to the compressed version.
+        names : set
+            Paths of the files to read, relative to
+            the root of the schema.
+
+        Yields
+        ------
+        tup
+            The path, a binary file object and the number
+            of bytes of each file that is in `names`, in
+            the order they are stored in the archive.
+    """
+
+    if path.endswith('.tar.zst'):
+        if zstandard is None:
+            raise OSError('Cannot read {0}, the zstandard package '
+                          'is not installed.'.format(path))
+        with open(path, 'rb') as raw:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            with tarfile.open(fileobj=reader, mode='r|') as tf:
+                for member in tf:
+                    name = os.path.normpath(member.name)
+                    if member.isfile() and name in names:
+                        yield (name, tf.extractfile(member), member.size)
+    else:
+        with zipfile.ZipFile(path) as zf:
+            for info in zf.infolist():
+                name = os.path.normpath(info.filename)
+                if not info.is_dir() and name in names:
+                    with zf.open(info) as member:
+                        yield (name, member, info.file_size)
+
+
+def previous_manifest(old_zip, schema):
+    """ Reads the list of loci in a previous compressed
+        version of a schema.
+
+        Parameters
+        ----------
+        old_zip : str
+            Path to the previous compressed version.
+        schema : list
+            One of the sublists with data about a schema returned
+            by the :py:func:`compress_determiner` function.
+
+        Returns
+        -------
+        manifest : dict
+            A dictionary with the compression date, the schema
+            parameters and the name and number of alleles of
+            each locus in the compressed version. None if the
+            compressed version has no list of loci (created by
+            a previous version of this module), cannot be read
+            or was created with different parameters.
+    """
+
+    manifest = None
+    try:
+        for name, member, size in archive_members(old_zip, {'.ns_loci'}):
+            manifest = pickle.load(member)
+            break
+    except Exception as e:
+        logging.warning('Could not read list of loci in {0}: {1}'.format(old_zip, e))
+        return None
+
+    if manifest is None:
+        return None
+
+    if manifest.get('params') != schema[2:8]:
+        logging.info('Parameters of schema {0} ({1}) changed since '
+                     'previous compression.'.format(schema[0], schema[-2]))
+        return None
+
+    return manifest
+
+
+def copy_loci(old_zip, loci_names, archive):
+    """ Copies the adapted files of loci from a previous
+        compressed version of a schema to the new version.
+
+        Parameters
+        ----------
+        old_zip : str
+            Path to the previous compressed version.
+        loci_names : list
+            Names of the loci to copy.
+        archive : SchemaArchive
+            The new compressed version.
+
+        Returns
+        -------
+        missing : set
+            Names of the loci that were not copied because
+            the compressed version does not have their files.
+    """
+
+    locus_files = {}
+    for name in loci_names:
+        locus_files['{0}.fasta'.format(name)] = name
+        locus_files[os.path.join('short', '{0}_short.fasta'.format(name))] = name
+
+    copied = set()
+    for name, member, size in archive_members(old_zip, set(locus_files)):
+        archive.add_stream(name, member, size)
+        copied.add(name)
+
+    missing = {locus_files[f] for f in locus_files if f not in copied}
+
+    return missing
+
+
+def add_adapted(output_directory, archive):
+    """ Moves the files created by PrepExternalSchema to
+        the compressed version of a schema.
+
+        Parameters
+        ----------
+        output_directory : str
+            Path to the directory with the adapted loci.
+        archive : SchemaArchive
+            The compressed version of the schema.
+    """
+
+    written = set(archive.names)
+    short_directory = os.path.join(output_directory, 'short')
+    for directory, prefix in ((output_directory, ''), (short_directory, 'short')):
+        for file in os.listdir(directory):
+            path = os.path.join(directory, file)
+            if not file.endswith('.fasta') or not os.path.isfile(path):
+                continue
+            # loci partially copied from the previous version
+            # keep the copied files
+            arcname = os.path.join(prefix, file)
+            if arcname not in written:
+                archive.add_file(path, arcname)
+            os.remove(path)
+
+
+def add_cached(temp_file, key, archive):
+    """ Adds the adapted files of a locus in the adapted
+        loci cache to the compressed version of a schema.
+
+        Parameters
+        ----------
+        temp_file : str
+            Path to the FASTA file with the alleles of the locus.
+        key : str
+            Cache key of the locus.
+        archive : SchemaArchive
+            The compressed version of the schema.
+
+        Returns
+        -------
+        bool
+            True if the locus was in the cache, False otherwise.
+    """
+
+    cached = adapted_cache.get(key)
+    if cached is None:
+        return False
+
+    locus_name = os.path.basename(temp_file).split('.f')[0]
+    archive.add_bytes('{0}.fasta'.format(locus_name), cached[0])
+    archive.add_bytes(os.path.join('short', '{0}_short.fasta'.format(locus_name)),
+                      cached[1])
+
+    return True
+
+
+def cache_adapted(temp_files, keys, output_directory):
+    """ Adds the loci adapted by PrepExternalSchema to the
+        adapted loci cache.
+
+        Parameters
+        ----------
         temp_files : list
-            List of paths to the FASTA files that were created.
+            Paths to the FASTA files that were adapted.
+        keys : dict
+            Cache key of each FASTA file.
+        output_directory : str
+            Path to the directory with the adapted loci.
     """
 
-    # download FASTA sequences and save in temp directory
-    temp_files = []
-    for locus in loci_list:
-        locus_name = locus[0]
-        locus_uri = locus[1]
-        sequences = fasta_sequences(locus_uri, date, local_sparql, virtuoso_graph)
-        if sequences is False:
-            logging.warning('Cannot continue compression '
-                            'process for schema. Could not '
-                            'retrieve sequences for one or more loci.')
-            return False
+    for temp_file in temp_files:
+        # PrepExternalSchema uses the same locus identifier
+        locus_name = os.path.basename(temp_file).split('.f')[0]
+        full_file = os.path.join(output_directory, '{0}.fasta'.format(locus_name))
+        short_file = os.path.join(output_directory, 'short',
+                                  '{0}_short.fasta'.format(locus_name))
+        # loci without valid alleles have no files
+        if os.path.isfile(full_file) and os.path.isfile(short_file):
+            adapted_cache.put(keys[temp_file], full_file, short_file)
+
+
+@contextlib.contextmanager
+def schema_lock(schema_prefix, blocking=False):
+    """ Acquires the compression lock of a schema.
+
+        The lock is a hidden file in the directory with the
+        compressed schemas locked with `flock`, so it is
+        released if the process that holds it is terminated.
+
+        Parameters
+        ----------
+        schema_prefix : str
+            Filename prefix of the compressed version of the schema.
+        blocking : bool
+            True to wait until the lock is released by
+            another process.
+
+        Yields
+        ------
+        bool
+            True if the lock was acquired, False if it is
+            held by another process.
+    """
+
+    lock_file = os.path.join(Config.SCHEMAS_ZIP, '.{0}.lock'.format(schema_prefix))
+    with open(lock_file, 'w') as lf:
+        try:
+            fcntl.flock(lf, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lf, fcntl.LOCK_UN)
+
+
+def schema_alleles(schema_uri, local_sparql, virtuoso_graph):
+    """ Counts the alleles of a schema.
+
+        Parameters
+        ----------
+        schema_uri : str
+            The URI of the schema in the Chewie-NS.
+
+        Returns
+        -------
+        int
+            Number of alleles in the schema, 0 if they
+            could not be counted.
+    """
 
-        fasta_seqs = [(f['allele_id']['value'], f['nucSeq']['value']) for f in sequences]
+    result = aux.get_data(local_sparql,
+                          (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(virtuoso_graph,
+                                                                      schema_uri)))
 
-        fasta_lines = ['>{0}_{1}\n{2}'.format(locus_name, s[0], s[1]) for s in fasta_seqs]
+    try:
+        return int(result['results']['bindings'][0]['nr_alleles']['value'])
+    except Exception:
+        logging.warning('Could not count alleles of schema {0}.'.format(schema_uri))
+        return 0
 
-        fasta_text = '\n'.join(fasta_lines)
 
-        temp_file = '{0}/{1}.fasta'.format(temp_dir, locus_name)
-        temp_files.append(temp_file)
+def job_cores(total_alleles, budget):
+    """ Determines the number of cores used to compress a schema.
+
+        Parameters
+        ----------
+        total_alleles : int
+            Number of alleles in the schema.
+        budget : int
+            Total number of cores available.
 
-        with open(temp_file, 'w') as f:
-            f.write(fasta_text)
+        Returns
+        -------
+        int
+            One core per `COMPRESSOR_ALLELES_PER_CORE`
+            alleles, at least one and at most `budget`.
+    """
 
-    return temp_files
+    cores = math.ceil(total_alleles / Config.COMPRESSOR_ALLELES_PER_CORE)
 
+    return max(1, min(budget, cores))
+
+
+def compress_locked(schema, local_sparql, virtuoso_graph,
+                    incremental=True, cores=None, blocking=False):
+    """ Compresses a schema while holding its compression lock.
+
+        The compressed version is listed again after the lock
+        is acquired, because another process might have
+        updated it after :py:func:`compress_determiner` ran.
+
+        Parameters
+        ----------
+        schema : list
+            One of the sublists with data about a schema returned
+            by the :py:func:`compress_determiner` function.
+        incremental : bool
+            True to reuse the adapted files of the loci that
+            did not change since the previous compression.
+        cores : int
+            Number of processes used to adapt the schema.
+        blocking : bool
+            True to wait if another process is compressing
+            the schema, False to skip the schema.
+
+        Returns
+        -------
+        0 if the compression process completed successfully,
+        1 otherwise.
+    """
 
-def compress_schema(schema, old_zip, local_sparql, virtuoso_graph):
+    with schema_lock(schema[-3], blocking) as locked:
+        if locked is False:
+            logging.warning('{0} ({1}) is already being compressed.'.format(schema[0], schema[-2]))
+            return 1
+
+        current = aux.compressed_versions(os.listdir(Config.SCHEMAS_ZIP), schema[-3])
+        # remove versions left by compressions interrupted
+        # after the new version was renamed
+        for f in current[:-1]:
+            os.remove(os.path.join(Config.SCHEMAS_ZIP, f))
+
+        old_zip = None
+        if len(current) > 0:
+            if aux.archive_date(current[-1]) == schema[1]:
+                logging.info('{0} ({1}) is up-to-date.'.format(schema[0], schema[-2]))
+                return 0
+            old_zip = os.path.join(Config.SCHEMAS_ZIP, current[-1])
+
+        return compress_schema(schema, old_zip, local_sparql, virtuoso_graph,
+                               incremental, cores)
+
+
+def compress_schema(schema, old_zip, local_sparql, virtuoso_graph, incremental=True,
+                    cores=None):
     """ Generates a compressed version of a schema that is in
         the Chewie-NS.
 
@@ -462,6 +1144,13 @@ def compress_schema(schema, old_zip, local_sparql, virtuoso_graph):
         old_zip : str
             Path to the outdated compressed version of the schema
             (None if there is no compressed version).
+        incremental : bool
+            True to reuse the adapted files of the loci that
+            did not change since the previous compression.
+        cores : int
+            Number of processes used to adapt the schema.
+            Uses the value of `COMPRESSOR_CORES` in the
+            configuration if it is None.
 
         Returns
         -------
@@ -469,6 +1158,7 @@ def compress_schema(schema, old_zip, local_sparql, virtuoso_graph):
         1 otherwise.
     """
 
+    cores = cores or Config.COMPRESSOR_CORES
     schema_ptf_path = os.path.join(Config.SCHEMAS_PTF, schema[5])
     if os.path.isfile(schema_ptf_path) is False:
         logging.warning('Could not find training file for schema {0} ({1}).'
@@ -480,58 +1170,134 @@ def compress_schema(schema, old_zip, local_sparql, virtuoso_graph):
         logging.info('Could not retrieve loci for {0} ({1}).'.format(schema[0], schema[-2]))
         return 1
 
-    # create temp folder
-    temp_dir = os.path.join(Config.SCHEMAS_ZIP, '{0}_temp'.format(schema[-3]))
-    os.mkdir(temp_dir)
+    manifest = None
+    if incremental is True and old_zip is not None:
+        manifest = previous_manifest(old_zip, schema)
 
-    logging.info('Downloading Fasta files for schema {0} ({1})'.format(schema[0], schema[-2]))
-    temp_files = create_fasta(loci_list, schema[1], temp_dir, local_sparql, virtuoso_graph)
-    if temp_files is False:
-        shutil.rmtree(temp_dir)
+    # count alleles per locus, the counts are stored in the new
+    # compressed version to detect loci with deleted alleles
+    previous_date = manifest['date'] if manifest is not None else schema[1]
+    changes = loci_changes(schema[0], schema[1], previous_date,
+                           local_sparql, virtuoso_graph)
+    if changes is None:
         return 1
 
-    # run PrepExternalSchema
-    logging.info('Adapting schema {0} ({1})'.format(schema[0], schema[-2]))
-    output_directory = os.path.join(Config.SCHEMAS_ZIP, '{0}_{1}'.format(schema[-3], schema[1]))
-    adapted = PrepExternalSchema.main(temp_dir, output_directory, 6,
-                                      float(schema[2]), 0,
-                                      int(schema[4]), schema[5],
-                                      None, os.path.join('/app', logfile))
-
-    if adapted is True:
-        # copy training file to schema directory
-        ptf_basename = '{0}.trn'.format(schema[-4])
-        ptf_file = os.path.join(output_directory, ptf_basename)
-        shutil.copy(schema_ptf_path, ptf_file)
-
-        # write schema config file
-        schema_config = aux.write_schema_config(schema[2], schema[5],
-                                                schema[4], schema[3],
-                                                schema[7], schema[6],
-                                                output_directory)
-
-        # write config file with schema last modification date
-        ns_config = os.path.join(output_directory, '.ns_config')
-        with open(ns_config, 'wb') as nc:
+    # create temp folder for the FASTA files and adapted loci
+    # directories left by interrupted compressions are removed,
+    # the schema lock guarantees that no other process uses them
+    temp_dir = os.path.join(Config.SCHEMAS_ZIP, '{0}_temp'.format(schema[-3]))
+    if os.path.isdir(temp_dir):
+        shutil.rmtree(temp_dir)
+    output_directory = os.path.join(temp_dir, 'adapted')
+    aux.create_directory(os.path.join(output_directory, 'short'))
+
+    extension, level = archive_format()
+    archive_name = '{0}_{1}{2}'.format(schema[-3], schema[1], extension)
+    archive = None
+    downloads = None
+    adapted = True
+    try:
+        archive = SchemaArchive(os.path.join(Config.SCHEMAS_ZIP, archive_name),
+                                os.path.join(temp_dir, archive_name + '.part'),
+                                level)
+
+        # write list of loci used to update the compressed version
+        # first, so that it is read without reading the other files
+        loci_info = {'date': schema[1],
+                     'params': schema[2:8],
+                     'loci': {l[1]: [l[0], changes.get(l[1], [0, 0])[0]]
+                              for l in loci_list}}
+        archive.add_bytes('.ns_loci', pickle.dumps(loci_info))
+        archive.add_directory('short')
+
+        # reuse loci with the same name and alleles as in the previous version
+        to_adapt = loci_list
+        if manifest is not None:
+            unchanged = [l for l in loci_list
+                         if manifest['loci'].get(l[1]) == [l[0], changes.get(l[1], [0, 0])[0]]
+                         and changes.get(l[1], [0, 0])[1] == 0]
+            missing = copy_loci(old_zip, [l[0] for l in unchanged], archive)
+            to_adapt = [l for l in loci_list if l not in unchanged or l[0] in missing]
+            logging.info('Reused {0} loci from previous compressed version of schema '
+                         '{1} ({2})'.format(len(loci_list)-len(to_adapt), schema[0], schema[-2]))
+
+        # loci in the adapted loci cache are added to the archive, the
+        # other loci are adapted in batches while the remaining loci
+        # are downloaded and each batch is added to the archive
+        logging.info('Downloading and adapting {0} loci of schema '
+                     '{1} ({2})'.format(len(to_adapt), schema[0], schema[-2]))
+        params = adapt_params(schema)
+        batch = []
+        keys = {}
+        hits = 0
+        downloads = download_fasta(to_adapt, schema[1], temp_dir,
+                                   local_sparql, virtuoso_graph)
+        for temp_file in itertools.chain(downloads, [None]):
+            if temp_file is not None:
+                keys[temp_file] = adapted_cache.locus_key(temp_file, params)
+                if add_cached(temp_file, keys[temp_file], archive):
+                    os.remove(temp_file)
+                    hits += 1
+                    continue
+                batch.append(temp_file)
+            if len(batch) == Config.COMPRESSOR_ADAPT_BATCH_SIZE \
+                    or (temp_file is None and len(batch) > 0):
+                adapted = adapt_fasta(batch, temp_dir, output_directory, schema, cores)
+                if adapted is not True:
+                    break
+                cache_adapted(batch, keys, output_directory)
+                add_adapted(output_directory, archive)
+                for f in batch:
+                    os.remove(f)
+                batch = []
+        logging.info('Got {0} of {1} adapted loci of schema {2} ({3}) from the '
+                     'adapted loci cache'.format(hits, len(to_adapt), schema[0], schema[-2]))
+
+        if adapted is True:
+            # copy training file to schema archive
+            ptf_basename = '{0}.trn'.format(schema[-4])
+            archive.add_file(schema_ptf_path, ptf_basename)
+
+            # write schema config file
+            schema_config = aux.write_schema_config(schema[2], schema[5],
+                                                    schema[4], schema[3],
+                                                    schema[7], schema[6],
+                                                    temp_dir)
+            archive.add_file(schema_config[1], '.schema_config')
+
+            # write config file with schema last modification date
             ns_info = [schema[1], schema[0]]
-            pickle.dump(ns_info, nc)
+            archive.add_bytes('.ns_config', pickle.dumps(ns_info))
 
-        # create hidden file with genes/loci list
-        genes_list_file = aux.write_gene_list(output_directory)
+            # create hidden file with genes/loci list
+            genes_list = [f for f in archive.names
+                          if f.endswith('.fasta') and os.path.dirname(f) == '']
+            archive.add_bytes('.genes_list', pickle.dumps(genes_list))
 
-        # remove old zip archive
-        if old_zip is not None:
-            os.remove(old_zip)
-
-        # compress new version
-        shutil.make_archive(output_directory, 'zip', output_directory)
-
-    elif adapted is not True:
-        logging.warning('Could not adapt {0} ({1}).'.format(schema[0], schema[-2]))
+            # new version replaces the old version atomically
+            archive.commit()
+            if old_zip is not None and old_zip != archive.path:
+                os.remove(old_zip)
+        else:
+            logging.warning('Could not adapt {0} ({1}).'.format(schema[0], schema[-2]))
+    except Exception as e:
+        logging.warning('Cannot continue compression process for schema '
+                        '{0} ({1}). {2}'.format(schema[0], schema[-2], e))
+        adapted = False
+    finally:
+        # stop downloads before removing the FASTA files
+        if downloads is not None:
+            downloads.close()
+        if adapted is not True and archive is not None:
+            archive.discard()
+        # remove temp directories and files
+        shutil.rmtree(temp_dir)
 
-    # remove temp directories and files
-    shutil.rmtree(temp_dir)
-    shutil.rmtree(output_directory)
+    if adapted is True:
+        removed, freed = adapted_cache.prune()
+        if removed > 0:
+            logging.info('Removed {0} loci ({1} bytes) from the adapted '
+                         'loci cache'.format(removed, freed))
 
     return 0 if adapted is True else 1
 
@@ -589,14 +1355,93 @@ def parse_arguments():
                         default=os.environ.get('VIRTUOSO_PASS'),
                         help='')
 
+    parser.add_argument('--full', action='store_true',
+                        dest='full', required=False,
+                        help='Adapt all loci of outdated schemas '
+                             'instead of reusing the loci that did '
+                             'not change since the previous compressed '
+                             'version.')
+
+    parser.add_argument('--cpu', type=int, default=None,
+                        dest='cpu_cores', required=False,
+                        help='Number of cores used to adapt a schema in '
+                             'the "single" mode or to adapt all schemas '
+                             'in the "global" mode. Uses the '
+                             'COMPRESSOR_CPU_BUDGET by default.')
+
     args = parser.parse_args()
 
     return [args.mode, args.species_id, args.schema_id,
             args.virtuoso_graph, args.local_sparql, args.base_url,
-            args.virtuoso_user, args.virtuoso_pass]
+            args.virtuoso_user, args.virtuoso_pass, args.full,
+            args.cpu_cores]
 
 
-def global_compressor(graph, sparql, base_url):
+def schedule_compression(to_compress, sparql, graph, full=False, budget=None):
+    """ Compresses several schemas at the same time within
+        the `COMPRESSOR_CPU_BUDGET`.
+
+        Schemas are sorted by decreasing number of alleles
+        and each schema is started as soon as there are
+        enough free cores for it.
+
+        Parameters
+        ----------
+        to_compress : list
+            Sublists with data about the schemas to compress
+            returned by the :py:func:`compress_determiner` function.
+        full : bool
+            True to adapt all loci of the schemas.
+        budget : int
+            Total number of cores. Uses the value of
+            `COMPRESSOR_CPU_BUDGET` in the configuration
+            if it is None.
+    """
+
+    budget = budget or Config.COMPRESSOR_CPU_BUDGET
+    jobs = []
+    for schema in to_compress:
+        total_alleles = schema_alleles(schema[0], sparql, graph)
+        jobs.append((job_cores(total_alleles, budget), total_alleles, schema))
+    jobs.sort(key=lambda j: j[1], reverse=True)
+
+    free = budget
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        while len(jobs) > 0 or len(running) > 0:
+            # start the largest schemas that fit in the free cores
+            for job in list(jobs):
+                if job[0] <= free:
+                    cores, total_alleles, schema = job
+                    logging.info('Compressing schema {0} ({1}, {2} alleles) with {3} '
+                                 'cores'.format(schema[0], schema[-2], total_alleles, cores))
+                    future = executor.submit(compress_locked, schema, sparql,
+                                             graph, not full, cores)
+                    running[future] = job
+                    jobs.remove(job)
+                    free -= cores
+
+            done, pending = concurrent.futures.wait(running,
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                cores, total_alleles, schema = running.pop(future)
+                free += cores
+                try:
+                    response = future.result()
+                except Exception as e:
+                    logging.warning('Compression of schema {0} ({1}) raised an '
+                                    'exception: {2}'.format(schema[0], schema[-2], e))
+                    response = 1
+
+                if response == 0:
+                    logging.info('Successfully compressed schema {0} '
+                                 '({1})'.format(schema[0], schema[-2]))
+                else:
+                    logging.info('Could not compress schema {0} '
+                                 '({1})'.format(schema[0], schema[-2]))
+
+
+def global_compressor(graph, sparql, base_url, full=False, cores=None):
     """ Determines which schemas need to be compressed and generates
         compressed versions of those schemas.
     """
@@ -658,7 +1503,6 @@ def global_compressor(graph, sparql, base_url):
             del(old_zips[s[0]])
 
     to_compress = [s for s in to_compress if s[0] not in locked]
-    old_zips = {f: os.path.join(Config.SCHEMAS_ZIP, z) if z is not None else None for f, z in old_zips.items()}
 
     if len(to_compress) == 0:
         logging.info('No schemas to update.\n\n')
@@ -668,22 +1512,15 @@ def global_compressor(graph, sparql, base_url):
         logging.info('Schemas to compress: {0}'.format(';'.join(schemas)))
 
     # for each schema: get loci, download FASTA to temp folder, apply PrepExternalSchema and compress
-    for schema in to_compress:
-
-        response = compress_schema(schema, old_zips[schema[0]], sparql, graph)
-        if response == 0:
-            logging.info('Successfully compressed schema {0} '
-                         '({1})'.format(schema[0], schema[-2]))
-        else:
-            logging.info('Could not compress schema {0} '
-                         '({1})'.format(schema[0], schema[-2]))
+    schedule_compression(to_compress, sparql, graph, full, cores)
 
     end_date = dt.datetime.now()
     end_date_str = dt.datetime.strftime(end_date, '%Y-%m-%dT%H:%M:%S')
     logging.info('Finished global compressor at: {0}\n\n'.format(end_date_str))
 
 
-def single_compressor(species_id, schema_id, graph, sparql, base_url, user, password):
+def single_compressor(species_id, schema_id, graph, sparql, base_url, user, password,
+                      full=False, cores=None):
     """ Determines if a schema needs to be compressed and
         generates a compressed version if needed.
     """
@@ -693,7 +1530,7 @@ def single_compressor(species_id, schema_id, graph, sparql, base_url, user, pass
 
     # check if species exists
     species_uri = '{0}species/{1}'.format(base_url, species_id)
-    species_result = aux.get_data(SPARQLWrapper(sparql),
+    species_result = aux.get_data(sparql,
                                   sq.SELECT_SINGLE_SPECIES.format(graph, species_uri))
     result_data = species_result['results']['bindings']
 
@@ -708,7 +1545,7 @@ def single_compressor(species_id, schema_id, graph, sparql, base_url, user, pass
     # get schema info
     # construct schema URI
     schema_uri = '{0}/schemas/{1}'.format(species_uri, schema_id)
-    schema_info = aux.get_data(SPARQLWrapper(sparql),
+    schema_info = aux.get_data(sparql,
                                (sq.SELECT_SPECIES_SCHEMA.format(graph, schema_uri)))
 
     schema_properties = schema_info['results']['bindings']
@@ -736,7 +1573,7 @@ def single_compressor(species_id, schema_id, graph, sparql, base_url, user, pass
         logging.info('Schema to compress: {0}'.format(';'.join(schemas)))
 
     # check if schema is locked
-    schema_lock = aux.get_data(SPARQLWrapper(sparql),
+    schema_lock = aux.get_data(sparql,
                                (sq.ASK_SCHEMA_LOCK.format(schema_uri)))
 
     lock_status = schema_lock['boolean']
@@ -750,11 +1587,14 @@ def single_compressor(species_id, schema_id, graph, sparql, base_url, user, pass
             sys.exit(1)
 
     single_schema_name = to_compress[0][-2]
-    if old_zip[schema_uri] is not None:
-        old_zip[schema_uri] = os.path.join(Config.SCHEMAS_ZIP, old_zip[schema_uri])
 
     # adapt and compress schema
-    response = compress_schema(to_compress[0], old_zip[schema_uri], sparql, graph)
+    # waits if the schema is being compressed by another process
+    if cores is None:
+        cores = job_cores(schema_alleles(schema_uri, sparql, graph),
+                          Config.COMPRESSOR_CPU_BUDGET)
+    response = compress_locked(to_compress[0], sparql, graph, incremental=not full,
+                               cores=cores, blocking=True)
     if response == 0:
         logging.info('Successfully compressed schema {0} '
                      '({1})'.format(schema_uri, single_schema_name))
@@ -777,8 +1617,8 @@ if __name__ == '__main__':
     args = parse_arguments()
 
     if args[0] == 'global':
-        global_compressor(args[3], args[4], args[5])
+        global_compressor(args[3], args[4], args[5], args[8], args[9])
     elif args[0] == 'single':
         single_compressor(args[1], args[2], args[3],
                           args[4], args[5], args[6],
-                          args[7])
+                          args[7], args[8], args[9])
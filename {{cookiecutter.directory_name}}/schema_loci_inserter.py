@@ -37,10 +37,9 @@ import threading
 import concurrent.futures
 from itertools import repeat
 
-from SPARQLWrapper import SPARQLWrapper
-
+from app.utils import id_allocator
+from app.utils import query_cache as qc
 from app.utils import sparql_queries as sq
-from app.utils import auxiliary_functions as aux
 
 
 logfile = './log_files/schema_loci_inserter.log'
@@ -311,7 +310,8 @@ def species_link_queries(loci_data, schema_hashes, species_uri, virtuoso_graph):
     return [link_queries, link]
 
 
-def schema_link_queries(loci_data, schema_hashes, schema_uri, virtuoso_graph):
+def schema_link_queries(loci_data, schema_hashes, schema_uri, virtuoso_graph,
+                        start_id=1):
     """ Creates SPARQL queries to loci loci to a schema.
 
         Parameters
@@ -331,6 +331,8 @@ def schema_link_queries(loci_data, schema_hashes, schema_uri, virtuoso_graph):
             to the schema.
         schema_uri : str
             The schema URI in the Chewie-NS.
+        start_id : int
+            The starting identifier for new schema parts.
 
         Returns
         -------
@@ -344,7 +346,7 @@ def schema_link_queries(loci_data, schema_hashes, schema_uri, virtuoso_graph):
 
     link = 0
     link_queries = []
-    schema_part_id = 1
+    schema_part_id = start_id
     for l in loci_data:
         sc_link = schema_hashes[l[1]][1][2]
         if sc_link is False:
@@ -474,19 +476,6 @@ def main(temp_dir, graph, sparql, base_url, user, password):
                         'Aborting\n\n'.format(loci_file))
         sys.exit(1)
 
-    # determine locus with highest identifier
-    result = aux.get_data(SPARQLWrapper(sparql),
-                          (sq.SELECT_HIGHEST_LOCUS.format(graph)))
-
-    highest_locus = result['results']['bindings']
-    # if there are no loci
-    if highest_locus != []:
-        highest_locus = highest_locus[0]['locus']['value']
-        highest_id = int(highest_locus.split('/')[-1])
-        start_id = highest_id + 1
-    elif highest_locus == []:
-        start_id = 1
-
     # define path to file with schema upload status data
     hashes_file = os.path.join(temp_dir,
                                '{0}_{1}_hashes'.format(species_id, schema_id))
@@ -499,7 +488,15 @@ def main(temp_dir, graph, sparql, base_url, user, password):
         logging.warning('Could not find schema upload status file. Aborting.\n\n')
         sys.exit(1)
 
-    # assign identifiers to new loci based on the total number of loci in the Chewie-NS
+    # reserve identifiers for the loci that were not inserted
+    new_loci = len([l for l in loci_data if schema_hashes[l[1]][1][0] is False])
+    try:
+        start_id = id_allocator.reserve_loci(sparql, graph, new_loci) if new_loci > 0 else None
+    except id_allocator.AllocationError as e:
+        logging.error('{0} Aborting.\n\n'.format(e))
+        sys.exit(1)
+
+    # assign identifiers to new loci from the reserved block
     response, hash_to_uri, loci_data, = assign_identifiers(loci_data, schema_hashes,
                                                            loci_prefix, start_id,
                                                            base_url)
@@ -508,11 +505,11 @@ def main(temp_dir, graph, sparql, base_url, user, password):
     insert_queries, insert = create_insert_queries(loci_data, schema_hashes, graph)
     logging.info('{0} loci to insert out of {1} total loci '
                  'in schema.'.format(insert, len(loci_data)))
-    logging.info('Loci integer identifiers interval: [{0} .. {1}]'
-                 ''.format(start_id, start_id+insert))
 
     # insert data to create loci
     if len(insert_queries) > 0:
+        logging.info('Loci integer identifiers interval: [{0} .. {1}]'
+                     ''.format(start_id, start_id+insert-1))
         loci_insertion = send_queries(insert_queries, sparql, user, password)
         insert_status, success, failed = results_status(loci_insertion)
 
@@ -553,11 +550,19 @@ def main(temp_dir, graph, sparql, base_url, user, password):
         logging.info('Successfully linked {0} loci to species. '
                      'Failed {1}'.format(success, failed))
 
-    # link loci to schema
+    # link loci to schema, parts identifiers continue after existing parts
+    unlinked = len([l for l in loci_data if schema_hashes[l[1]][1][2] is False])
+    try:
+        part_id = id_allocator.reserve_schema_parts(sparql, graph, schema_uri,
+                                                    unlinked) if unlinked > 0 else None
+    except id_allocator.AllocationError as e:
+        logging.error('{0} Aborting.\n\n'.format(e))
+        sys.exit(1)
     sc_queries, link = schema_link_queries(loci_data,
                                            schema_hashes,
                                            schema_uri,
-                                           graph)
+                                           graph,
+                                           part_id)
 
     logging.info('{0} loci to link to schema out of {1} total loci '
                  'in schema.'.format(link, len(loci_data)))
@@ -576,6 +581,8 @@ def main(temp_dir, graph, sparql, base_url, user, password):
         logging.info('Successfully linked {0} loci to schema. '
                      'Failed {1}'.format(success, failed))
 
+    qc.invalidate(schema_uri)
+
     # save updated schema hashes
     with open(hashes_file, 'wb') as hf:
         pickle.dump(schema_hashes, hf)
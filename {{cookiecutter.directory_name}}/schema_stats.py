@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+
+This module is used by the Chewie-NS to create and update the
+pre-computed statistics files used by the frontend (loci and
+alleles totals, number of alleles per locus, allele length modes,
+loci annotations and allele length boxplots).
+
+The allele lengths and schema metadata are loaded once per schema
+and all outdated files are updated in a single pass. The scripts
+that insert alleles call `app.utils.stats_engine` directly.
+
+Expected input
+--------------
+
+It is necessary to specify the execution mode through the
+following argument:
+
+- ``-m``, ``mode`` :
+
+    - ``global_species`` updates the files of all schemas.
+    - ``single_species`` updates the files of all schemas of
+      the species specified with ``--sp``.
+    - ``single_schema`` updates the files of the schema
+      specified with ``--sp`` and ``--sc``.
+
+- ``--sp``, ``species_id`` :
+
+    - e.g.: ``1``
+
+- ``--sc``, ``schema_id`` :
+
+    - e.g.: ``1``
+
+- ``--o``, ``outputs`` :
+
+    - e.g.: ``mode boxplot`` (all files by default)
+
+- ``--f``, ``force`` :
+
+    - update files that are up-to-date.
+
+- ``--w``, ``workers`` :
+
+    - number of schemas updated concurrently in the
+      ``global_species`` and ``single_species`` modes
+      (``STATS_WORKERS`` by default).
+
+The Virtuoso graph, SPARQL endpoint and base URL are read from the
+environment by default (``--g``, ``--s`` and ``--b``).
+
+Code documentation
+------------------
+"""
+
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+from app.utils import stats_engine
+
+
+logfile = './log_files/schema_stats.log'
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                    datefmt='%Y-%m-%dT%H:%M:%S',
+                    filename=logfile)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-m', type=str,
+                        dest='mode', required=True,
+                        choices=['global_species', 'single_species', 'single_schema'],
+                        help='Execution mode.')
+
+    parser.add_argument('--sp', type=str, required=False,
+                        default=None, dest='species_id',
+                        help='The identifier of the species in the Chewie-NS.')
+
+    parser.add_argument('--sc', type=str, required=False,
+                        default=None, dest='schema_id',
+                        help='The identifier of the schema in the Chewie-NS.')
+
+    parser.add_argument('--g', type=str,
+                        dest='virtuoso_graph',
+                        default=os.environ.get('DEFAULTHGRAPH'),
+                        help='Name of the Virtuoso graph.')
+
+    parser.add_argument('--s', type=str,
+                        dest='local_sparql',
+                        default=os.environ.get('LOCAL_SPARQL'),
+                        help='URL of the SPARQL endpoint.')
+
+    parser.add_argument('--b', type=str,
+                        dest='base_url',
+                        default=os.environ.get('BASE_URL'),
+                        help='Base URL of the Chewie-NS.')
+
+    parser.add_argument('--o', type=str, nargs='+', required=False,
+                        default=list(stats_engine.OUTPUTS), dest='outputs',
+                        choices=stats_engine.OUTPUTS,
+                        help='Statistics files to update.')
+
+    parser.add_argument('--f', action='store_true', required=False,
+                        dest='force',
+                        help='Update files that are up-to-date.')
+
+    parser.add_argument('--w', type=int, required=False,
+                        default=None, dest='workers',
+                        help='Number of schemas updated concurrently.')
+
+    args = parser.parse_args()
+
+    return [args.mode, args.species_id, args.schema_id,
+            args.virtuoso_graph, args.local_sparql,
+            args.base_url, args.outputs, args.force,
+            args.workers]
+
+
+def main(mode, species_id, schema_id, virtuoso_graph, local_sparql,
+         base_url, outputs, force, workers):
+
+    start = time.time()
+    logging.info('Started statistics update in {0} mode.'.format(mode))
+
+    if mode == 'global_species':
+        updated = stats_engine.global_species(virtuoso_graph, local_sparql,
+                                              base_url, outputs, force,
+                                              workers)
+    elif mode == 'single_species':
+        updated = stats_engine.single_species(species_id, virtuoso_graph,
+                                              local_sparql, base_url,
+                                              outputs, force, workers)
+    elif mode == 'single_schema':
+        updated = stats_engine.single_schema(species_id, schema_id,
+                                             virtuoso_graph, local_sparql,
+                                             base_url, outputs, force=force)
+        if updated is False:
+            sys.exit(1)
+
+    logging.info('Finished statistics update in {0:.1f}s.'.format(time.time() - start))
+
+    # other schemas were updated but the failures must be reported
+    if mode != 'single_schema' and None in updated.values():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    args = parse_arguments()
+
+    main(args[0], args[1], args[2], args[3],
+         args[4], args[5], args[6], args[7],
+         args[8])
@@ -37,9 +37,12 @@ import datetime as dt
 import concurrent.futures
 from itertools import repeat
 from collections import Counter
-from SPARQLWrapper import SPARQLWrapper
 
 from config import Config
+from app.utils import id_allocator
+from app.utils import query_cache as qc
+from app.utils import stats_engine
+from app.utils import sequence_index
 from app.utils import sparql_queries as sq
 from app.utils import auxiliary_functions as aux
 
@@ -76,21 +79,21 @@ def fasta_sequences(locus, local_sparql, virtuoso_graph):
 
     # setting [SPARQL] ResultSetMaxRows = 400000 in virtuoso.ini
     # is important to return all sequences at once
-    fasta_result = aux.get_data(SPARQLWrapper(local_sparql),
+    fasta_result = aux.get_data(local_sparql,
                                 (sq.SELECT_LOCUS_FASTA.format(virtuoso_graph, locus)))
 
     # virtuoso returned an error because request length exceeded maximum value of Temp Col
-    # get each allele separately
+    # get the sequence hashes and then the sequences in batches
     try:
         fasta_seqs = fasta_result['results']['bindings']
     # virtuoso returned an error
     # probably because sequence/request length exceeded maximum value
     except:
         logging.warning('Could not retrieve FASTA records for locus {0}\n'
-                        'Response content:\n{1}\nTrying to get each sequence '
-                        'separately...\n'.format(locus, fasta_result))
-        # get each allele separately
-        result = aux.get_data(SPARQLWrapper(local_sparql),
+                        'Response content:\n{1}\nTrying to get sequences '
+                        'in batches...\n'.format(locus, fasta_result))
+        # get the sequence hashes and then the sequences in batches
+        result = aux.get_data(local_sparql,
                               (sq.SELECT_LOCUS_SEQS.format(virtuoso_graph, locus)))
         try:
             fasta_seqs = result['results']['bindings']
@@ -102,16 +105,16 @@ def fasta_sequences(locus, local_sparql, virtuoso_graph):
                             'for locus {0}.'.format(locus))
             return False
 
-        total = 0
-        hashes = []
-        for s in range(len(fasta_seqs)):
-            # get the sequence corresponding to the hash
-            result2 = aux.get_data(SPARQLWrapper(local_sparql),
-                                   (sq.SELECT_SEQ_FASTA.format(virtuoso_graph, fasta_seqs[s]['sequence']['value'])))
-            hashes.append(fasta_seqs[s]['sequence']['value'])
-
-            fasta_seqs[s]['nucSeq'] = result2['results']['bindings'][0]['nucSeq']
-            total += 1
+        # get the sequences corresponding to the hashes in batches
+        try:
+            sequences = aux.get_sequences(local_sparql, virtuoso_graph,
+                                          [f['sequence']['value'] for f in fasta_seqs])
+            for f in fasta_seqs:
+                f['nucSeq'] = sequences[f['sequence']['value']]
+        except Exception as e:
+            logging.warning('Could not retrieve sequences '
+                            'for locus {0}: {1}'.format(locus, e))
+            return False
 
     return fasta_seqs
 
@@ -139,6 +142,8 @@ def change_date(schema_uri, date_type, date_value, virtuoso_graph, local_sparql,
                                    virtuoso_user,
                                    virtuoso_pass)
 
+    qc.invalidate(schema_uri)
+
 
 def change_lock(schema_uri, action, virtuoso_graph, local_sparql, virtuoso_user, virtuoso_pass):
     """
@@ -162,6 +167,8 @@ def change_lock(schema_uri, action, virtuoso_graph, local_sparql, virtuoso_user,
                                     virtuoso_user,
                                     virtuoso_pass)
 
+    qc.invalidate(schema_uri)
+
 # def change_schema_version(schema_uri, schema_version, virtuoso_graph, local_sparql, virtuoso_user, virtuoso_pass):
 # 	"""
 # 	"""
@@ -190,6 +197,7 @@ def create_single_insert(alleles, species, locus_uri, user_uri, start_id, base_u
     """
 
     queries = []
+    entries = []
     allele_id = start_id
     for a in alleles:
         sequence = a
@@ -207,11 +215,12 @@ def create_single_insert(alleles, species, locus_uri, user_uri, start_id, base_u
                                                       locus_uri, insert_date,
                                                       allele_id))
         queries.append(query)
+        entries.append([(seq_uri, allele_uri)])
         attributed[sequence_hash] = allele_id
 
         allele_id += 1
 
-    return [queries, attributed]
+    return [queries, attributed, entries]
 
 
 def create_multiple_insert(alleles, species, locus_uri, user_uri, start_id, base_url, virtuoso_graph, attributed):
@@ -219,8 +228,10 @@ def create_multiple_insert(alleles, species, locus_uri, user_uri, start_id, base
     """
 
     queries = []
+    entries = []
     allele_id = start_id
     allele_set = []
+    query_entries = []
     max_alleles = 100
     for i, a in enumerate(alleles):
         sequence = a
@@ -241,16 +252,19 @@ def create_multiple_insert(alleles, species, locus_uri, user_uri, start_id, base
                                                      '<{0}>'.format(locus_uri),
                                                      '"{0}"^^xsd:dateTime'.format(insert_date),
                                                      '"{0}"^^xsd:integer'.format(allele_id)))
+        query_entries.append((seq_uri, allele_uri))
         attributed[sequence_hash] = allele_id
 
         if len(allele_set) == max_alleles or i == (len(alleles)-1):
             query = (sq.MULTIPLE_INSERT_NEW_SEQUENCE.format(virtuoso_graph, ' '.join(allele_set)))
             queries.append(query)
+            entries.append(query_entries)
             allele_set = []
+            query_entries = []
 
         allele_id += 1
 
-    return [queries, attributed]
+    return [queries, attributed, entries]
 
 
 def create_queries(locus_file, virtuoso_graph, local_sparql, base_url):
@@ -268,15 +282,6 @@ def create_queries(locus_file, virtuoso_graph, local_sparql, base_url):
     sequences = fasta_sequences(locus_url, local_sparql, virtuoso_graph)
     ns_seqs = fasta_seqs = {f['nucSeq']['value']: f['allele_id']['value'] for f in sequences}
 
-    # count number of alleles for locus
-    count_query = (sq.COUNT_LOCUS_ALLELES.format(virtuoso_graph,
-                                                   locus_url))
-
-    count_res = aux.get_data(SPARQLWrapper(local_sparql),
-                                             count_query)
-
-    start_id = int(count_res['results']['bindings'][0]['count']['value']) + 1
-
     spec_name = locus_data[1]
     user_url = locus_data[2]
     alleles = locus_data[3]
@@ -285,19 +290,25 @@ def create_queries(locus_file, virtuoso_graph, local_sparql, base_url):
     
     attributed = {}
     if len(novel) > 0:
+        # reserve identifiers for all novel alleles
+        start_id = id_allocator.reserve_alleles(local_sparql, virtuoso_graph,
+                                                locus_url, len(novel))
+
         max_length = max([len(a) for a in novel])
         if max_length < 7000:
-            queries, attributed = create_multiple_insert(novel, spec_name, locus_url,
-                                                         user_url, start_id, base_url,
-                                                         virtuoso_graph, attributed)
+            queries, attributed, entries = create_multiple_insert(novel, spec_name, locus_url,
+                                                                  user_url, start_id, base_url,
+                                                                  virtuoso_graph, attributed)
         else:
-            queries, attributed = create_single_insert(novel, spec_name, locus_url,
-                                                       user_url, start_id, base_url,
-                                                       virtuoso_graph, attributed)
+            queries, attributed, entries = create_single_insert(novel, spec_name, locus_url,
+                                                                user_url, start_id, base_url,
+                                                                virtuoso_graph, attributed)
 
         queries_file = '{0}_queries'.format(locus_file.split('alleles')[0])
+        # sequence and allele URIs are added to the index
+        # after the query that inserts them succeeds
         with open(queries_file, 'wb') as qf:
-            pickle.dump(queries, qf)
+            pickle.dump(list(zip(queries, entries)), qf)
 
         return [queries_file, locus_id, repeated, attributed]
     else:
@@ -320,7 +331,7 @@ def post_alleles(input_file, local_sparql, virtuoso_user, virtuoso_pass):
     responses = []
     session = get_session()
     headers = {'content-type': 'application/sparql-query'}
-    for d in locus_data:
+    for d, e in locus_data:
         tries = 0
         max_tries = 5
         valid = False
@@ -339,6 +350,7 @@ def post_alleles(input_file, local_sparql, virtuoso_user, virtuoso_pass):
                 else:
                     valid = True
                     responses.append(list(response))
+                    sequence_index.add(e)
 
     return responses
 
@@ -518,7 +530,7 @@ def main(temp_dir, graph, sparql, base_url, user, password, c_user):
     count_schema_loci = (sq.COUNT_SINGLE_SCHEMA_LOCI_ALLELES.format(graph,
                                                 schema_uri))
 
-    count_schema_loci_res = aux.get_data(SPARQLWrapper(sparql),
+    count_schema_loci_res = aux.get_data(sparql,
                                             count_schema_loci)
 
     total_loci = int(count_schema_loci_res["results"]["bindings"][0]["nr_loci"]["value"])
@@ -584,21 +596,12 @@ def main(temp_dir, graph, sparql, base_url, user, password, c_user):
         # 	graph, sparql, user, password)
 
         # create pre-computed frontend files
-        os.system('python schema_totals.py -m single_schema '
-                  '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-                  ''.format(species_id, schema_id, graph, sparql, base_url))
-        os.system('python loci_totals.py -m single_schema '
-                  '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-                  ''.format(species_id, schema_id, graph, sparql, base_url))
-        os.system('python loci_mode.py -m single_schema '
-                  '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-                  ''.format(species_id, schema_id, graph, sparql, base_url))
-        os.system('python annotations.py -m single_schema '
-                  '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-                  ''.format(species_id, schema_id, graph, sparql, base_url))
-        os.system('python loci_boxplot.py -m single_schema '
-                  '--sp {0} --sc {1} --g {2} --s {3} --b {4}'
-                  ''.format(species_id, schema_id, graph, sparql, base_url))
+        try:
+            stats_engine.single_schema(species_id, schema_id, graph,
+                                       sparql, base_url)
+        except Exception:
+            logging.exception('Could not update statistics for schema '
+                              '{0}.'.format(schema_uri))
 
     # unlock schema
     change_lock(schema_uri, 'Unlocked',
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+
+This module is used by the Chewie-NS to rebuild the local
+sequence index with the sequences and alleles in Virtuoso.
+
+The index is kept up to date by the processes that insert and
+delete data, so it only has to be rebuilt when it is created,
+when Virtuoso is restored from a backup or if an update of the
+index failed. The endpoints send their queries to Virtuoso while
+the index is rebuilt.
+
+Expected input
+--------------
+
+The process only receives the arguments needed to reach
+Virtuoso:
+
+- ``--g``, ``virtuoso_graph`` :
+
+    - e.g.: ``http://localhost:8890/chewiens``
+
+- ``--s``, ``local_sparql`` :
+
+    - e.g.: ``http://172.19.1.3:8890/sparql``
+
+Code documentation
+------------------
+"""
+
+
+import os
+import time
+import logging
+import argparse
+
+from app.utils import sequence_index
+
+
+logfile = './log_files/sequence_index_builder.log'
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s %(name)-12s %(levelname)-8s %(message)s',
+                    datefmt='%Y-%m-%dT%H:%M:%S',
+                    filename=logfile)
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('--g', type=str,
+                        dest='virtuoso_graph',
+                        default=os.environ.get('DEFAULTHGRAPH'),
+                        help='')
+
+    parser.add_argument('--s', type=str,
+                        dest='local_sparql',
+                        default=os.environ.get('LOCAL_SPARQL'),
+                        help='')
+
+    parser.add_argument('--ps', type=int,
+                        dest='page_size',
+                        default=10000,
+                        help='Number of rows requested per query.')
+
+    args = parser.parse_args()
+
+    return [args.virtuoso_graph, args.local_sparql, args.page_size]
+
+
+def main(graph, sparql, page_size):
+
+    start = time.time()
+    logging.info('Started rebuilding sequence index at {0}'
+                 ''.format(sequence_index.index.path))
+
+    total = sequence_index.index.rebuild(sparql, graph, page_size)
+
+    delta = time.time() - start
+    print('Added {0} rows to the sequence index in {1:.0f}s.'.format(total, delta))
+    logging.info('Added {0} rows to the sequence index in '
+                 '{1:.0f}s.'.format(total, delta))
+
+
+if __name__ == '__main__':
+
+    args = parse_arguments()
+
+    main(args[0], args[1], args[2])
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Purpose
+-------
+Tests for the store with the allele lengths of a schema.
+
+Code documentation
+------------------
+"""
+
+
+import os
+import pickle
+import threading
+
+from app.utils import lengths_store
+
+
+def write_legacy_file(directory, locus_id, alleles):
+    """ Writes a pickled file of the previous store format. """
+
+    locus_uri = 'http://localhost/NS/api/loci/{0}'.format(locus_id)
+    with open(os.path.join(directory, 'locus_{0}'.format(locus_id)), 'wb') as outfile:
+        pickle.dump({locus_uri: alleles}, outfile)
+
+
+def test_append_migrates_legacy_files(tmp_path):
+    directory = str(tmp_path / '1_1_lengths')
+    os.makedirs(directory)
+    write_legacy_file(directory, 1, {'a1': 100, 'a2': 103})
+
+    store = lengths_store.LengthsStore(directory)
+    added = []
+    # appending must not block on the lock it already holds
+    worker = threading.Thread(target=lambda: added.append(
+        store.append({1: {'a2': 103, 'a3': 106}, 2: {'b1': 90}})), daemon=True)
+    worker.start()
+    worker.join(30)
+
+    assert not worker.is_alive()
+    assert added == [2]
+    assert store.legacy_files() == []
+
+    loci_lengths = store.loci_lengths()
+    assert sorted(loci_lengths[1].tolist()) == [100, 103, 106]
+    assert loci_lengths[2].tolist() == [90]
+    assert store.loci_aggregates()[1]['count'] == 3
+
+
+def test_migrate(tmp_path):
+    directory = str(tmp_path / '1_1_lengths')
+    os.makedirs(directory)
+    write_legacy_file(directory, 1, {'a1': 100})
+    write_legacy_file(directory, 2, {'b1': 90, 'b2': 91})
+
+    store = lengths_store.LengthsStore(directory)
+
+    assert store.migrate() == 2
+    assert store.legacy_files() == []
+    assert store.migrate() == 0
+    assert {k: len(v) for k, v in store.loci_lengths().items()} == {1: 1, 2: 2}